@@ -1,9 +1,26 @@
 # app.py
-import os, io, re, pathlib
+import os, html, json, pathlib
 import numpy as np
 import pandas as pd
 import streamlit as st
 
+from encuesta.anexo import panel_anexo
+from encuesta.armonizar import (
+    MAX_DISTINCT, propose_merges, aplicar_armonizacion, cargar_mapeos, guardar_mapeos,
+)
+from encuesta.codebook import build_value_labels, apply_value_labels
+from encuesta.datos import clean_label, make_unique_columns
+from encuesta.duplicados import POLITICAS, panel_duplicados
+from encuesta.excel import libro_bytes
+from encuesta.geo import coords, panel_mapa, panel_zona
+from encuesta.lexico import cargar_stopwords
+from encuesta.nubes import nube_async
+from encuesta.poligonos import SECTOR_POLIGONO, SECTORES_GEOJSON_PATH, asignar_sector, cargar_poligonos, discrepancias
+from encuesta.tabulados import PLAN, crosstab_pct, indicadores, subset, vc_percent
+from encuesta.textos import dtm_en_disco, huella, kwic
+from encuesta.validacion import validar
+from encuesta.versiones import CLAVES_DEFAULT, versiones_disponibles, diff_versions, tables_shift
+
 st.set_page_config(page_title="Plan de Tabulados — Encuesta", layout="wide")
 
 # ---------- Estilos (tabs más espacios y wrap) ----------
@@ -20,96 +37,6 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# ---------- Convenciones de faltantes ----------
-MISSING_LABELS = {
-    "", "(Sin dato)", "No contestó", "No contesto", "No respondió", "No responde",
-    "No sabe/No responde", "NS/NR", "Ns/Nr", "NSNR", "No aplica", "NA", "N/A",
-    "Sin respuesta", "NR"
-}
-def _is_missing_label(x: str) -> bool:
-    return str(x).strip() in MISSING_LABELS
-
-# ---------- Helpers ----------
-def clean_label(s: str) -> str:
-    s = re.sub(r"\s+", " ", str(s)).strip()
-    rep = {"√≠":"í","√≥":"ó","√±":"ñ","√©":"é","√í":"á","√∫":"ú","###":""}
-    for k,v in rep.items():
-        s = s.replace(k,v)
-    return s
-
-def _make_unique_columns(cols):
-    seen, out = {}, []
-    for c in cols:
-        base = str(c)
-        if base not in seen:
-            seen[base] = 1; out.append(base)
-        else:
-            seen[base] += 1; out.append(f"{base} ({seen[base]})")
-    return out
-
-def _cat(s: pd.Series) -> pd.Series:
-    # convierte a object, rellena NaN a "(Sin dato)" y fuerza str
-    return s.astype("object").where(s.notna(), "(Sin dato)").astype(str)
-
-def vc_percent(df, col, by=None):
-    if col not in df.columns: return pd.DataFrame(columns=[col, "n", "%"])
-    if by is not None and by not in df.columns: by = None
-
-    if by is None:
-        s = _cat(df[col])
-        s = s[~s.isin(MISSING_LABELS)]
-        if s.empty: return pd.DataFrame(columns=[col, "n", "%"])
-        t = s.value_counts(dropna=False).rename_axis(col).reset_index(name="n")
-        total = int(t["n"].sum())
-        t["%"] = (t["n"] / total * 100).round(1) if total else 0
-        return t
-
-    tmp = pd.DataFrame({by: _cat(df[by]), col: _cat(df[col])})
-    tmp = tmp[~tmp[col].isin(MISSING_LABELS)]
-    if tmp.empty: return pd.DataFrame(columns=[by, col, "n", "%"])
-    t = tmp.groupby([by, col], dropna=False).size().rename("n").reset_index()
-    t["%"] = t.groupby(by)["n"].transform(lambda s: (s/s.sum()*100).round(1))
-    return t
-
-def crosstab_pct(df, r, c, by=None):
-    if (r not in df.columns) or (c not in df.columns):
-        return pd.DataFrame()
-
-    if by is None:
-        rr, cc = _cat(df[r]), _cat(df[c])
-        mask = (~rr.isin(MISSING_LABELS)) & (~cc.isin(MISSING_LABELS))
-        rr, cc = rr[mask], cc[mask]
-        if rr.empty or cc.empty: return pd.DataFrame()
-        tab = pd.crosstab(rr, cc, dropna=False)
-        tab.columns = tab.columns.astype(str)
-        tab["n_fila"] = tab.sum(axis=1)
-        pct = (tab.div(tab["n_fila"].replace(0, np.nan), axis=0)*100).round(1)
-        tab = tab.drop(columns=["n_fila"])
-        tab["__tipo__"] = "n"; pct["__tipo__"] = "%"
-        return pd.concat(
-            [tab.reset_index().rename(columns={"index": r}),
-             pct.reset_index().rename(columns={"index": r})],
-            ignore_index=True
-        )
-
-    # con 'by': iterar grupos
-    out = []
-    for g, sub in df.groupby(by):
-        rr, cc = _cat(sub[r]), _cat(sub[c])
-        mask = (~rr.isin(MISSING_LABELS)) & (~cc.isin(MISSING_LABELS))
-        rr, cc = rr[mask], cc[mask]
-        if rr.empty or cc.empty: continue
-        tab = pd.crosstab(rr, cc, dropna=False)
-        tab.columns = tab.columns.astype(str)
-        tab["n_fila"] = tab.sum(axis=1)
-        pct = (tab.div(tab["n_fila"].replace(0, np.nan), axis=0)*100).round(1)
-        tab = tab.drop(columns=["n_fila"])
-        tab["__grupo__"] = str(g); tab["__tipo__"] = "n"
-        pct["__grupo__"] = str(g); pct["__tipo__"] = "%"
-        out.append(tab.reset_index().rename(columns={"index": r}))
-        out.append(pct.reset_index().rename(columns={"index": r}))
-    return pd.concat(out, ignore_index=True) if out else pd.DataFrame()
-
 # ====== NUEVO: Render bonito para cruces (separa n/% y ordena) ======
 def _render_crosstab_pretty(out: pd.DataFrame, r: str):
     """Recibe la salida de crosstab_pct() y la muestra en dos tablas (n y %),
@@ -168,17 +95,8 @@ def _render_crosstab_pretty(out: pd.DataFrame, r: str):
 
 # ---------- Export a Excel ----------
 def export_xlsx(sheets_dict):
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        for sheet, df in sheets_dict.items():
-            if isinstance(df, dict):
-                startrow = 0
-                for name, sub in df.items():
-                    sub.to_excel(writer, index=False, sheet_name=sheet, startrow=startrow)
-                    startrow += len(sub) + 3
-            else:
-                df.to_excel(writer, index=False, sheet_name=sheet)
-    return output.getvalue()
+    # xlsxwriter en streaming (constant_memory) a un temporal; ver encuesta/excel.py
+    return libro_bytes(sheets_dict.items())
 
 # ---------- Carga de datos ----------
 st.sidebar.title("⚙️ Datos")
@@ -217,7 +135,22 @@ if os.path.exists(CODEBOOK_PATH):
         st.warning(f"No se pudo leer Codebook en {CODEBOOK_PATH}. Detalle: {e}")
 
 df = df.rename(columns={c: clean_label(c) for c in df.columns})
-df.columns = _make_unique_columns(df.columns)
+df.columns = make_unique_columns(df.columns)
+
+# ---------- Etiquetas de valor del Codebook (código -> etiqueta) ----------
+usar_etiquetas = st.sidebar.toggle("Aplicar etiquetas del Codebook", value=True, key="cb_labels",
+                                   help="Reemplaza códigos crudos (1, 2, 0…) por su etiqueta del Codebook.")
+etiquetas_cb = build_value_labels(codebook) if codebook is not None else {}
+if etiquetas_cb and usar_etiquetas:
+    df, cb_reporte = apply_value_labels(df, etiquetas_cb)
+    if not cb_reporte.empty:
+        with st.sidebar.expander(f"⚠️ Valores fuera del Codebook ({len(cb_reporte)})"):
+            st.dataframe(cb_reporte, use_container_width=True, hide_index=True)
+
+# ---------- Armonización de categorías (mapeos aprobados) ----------
+df_raw = df
+mapeos_arm = cargar_mapeos()
+df = aplicar_armonizacion(df_raw, mapeos_arm)
 
 # ---------- Mapeo de variables ----------
 st.sidebar.header("🧭 Mapeo de variables")
@@ -285,6 +218,39 @@ p041 = pick("p041 (abierta)", ["p041"])
 p38tx = pick("p38tx (abierta)", ["p38tx","p038tx","p38"])
 p024  = pick("p024 (abierta)",  ["p024"])
 
+# ---------- Sector por polígono (límites oficiales, GeoJSON local opcional) ----------
+@st.cache_data(show_spinner=False, max_entries=4)
+def _sector_poligono_cached(huella_lat: str, huella_lon: str, geojson_mtime: float,
+                            lat_col: str, lon_col: str, _df: pd.DataFrame):
+    lat, lon = coords(_df, lat_col, lon_col)
+    return asignar_sector(lat, lon, cargar_poligonos())
+
+sector_digitado, pol_sectores = sector, []
+if lat_col != "<ninguna>" and lon_col != "<ninguna>":
+    pol_sectores = cargar_poligonos()
+if pol_sectores:
+    df[SECTOR_POLIGONO] = _sector_poligono_cached(huella(df[lat_col]), huella(df[lon_col]),
+                                                  os.path.getmtime(SECTORES_GEOJSON_PATH), lat_col, lon_col, df)
+    if st.sidebar.toggle("Sector según polígono GPS", value=False, key="sector_poligono",
+                         help=f"Usa como SECTOR el polígono de {SECTORES_GEOJSON_PATH} que contiene cada punto."):
+        sector = SECTOR_POLIGONO
+
+# Roles del plan de tabulados -> columna mapeada (motor compartido en encuesta/)
+roles = dict(
+    sector=sector,
+    p004=p004, p005=p005, p006=p006, p007=p007, p008=p008,
+    nviv=nviv, p009a=p009a, p009b=p009b, p010=p010, sexoj=sexoj, p011=p011,
+    sexom=sexom, sexoh=sexoh, sexonh=sexonh, sexonm=sexonm,
+    p012=p012, p013=p013, p014=p014, p022=p022,
+    p015=p015, p016=p016, p017=p017, p018=p018, p019=p019, p020=p020, p021=p021,
+    p025=p025, p026=p026, p027=p027, p028=p028, p029=p029, p030=p030, p031=p031, p032=p032,
+    p035=p035, p035tx=p035tx, p036=p036,
+    lat=lat_col, lon=lon_col,
+)
+
+# ---------- Envíos duplicados (se depuran antes de todas las pestañas) ----------
+df, dup_grupos, politica_dup, dup_n = panel_duplicados(df, roles)
+
 # ---------- Filtro general por sector (multiselect) ----------
 st.sidebar.header("Filtros")
 work = df.copy()
@@ -294,6 +260,9 @@ if sector != "<ninguna>":
     if sel: work = work[work[sector].isin(sel)]
     else:   work = work.iloc[0:0]
 
+# ---------- Zona GPS (índice espacial, una vez por versión de los datos) ----------
+work = panel_zona(df, work, lat_col, lon_col)
+
 # ---------- Vista Totales vs. Sólo un sector (drill-down) ----------
 st.sidebar.header("👁️ Vista de tabulados")
 vista = st.sidebar.radio(
@@ -352,10 +321,10 @@ else:
 st.markdown("---")
 
 # ---------- Tabs ----------
-tabB, tabC, tabD, tabE, tabF, tabG, tabI, tabMAP, tabTXT, tabMANUAL, tabEXPORT = st.tabs([
+tabB, tabC, tabD, tabE, tabF, tabG, tabI, tabMAP, tabTXT, tabARM, tabQA, tabVER, tabMANUAL, tabEXPORT = st.tabs([
     "B — Estructura", "C — Hogares", "D — Socioeconómico", "E — Servicios",
     "F — Negocios", "G — Espacios/Percepción", "I — Indicadores",
-    "Mapa GPS", "Texto (abiertas)", "Manual", "Exportar"
+    "Mapa GPS", "Texto (abiertas)", "Armonización", "Calidad", "Versiones", "Manual", "Exportar"
 ])
 
 # ---- B
@@ -380,16 +349,9 @@ with tabB:
     show_xtab(p004, p008, "p004 × Material piso")
 
 # ---- C
-def is_vivienda_or_mixto(v):
-    if v is None: return False
-    s = str(v).strip().lower()
-    return ("vivienda" in s) or ("mixto" in s) or ("vivienda–negocio" in s) or ("vivienda-negocio" in s)
-
 with tabC:
     st.subheader("BLOQUE C – Hogares (p004 = vivienda o mixto)")
-    sub = view_df.copy()
-    if p004 != "<ninguna>":
-        sub = sub[[True if is_vivienda_or_mixto(v) else False for v in sub[p004]]]
+    sub = subset(view_df, "vivienda", p004)
 
     st.markdown("**Tabulados simples y descriptivos**")
     for col,label in [(nviv,"Nº de hogares (nvivienda)"),
@@ -418,9 +380,7 @@ with tabC:
 # ---- D
 with tabD:
     st.subheader("BLOQUE D – Socioeconómico (p004 = vivienda o mixto)")
-    sub = view_df.copy()
-    if p004 != "<ninguna>":
-        sub = sub[[True if is_vivienda_or_mixto(v) else False for v in sub[p004]]]
+    sub = subset(view_df, "vivienda", p004)
 
     for col,label in [(p012,"Años de residencia (p012)"), (p013,"Nº personas con ingresos (p013)")]:
         if col!="<ninguna>":
@@ -443,9 +403,7 @@ with tabD:
 # ---- E
 with tabE:
     st.subheader("BLOQUE E – Servicios (p004 = vivienda o mixto)")
-    sub = view_df.copy()
-    if p004 != "<ninguna>":
-        sub = sub[[True if is_vivienda_or_mixto(v) else False for v in sub[p004]]]
+    sub = subset(view_df, "vivienda", p004)
 
     for par in [
         (p015,"Servicios básicos (p015)"), (p016,"Frecuencia acceso agua (p016)"),
@@ -465,16 +423,9 @@ with tabE:
     ]: show_xtab(r,c,t)
 
 # ---- F
-def is_negocio_or_mixto(v):
-    if v is None: return False
-    s = str(v).strip().lower()
-    return ("negocio" in s) or ("mixto" in s) or ("vivienda–negocio" in s) or ("vivienda-negocio" in s)
-
 with tabF:
     st.subheader("BLOQUE F – Negocios (p004 = negocio o mixto)")
-    sub = view_df.copy()
-    if p004 != "<ninguna>":
-        sub = sub[[True if is_negocio_or_mixto(v) else False for v in sub[p004]]]
+    sub = subset(view_df, "negocio", p004)
 
     for col,label in [
         (p025,"Actividad principal (p025)"), (p026,"Tiempo de operación (p026)"),
@@ -517,72 +468,28 @@ with tabG:
 # ---- I (Indicadores) — versión robusta
 with tabI:
     st.subheader("BLOQUE I – Indicadores (resumen)")
-    base = view_df.copy()
-    ind = {}
-
-    def has(pat_series: pd.Series, pat: str):
-        """Wrapper seguro para .str.contains con regex y NA."""
-        return pat_series.str.contains(pat, regex=True, na=False)
-
-    if p005!="<ninguna>":
-        s = base[p005].astype(str).str.lower()
-        ind["% estructuras en mal estado"] = (has(s, r"\bmalo\b") | has(s, r"\bmal\b")).mean()*100 if len(s)>0 else np.nan
-
-    if sexoj!="<ninguna>":
-        s = base[sexoj].astype(str).str.lower()
-        ind["% hogares con jefatura femenina"] = (has(s, "mujer") | has(s, "femen")).mean()*100 if len(s)>0 else np.nan
-
-    if p010!="<ninguna>":
-        s = base[p010].astype(str).str.lower()
-        # (Corregido: .str.contains en todas las condiciones)
-        prec = has(s, "prest") | has(s, "invad") | has(s, "alquil.*sin") | has(s, "sin.*titul")
-        ind["% hogares con tenencia precaria"] = prec.mean()*100 if len(s)>0 else np.nan
-
-    if p015!="<ninguna>":
-        s = base[p015].astype(str).str.lower()
-        ind["% hogares sin acceso a agua potable"] = (~(has(s, "agua") | has(s, "acued"))).mean()*100 if len(s)>0 else np.nan
-
-    if p018!="<ninguna>":
-        s = base[p018].astype(str).str.lower()
-        ind["% hogares con saneamiento inadecuado"] = (has(s, "letrin") | has(s, "ninguno") | has(s, "compart")).mean()*100 if len(s)>0 else np.nan
-
-    if p027!="<ninguna>":
-        s = base[p027].astype(str).str.lower()
-        ind["% negocios sin permisos"] = (has(s, r"^no\b") | has(s, r"\bninguno\b")).mean()*100 if len(s)>0 else np.nan
-
-    if p022!="<ninguna>":
-        ind["Promedio activos por hogar"] = pd.to_numeric(base[p022], errors='coerce').mean()
-
-    if p032!="<ninguna>":
-        ind["Promedio activos por negocio"] = pd.to_numeric(base[p032], errors='coerce').mean()
-
-    if p030!="<ninguna>" and p029!="<ninguna>":
-        num = pd.to_numeric(base[p030], errors='coerce')
-        den = pd.to_numeric(base[p029], errors='coerce').replace(0, np.nan)
-        ind["% negocios con personal formalizado"] = ((num/den).mean()*100) if den.notna().any() else np.nan
-
-    st.dataframe(pd.DataFrame({"Indicador": list(ind.keys()), "Valor": list(ind.values())}), use_container_width=True)
+    # reglas en encuesta/tabulados.py (las mismas que usa el anexo por línea de comandos)
+    st.dataframe(indicadores(view_df, roles), use_container_width=True)
     st.caption("Las reglas son heurísticas; ajusta a tu codificación final.")
 
 # ---- MAPA
 with tabMAP:
     st.subheader("Mapa de coordenadas GPS")
     if lat_col != "<ninguna>" and lon_col != "<ninguna>":
-        m = view_df.copy()
-        m["_lat"] = pd.to_numeric(m[lat_col], errors="coerce")
-        m["_lon"] = pd.to_numeric(m[lon_col], errors="coerce")
-        m = m.dropna(subset=["_lat","_lon"])
-        m = m[(m["_lat"].between(-90,90)) & (m["_lon"].between(-180,180))]
-        if m.empty:
-            st.info("No hay coordenadas válidas después de la limpieza.")
-        else:
-            map_df = m.rename(columns={"_lat":"lat","_lon":"lon"})[["lat","lon"]]
-            st.map(map_df, use_container_width=True)
-            st.caption(f"{len(map_df):,} puntos mostrados (vista: {ambito_txt.strip('*')}).")
+        panel_mapa(view_df, lat_col, lon_col, sector, ambito=ambito_txt.strip("*"),
+                   cols_indicador=[c for c in (sector, p004, p005, p006, p007, p008, p010, sexoj, p015, p018,
+                                               p021, p027, p035, p036) if c != "<ninguna>"])
     else:
         st.info("Selecciona LATITUD y LONGITUD en la barra lateral.")
 
 # ---- TEXTO (abiertas)
+nube_pendiente = None   # (placeholder, Future) de la nube; se completa al final del script
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def _dtm_cached(col: str, huella_col: str, huella_stop: int, stem: bool, _serie: pd.Series, _stop: frozenset):
+    # memoria del proceso -> data/.cache_texto (npz + vocabulario) -> ajuste
+    return dtm_en_disco(_serie, _stop, stem=stem)
+
 with tabTXT:
     st.subheader("Análisis de preguntas abiertas")
     activar_texto = st.toggle("Activar análisis de texto (abiertas)", value=False, key="txt_toggle",
@@ -590,70 +497,23 @@ with tabTXT:
     if not activar_texto:
         st.info("Activa el análisis para calcular frecuencias y nubes.")
     else:
-        import nltk
-        from sklearn.feature_extraction.text import CountVectorizer
-        from wordcloud import WordCloud
-        from unidecode import unidecode
-
-        # stopwords ES
-        try:
-            from nltk.corpus import stopwords
-            _ = stopwords.words("spanish")
-        except:
-            nltk.download("stopwords")
-            from nltk.corpus import stopwords
-
-        stop_es = set(stopwords.words("spanish")) | {
-            "si","no","sì","sí","mas","más","tambien","también","pues","porque",
-            "q","que","ya","solo","sólo","alli","allí","ahi","ahí","aqui","aquí"
-        }
-        MISSING_TEXT_PATTERNS = (
-            r"^no\s*contesta.?$|^no\s*respond[eió].?$|^ns/?nr$|^no\s*sabe\s*/?\s*no\s*responde$|^sin\s*respuesta$|^na$|^n/?a$",
-        )
-        def is_missing_text(s: str) -> bool:
-            s = str(s or "").strip().lower()
-            if s in {m.lower() for m in MISSING_LABELS}: return True
-            for pat in MISSING_TEXT_PATTERNS:
-                if re.match(pat, s, flags=re.I): return True
-            return False
-
-        def norm(s):
-            if pd.isna(s): return ""
-            s = str(s).replace("\n"," ").lower()
-            s = re.sub(r"\s+", " ", s).strip()
-            return unidecode(s)
+        # stopwords ES (léxico empaquetado + data/stopwords_extra.txt; sin descargas)
+        stop_es = cargar_stopwords()
 
         text_cols = [c for c in [p040, p041, p38tx, p024] if c != "<ninguna>" and c in view_df.columns]
         if not text_cols:
             st.warning("Selecciona al menos una columna abierta (p040, p041, p38tx, p024).")
         else:
             st.caption("Columnas analizadas: " + ", ".join(text_cols))
-            corpora = {}
-            for col in text_cols:
-                raw = view_df[col].astype(str)
-                raw = raw[~raw.map(is_missing_text)]
-                txt = raw.map(norm)
-                txt = txt[txt.str.len() > 0]
-                corpora[col] = txt
+            usar_raiz = st.toggle("Agrupar variantes (raíz)", value=False, key="txt_stem",
+                                  help="Cuenta 'calle' y 'calles' como un mismo término (raíz Snowball); se muestra la forma más frecuente.")
+            # Una matriz (1,2)-gramas por columna y versión del dataset; el filtro es un corte de filas
+            dtms = {col: _dtm_cached(col, huella(df[col]), hash(stop_es), usar_raiz, df[col], stop_es) for col in text_cols}
+            corpora = {col: d.textos[d.filas(view_df.index)] for col, d in dtms.items()}
 
             st.markdown("### Frecuencias")
             n_top = st.slider("Top términos a mostrar", 10, 50, 20, key="txt_topn")
 
-            def top_ngrams(series, n=1, top=20):
-                series = series[series.str.len() > 0]
-                if series.empty: return pd.DataFrame(columns=["término","frecuencia"])
-                vect = CountVectorizer(ngram_range=(n,n), stop_words=list(stop_es), min_df=2)
-                try:
-                    X = vect.fit_transform(series)
-                except ValueError:
-                    return pd.DataFrame(columns=["término","frecuencia"])
-                if X.shape[1] == 0:
-                    return pd.DataFrame(columns=["término","frecuencia"])
-                freqs = np.asarray(X.sum(axis=0)).ravel()
-                vocab = np.array(vect.get_feature_names_out())
-                order = freqs.argsort()[::-1][:top]
-                return pd.DataFrame({"término": vocab[order], "frecuencia": freqs[order]})
-
             for col in text_cols:
                 st.markdown(f"**{col}**")
                 s = corpora[col]
@@ -662,24 +522,239 @@ with tabTXT:
                 c1,c2 = st.columns(2)
                 with c1:
                     st.write("Unigramas (palabras)")
-                    st.dataframe(top_ngrams(s, 1, n_top), use_container_width=True)
+                    st.dataframe(dtms[col].frecuencias(view_df.index, 1, n_top), use_container_width=True)
                 with c2:
                     st.write("Bigramas (parejas de palabras)")
-                    st.dataframe(top_ngrams(s, 2, n_top), use_container_width=True)
+                    st.dataframe(dtms[col].frecuencias(view_df.index, 2, n_top), use_container_width=True)
+
+            if sector != "<ninguna>":
+                with st.expander("Términos por sector"):
+                    g1, g2, g3, g4 = st.columns(4)
+                    col_sec = g1.selectbox("Columna", text_cols, key="txt_sec_col")
+                    n_sec = g2.radio("Términos", [1, 2], horizontal=True, key="txt_sec_n",
+                                     format_func=lambda n: "Unigramas" if n == 1 else "Bigramas")
+                    top_sec = g3.slider("Top por sector", 3, 30, 10, key="txt_sec_top")
+                    orden_sec = g4.radio("Orden", ["Más frecuentes", "Distintivos (log-odds)", "Distintivos (TF-IDF)"],
+                                         key="txt_sec_orden",
+                                         help="Distintivos: términos más propios de cada sector frente al resto.")
+                    if orden_sec == "Más frecuentes":
+                        tab_sec = dtms[col_sec].por_grupo(view_df[sector], n_sec, top_sec)
+                    else:
+                        tab_sec = dtms[col_sec].distintivos(view_df[sector], n_sec, top_sec,
+                                                            metodo="tf-idf" if "TF-IDF" in orden_sec else "log-odds")
+                    st.dataframe(tab_sec, use_container_width=True, hide_index=True)
+                    st.download_button("⬇️ Descargar términos por sector (Excel)",
+                                       data=export_xlsx({"Términos por sector": tab_sec}),
+                                       file_name=f"terminos_por_sector_{col_sec}.xlsx",
+                                       mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                       key="txt_sec_dl")
+
+            st.markdown("### Buscar en respuestas")
+            b1, b2 = st.columns([3, 1])
+            consulta = b1.text_input("Palabras a buscar", key="txt_buscar",
+                                     help='Todas las palabras deben aparecer; "entre comillas" busca la frase.')
+            col_bus = b2.selectbox("Columna", text_cols, key="txt_buscar_col")
+            if consulta.strip():
+                d = dtms[col_bus]
+                filas = d.buscar(consulta, view_df.index, stop_words=stop_es)
+                if not len(filas):
+                    st.info("Sin respuestas que contengan la búsqueda (las stopwords se ignoran).")
+                else:
+                    POR_PAG = 20
+                    n_pag = (len(filas) - 1) // POR_PAG + 1
+                    pag = st.number_input(f"Página (de {n_pag})", 1, n_pag, 1, key="txt_buscar_pag") if n_pag > 1 else 1
+                    st.caption(f"{len(filas):,} respuestas coinciden.")
+                    terminos = d.terminos_consulta(consulta, stop_es)
+                    lineas = []
+                    for i in filas[(pag - 1) * POR_PAG: pag * POR_PAG]:
+                        ctx = "".join(f"<mark>{html.escape(t)}</mark>" if m else html.escape(t)
+                                      for t, m in kwic(df.at[i, col_bus], terminos, stem=d.stem))
+                        meta = " · ".join(html.escape(str(view_df.at[i, c])) for c in (sector, p004)
+                                          if c != "<ninguna>" and c in view_df.columns)
+                        lineas.append(f"<li><b>{meta or i}</b> — {ctx}</li>")
+                    st.markdown("<ul>" + "".join(lineas) + "</ul>", unsafe_allow_html=True)
 
             st.markdown("### Nube de palabras")
             col_wc = st.selectbox("Selecciona columna para la nube", options=text_cols, index=0, key="sel_wc")
-            txt_series = corpora.get(col_wc, pd.Series(dtype=str))
-            txt_wc = " ".join(txt_series.tolist()).strip()
-            if len(txt_wc) < 3:
+            # frecuencias de la misma matriz (ya sin stopwords); la imagen se dibuja en segundo
+            # plano y queda en caché por tabla de frecuencias: se muestra al final del script
+            freqs_wc = dtms[col_wc].frecuencias(view_df.index, 1, top=200, min_df=1)
+            if freqs_wc.empty:
                 st.info("No hay texto suficiente para generar la nube.")
             else:
-                try:
-                    wc = WordCloud(width=1000, height=400, background_color="white",
-                                   stopwords=stop_es, collocations=False).generate(txt_wc)
-                    st.image(wc.to_array(), use_column_width=True)
-                except Exception as e:
-                    st.warning(f"No se pudo generar la nube: {e}")
+                nube_pendiente = (st.empty(), nube_async(dict(zip(freqs_wc["término"], freqs_wc["frecuencia"]))))
+                nube_pendiente[0].caption("Generando nube…")
+
+# ---- ARMONIZACIÓN de categorías
+with tabARM:
+    st.subheader("Armonización de categorías")
+    st.caption("Agrupa variantes de escritura (mayúsculas, acentos, guiones) de cada columna categórica. "
+               "Los mapeos aprobados se guardan en `data/armonizacion.json` y se aplican al cargar los datos.")
+    cols_arm = [c for c in df_raw.columns
+                if str(df_raw[c].dtype) in ("object", "string") and df_raw[c].nunique() <= MAX_DISTINCT]
+    if not cols_arm:
+        st.info("No hay columnas categóricas de texto para armonizar.")
+    else:
+        a1, a2 = st.columns([2, 1])
+        col_arm = a1.selectbox("Columna", cols_arm, key="arm_col")
+        umbral = a2.slider("Similitud mínima", 0.70, 1.00, 0.88, step=0.01, key="arm_umbral")
+        actual = mapeos_arm.get(col_arm, {})
+        prop = propose_merges(df_raw[col_arm], threshold=umbral)
+        if prop.empty and not actual:
+            st.success("Sin variantes detectadas con el umbral actual.")
+        else:
+            # Mapeos ya aprobados que el umbral actual no propone se conservan en la tabla
+            extra = [(v, c) for v, c in actual.items() if v not in set(prop["valor"])]
+            if extra:
+                n_extra = df_raw[col_arm].astype(str).value_counts()
+                prop = pd.concat([prop, pd.DataFrame({
+                    "valor": [v for v, _ in extra], "canonico": [c for _, c in extra],
+                    "n": [int(n_extra.get(v, 0)) for v, _ in extra], "similitud": [np.nan] * len(extra),
+                })], ignore_index=True)
+            if actual:
+                prop["canonico"] = [actual.get(v, c) for v, c in zip(prop["valor"], prop["canonico"])]
+            prop.insert(0, "aprobar", [(v in actual) or (not actual and sim == 1.0)
+                                       for v, sim in zip(prop["valor"], prop["similitud"])])
+            edit = st.data_editor(prop, use_container_width=True, hide_index=True,
+                                  disabled=["valor", "n", "similitud"], key=f"arm_editor_{col_arm}")
+            aprobado = {str(v): str(c).strip() for v, c, ok in zip(edit["valor"], edit["canonico"], edit["aprobar"])
+                        if ok and str(c).strip() and str(c).strip() != str(v)}
+            n_antes = df_raw[col_arm].nunique()
+            n_despues = len(set(df_raw[col_arm].dropna().astype(str).map(lambda v: aprobado.get(v, v))))
+            st.caption(f"Categorías distintas: {n_antes} → {n_despues} con la selección actual.")
+            b1, b2 = st.columns(2)
+            if b1.button("💾 Guardar mapeo aprobado", key="arm_save", use_container_width=True):
+                mapeos_arm[col_arm] = aprobado
+                guardar_mapeos(mapeos_arm)
+                st.rerun()
+            if actual and b2.button("🗑️ Eliminar mapeo de la columna", key="arm_del", use_container_width=True):
+                mapeos_arm.pop(col_arm, None)
+                guardar_mapeos(mapeos_arm)
+                st.rerun()
+    if mapeos_arm:
+        st.markdown("**Mapeos activos**")
+        st.dataframe(pd.DataFrame([(c, v, k) for c, m in mapeos_arm.items() for v, k in m.items()],
+                                  columns=["columna", "valor", "canonico"]), use_container_width=True)
+
+# ---- CALIDAD de datos (reglas de rango, salto y consistencia)
+with tabQA:
+    st.subheader("Validación de calidad de datos")
+    st.caption("Reglas vectorizadas sobre el filtro base (sector). Una fila de incidencias por registro y regla violada.")
+    resumen_qa, incid_qa = validar(work, roles, labels=etiquetas_cb)
+    if resumen_qa.empty:
+        st.info("Mapea variables en la barra lateral para habilitar las reglas.")
+    else:
+        solo_con = st.checkbox("Mostrar sólo reglas con violaciones", value=True, key="qa_solo")
+        vista_qa = resumen_qa[resumen_qa["n"] > 0] if solo_con else resumen_qa
+        st.markdown("**Resumen por regla**")
+        st.dataframe(vista_qa, use_container_width=True, hide_index=True)
+        st.markdown(f"**Incidencias por registro** ({len(incid_qa):,})")
+        regla_sel = st.multiselect("Filtrar reglas", vista_qa["regla"].tolist(), key="qa_reglas")
+        inc = incid_qa[incid_qa["regla"].isin(regla_sel)] if regla_sel else incid_qa
+        st.dataframe(inc.head(5000), use_container_width=True, hide_index=True)
+        st.download_button("⬇️ Descargar reporte de validación (Excel)",
+                           data=export_xlsx({"Resumen": resumen_qa, "Incidencias": incid_qa}),
+                           file_name="reporte_validacion.xlsx",
+                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                           key="qa_dl")
+
+    st.markdown("---")
+    st.subheader("Sector por polígono")
+    if not pol_sectores:
+        st.info(f"Coloca los límites de sector en **{SECTORES_GEOJSON_PATH}** (Polygon/MultiPolygon, "
+                "propiedad SECTOR o nombre) y mapea LATITUD/LONGITUD para comparar con el SECTOR digitado.")
+    elif sector_digitado == "<ninguna>":
+        st.info("Mapea SECTOR en la barra lateral para compararlo con el polígono.")
+    else:
+        disc = discrepancias(work, sector_digitado)
+        st.caption(f"{len(pol_sectores)} polígonos · {len(disc):,} registros con SECTOR distinto o fuera de los límites.")
+        if disc.empty:
+            st.success("El SECTOR digitado coincide con el polígono en todos los registros con GPS.")
+        else:
+            st.dataframe(disc.groupby(["motivo", sector_digitado, SECTOR_POLIGONO], dropna=False).size()
+                         .rename("n").reset_index().sort_values("n", ascending=False),
+                         use_container_width=True, hide_index=True)
+            st.download_button("⬇️ Descargar discrepancias de sector (Excel)",
+                               data=export_xlsx({"Discrepancias": disc}),
+                               file_name="sector_poligono.xlsx",
+                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                               key="qa_pol_dl")
+
+    st.markdown("---")
+    st.subheader("Envíos duplicados")
+    if politica_dup == "ninguna":
+        st.info("Elige una política en **🧬 Duplicados** (barra lateral) para detectar duplicados.")
+    elif dup_grupos.empty:
+        st.success("No se detectaron envíos duplicados.")
+    else:
+        st.caption(f"Política: {POLITICAS[politica_dup]} · registros eliminados: {dup_n:,}. "
+                   "Los datos del resto de pestañas ya están depurados.")
+        cols_ver = [c for c in (sector, p004, lat_col, lon_col, "p002__Timestamp")
+                    if c != "<ninguna>" and c in df_raw.columns]
+        det = dup_grupos.drop(columns=["pos"]).join(df_raw[cols_ver], on="fila")
+        st.dataframe(det, use_container_width=True, hide_index=True)
+        st.download_button("⬇️ Descargar duplicados (Excel)", data=export_xlsx({"Duplicados": det}),
+                           file_name="duplicados.xlsx",
+                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                           key="dup_dl")
+
+# ---- VERSIONES del dataset (diff por hash de filas/celdas)
+@st.cache_data(show_spinner=False)
+def _leer_version(path: str) -> pd.DataFrame:
+    d = pd.read_excel(path, engine="openpyxl")
+    d = d.rename(columns={c: clean_label(c) for c in d.columns})
+    d.columns = make_unique_columns(d.columns)
+    return d
+
+@st.cache_data(show_spinner=False)
+def _diff_cached(path_a: str, path_b: str, claves: tuple) -> dict:
+    return diff_versions(_leer_version(path_a), _leer_version(path_b), list(claves))
+
+with tabVER:
+    st.subheader("Comparar versiones del dataset")
+    disp = versiones_disponibles()
+    if len(disp) < 2:
+        st.info("Se necesitan al menos dos versiones: " + ", ".join(f"`{p}`" for p in disp.values()))
+    else:
+        nombres = list(disp)
+        v1, v2 = st.columns(2)
+        va = v1.selectbox("Versión A (anterior)", nombres, index=0, key="ver_a")
+        vb = v2.selectbox("Versión B (nueva)", nombres, index=len(nombres) - 1, key="ver_b")
+        cols_ab = [c for c in _leer_version(disp[va]).columns if c in set(_leer_version(disp[vb]).columns)]
+        claves = st.multiselect("Columnas clave del registro (vacío = posición de fila)", cols_ab,
+                                default=[c for c in CLAVES_DEFAULT if c in cols_ab], key="ver_claves")
+        if va == vb:
+            st.info("Elige dos versiones distintas.")
+        else:
+            with st.spinner("Comparando versiones…"):
+                d = _diff_cached(disp[va], disp[vb], tuple(claves))
+            k1, k2, k3, k4 = st.columns(4)
+            k1.metric("Registros agregados", f"{len(d['agregados']):,}")
+            k2.metric("Registros eliminados", f"{len(d['eliminados']):,}")
+            k3.metric("Registros modificados", f"{len(d['modificados']):,}")
+            k4.metric("Columnas con cambios", f"{len(d['cambios_col']):,}")
+            if d["cols_nuevas"] or d["cols_eliminadas"]:
+                st.caption(f"Columnas sólo en B: {len(d['cols_nuevas'])} · sólo en A: {len(d['cols_eliminadas'])}")
+            with st.expander("Cambios por columna", expanded=True):
+                st.dataframe(d["cambios_col"], use_container_width=True, hide_index=True)
+            with st.expander("Detalle de celdas modificadas (máx. 5000)"):
+                st.dataframe(d["detalle"].astype(str), use_container_width=True, hide_index=True)
+            for nombre, key_d in [("Agregados", "agregados"), ("Eliminados", "eliminados"), ("Modificados", "modificados")]:
+                if len(d[key_d]):
+                    with st.expander(f"Registros {nombre.lower()} ({len(d[key_d]):,})"):
+                        st.dataframe(d[key_d].astype(str), use_container_width=True, hide_index=True)
+
+            st.markdown("**Impacto en tabulados B–G**")
+            por_sector = st.checkbox("Desagregar por sector", value=False, key="ver_by")
+            by_ver = sector if (por_sector and sector != "<ninguna>") else None
+            shift = tables_shift(_leer_version(disp[va]), _leer_version(disp[vb]), roles, d, by=by_ver)
+            if not shift:
+                st.success("Ningún tabulado del plan cambia entre estas versiones.")
+            else:
+                st.caption(f"{len(shift)} tabulados cambian (sólo se recalculan los afectados por columnas modificadas).")
+                for key_t, t in shift.items():
+                    with st.expander(f"{key_t} — {len(t)} celdas"):
+                        st.dataframe(t, use_container_width=True, hide_index=True)
 
 # ---- MANUAL (robusto; sin use_container_width y con fallback de encoding)
 with tabMANUAL:
@@ -755,25 +830,24 @@ Este es un manual de respaldo. Para mostrar tu manual propio:
 # ---- EXPORTAR
 with tabEXPORT:
     st.subheader("Exportar anexos a Excel (según vista actual)")
-    sheets = {}
-    # B
-    if p004!="<ninguna>": sheets["B_p004"] = vc_percent(view_df, p004, by=None)
-    if p005!="<ninguna>": sheets["B_p005"] = vc_percent(view_df, p005, by=None)
-    if p006!="<ninguna>": sheets["B_p006"] = vc_percent(view_df, p006, by=None)
-    if p007!="<ninguna>": sheets["B_p007"] = vc_percent(view_df, p007, by=None)
-    if p008!="<ninguna>": sheets["B_p008"] = vc_percent(view_df, p008, by=None)
-    if p004!="<ninguna>" and p005!="<ninguna>": sheets["B_p004x_p005"] = crosstab_pct(view_df, p004, p005, by=None)
-    for other, key in [(p006,"p005x_p006"),(p007,"p005x_p007"),(p008,"p005x_p008")]:
-        if p005!="<ninguna>" and other!="<ninguna>":
-            sheets[f"B_{key}"] = crosstab_pct(view_df, p005, other, by=None)
-    for other, key in [(p006,"p004x_p006"),(p007,"p004x_p007"),(p008,"p004x_p008")]:
-        if p004!="<ninguna>" and other!="<ninguna>":
-            sheets[f"B_{key}"] = crosstab_pct(view_df, p004, other, by=None)
-
-    if sheets:
-        data = export_xlsx(sheets)
-        st.download_button("⬇️ Descargar Anexo Estadístico (Excel)", data=data,
-                           file_name="anexo_estadistico.xlsx",
-                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    else:
-        st.info("Configura mapeo de variables para habilitar la exportación.")
+    # Bloque B de la vista actual; se genera sólo al pedirlo
+    claves_b = {k for k, *_ in PLAN if k.startswith("B_")}
+    panel_anexo(view_df, roles, by=None, keys=claves_b, key="exp_anexo")
+    if sector != "<ninguna>":
+        st.markdown("**Un libro por sector**")
+        st.caption("Totales del filtro base y un libro por cada sector, en paralelo; se descargan juntos en un zip.")
+        panel_anexo(work, roles, by=None, keys=claves_b, key="exp_lote", por_sector=sector)
+    st.markdown("**Anexo sin navegador**")
+    st.caption("Guarda el mapeo actual como `data/mapeo_variables.json` y genera el anexo completo (B–G + "
+               "indicadores) con `python -m encuesta.cli`; ver el Manual.")
+    st.download_button("⬇️ Mapeo de variables (JSON)",
+                       data=json.dumps(roles, ensure_ascii=False, indent=2, sort_keys=True).encode("utf-8"),
+                       file_name="mapeo_variables.json", mime="application/json", key="exp_mapeo")
+
+# ---- Nube de palabras (dibujada en segundo plano mientras se pintaba el resto)
+if nube_pendiente is not None:
+    ph, fut = nube_pendiente
+    try:
+        ph.image(fut.result().array, use_column_width=True)
+    except Exception as e:
+        ph.warning(f"No se pudo generar la nube: {e}")
@@ -6,16 +6,15 @@
 #   pandas
 #   numpy
 #   pydeck
-#   matplotlib
 #   wordcloud
-#   openpyxl
+#   openpyxl    (lectura de .xlsx)
+#   xlsxwriter  (exportación en streaming, ver encuesta/excel.py)
 # Estructura de archivos (recomendada):
 #   data/respuestas.xlsx
 #   data/Codebook.xlsx
 # =========================================================
 
-import os, re, io, unicodedata
-from io import BytesIO
+import os, json, time
 from collections import Counter
 
 import numpy as np
@@ -24,8 +23,16 @@ import streamlit as st
 
 # Visualización
 import pydeck as pdk
-import matplotlib.pyplot as plt
-from wordcloud import WordCloud
+
+from encuesta.codebook import build_value_labels, apply_value_labels
+from encuesta.datos import clean_label, make_unique_columns
+from encuesta.duplicados import RESPUESTAS_CLAVE, panel_duplicados
+from encuesta.excel import libro_bytes
+from encuesta.geo import panel_mapa, panel_zona
+from encuesta.lexico import cargar_stopwords, etiquetas_raices, raiz
+from encuesta.nubes import nube_async
+from encuesta.paralelo import map_distintos
+from encuesta.textos import clean_text_spanish, serie_en_disco
 
 # ---------------------------------------------------------
 # Configuración básica de la app
@@ -42,16 +49,6 @@ st.caption("Panel interactivo para tabulados, cruces, diccionario, mapa GPS y nu
 # =========================================================
 # Helpers de limpieza y utilidades
 # =========================================================
-def clean_label(s: str) -> str:
-    s = re.sub(r"\s+", " ", str(s)).strip()
-    rep = {
-        "√≠": "í", "√≥": "ó", "√±": "ñ", "√©": "é", "√í": "á", "√∫": "ú", "###": ""
-    }
-    for k, v in rep.items():
-        s = s.replace(k, v)
-    return s
-
-
 def ensure_string_cols(df: pd.DataFrame) -> pd.DataFrame:
     # Convierte columnas tipo "object" a string para evitar errores en filtros/agrupaciones
     for c in df.columns:
@@ -128,53 +125,23 @@ def crosstab_pct(df, r, c, by=None, by_label=None):
 
 
 # ---------- Texto (abiertas) ----------
-STOPWORDS_ES = {
-    "de","la","que","el","en","y","a","los","del","se","las","por","un","para",
-    "con","no","una","su","al","lo","como","más","pero","sus","le","ya","o",
-    "este","sí","porque","esta","entre","cuando","muy","sin","sobre","también",
-    "me","hasta","hay","donde","quien","desde","todo","nos","durante","todos",
-    "uno","les","ni","contra","otros","ese","eso","ante","ellos","e","esto","mí",
-    "antes","algunos","qué","unos","yo","otro","otras","otra","él","tanto","esa",
-    "estos","mucho","quienes","nada","muchos","cual","poco","ella","estar","estas",
-    "algunas","algo","nosotros","mi","mis","tú","te","ti","tu","tus","ellas","nosotras",
-    "vosotros","vosotras","os","mío","mía","míos","mías","tuyo","tuya","tuyos","tuyas",
-    "suyo","suya","suyos","suyas","nuestro","nuestra","nuestros","nuestras",
-    "vuestro","vuestra","vuestros","vuestras","esos","esas","estoy","estás","está",
-    "estamos","estáis","están","esté","estés","estemos","estéis","estén","estaré",
-    "estarás","estará","estaremos","estaréis","estarán","estaba","estabas","estábamos",
-    "estabais","estaban","estuve","estuviste","estuvo","estuvimos","estuvisteis",
-    "estuvieron","estuviera","estuvieras","estuviéramos","estuvierais","estuvieran",
-    "estuviese","estuvieses","estuviésemos","estuvieseis","estuviesen","estando",
-    "estado","estada","estados","estadas","estad","ser","soy","eres","es","somos",
-    "sois","son","sea","seas","seamos","seáis","sean","seré","serás","será","seremos",
-    "seréis","serán","era","eras","éramos","erais","eran","fui","fuiste","fue",
-    "fuimos","fuisteis","fueron","fuera","fueras","fuéramos","fuerais","fueran",
-    "fuese","fueses","fuésemos","fueseis","fuesen","siendo","sido","hoy","año",
-    "años","mes","meses","día","días","así","cada"
-}
-
-def _strip_accents(s: str) -> str:
-    return "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
-
-def clean_text_spanish(s: str) -> str:
-    if not isinstance(s, str):
-        return ""
-    s = s.lower()
-    s = _strip_accents(s)
-    s = re.sub(r"http\S+|www\.\S+", " ", s)    # URLs
-    s = re.sub(r"[@#]\w+", " ", s)             # @usuario, #hashtag
-    s = re.sub(r"[\U00010000-\U0010ffff]", " ", s)  # emojis/símbolos
-    s = re.sub(r"[^a-z0-9\s]", " ", s)         # mantener letras/números/espacio
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-def tokenize_es(s: str, min_len: int = 3, stopwords_extra: set | None = None, keep_numbers: bool = False):
+# Léxico compartido (nltk + ampliadas, sin acentos) + data/stopwords_extra.txt
+STOPWORDS_ES = cargar_stopwords()
+
+def stopwords_con(stopwords_extra: set | None = None) -> frozenset:
+    if not stopwords_extra:
+        return STOPWORDS_ES
+    return STOPWORDS_ES | {clean_text_spanish(x) for x in stopwords_extra if x}
+
+def tokenize_es(s: str, min_len: int = 3, stopwords_extra: set | None = None, keep_numbers: bool = False,
+                sw: frozenset | None = None, stem: bool = False, formas: dict | None = None):
+    # sw: stopwords ya combinadas (stopwords_con) para no rehacer la unión en cada fila
+    # stem: devuelve raíces (memorizadas por token); formas: {raíz: Counter(forma)} a completar
     if not s:
         return []
     tokens = s.split()
-    sw = set(STOPWORDS_ES)
-    if stopwords_extra:
-        sw |= {clean_text_spanish(x) for x in stopwords_extra if x}
+    if sw is None:
+        sw = stopwords_con(stopwords_extra)
     out = []
     for t in tokens:
         if not keep_numbers and t.isdigit():
@@ -184,6 +151,12 @@ def tokenize_es(s: str, min_len: int = 3, stopwords_extra: set | None = None, ke
         if t in sw:
             continue
         out.append(t)
+    if stem:
+        raices = [raiz(t) for t in out]
+        if formas is not None:
+            for r, t in zip(raices, out):
+                formas.setdefault(r, Counter())[t] += 1
+        return raices
     return out
 
 def make_ngrams(tokens, n=2, min_len=3):
@@ -196,6 +169,37 @@ def make_ngrams(tokens, n=2, min_len=3):
             grams.append("_".join(g))
     return grams
 
+def iter_respuestas(limpias: pd.DataFrame, grupos: pd.Series | None = None, chunk: int = 5000):
+    """(grupo, texto limpio) por respuesta (celda), recorriendo el corpus en bloques."""
+    for i in range(0, len(limpias), chunk):
+        bloque = limpias.iloc[i:i + chunk]
+        g = grupos.iloc[i:i + chunk].tolist() if grupos is not None else [None] * len(bloque)
+        for gi, fila in zip(g, bloque.itertuples(index=False, name=None)):
+            for txt in fila:
+                if txt:
+                    yield gi, txt
+
+def contar_terminos(respuestas, min_len=3, sw=STOPWORDS_ES, keep_numbers=False, use_bigrams=True,
+                    stem=False):
+    """Cuenta términos respuesta por respuesta (los bigramas no cruzan respuestas).
+    Devuelve (Counter total, {grupo: Counter}); con stem, las raíces se muestran con su
+    forma más frecuente."""
+    total, por_grupo, formas = Counter(), {}, {}
+    for g, txt in respuestas:
+        toks = tokenize_es(txt, min_len=min_len, keep_numbers=keep_numbers, sw=sw, stem=stem, formas=formas)
+        if use_bigrams:
+            # los tokens ya pasaron min_len; una raíz puede ser más corta que su forma
+            toks += make_ngrams(toks, n=2, min_len=1 if stem else min_len)
+        total.update(toks)
+        if g is not None:
+            por_grupo.setdefault(g, Counter()).update(toks)
+    if stem:
+        forma = etiquetas_raices(formas)
+        def _et(c):
+            return Counter({"_".join(forma.get(p, p) for p in k.split("_")): v for k, v in c.items()})
+        total, por_grupo = _et(total), {g: _et(c) for g, c in por_grupo.items()}
+    return total, por_grupo
+
 
 # =========================================================
 # Carga de datos
@@ -226,7 +230,7 @@ else:
 if df is not None:
     df = ensure_string_cols(df)
     # Limpieza leve de encabezados
-    df.columns = [clean_label(c) for c in df.columns]
+    df.columns = make_unique_columns([clean_label(c) for c in df.columns])
 
 # Codebook (opcional)
 if os.path.exists(CODEBOOK_PATH):
@@ -248,6 +252,29 @@ else:
 if df is None:
     st.stop()
 
+# Etiquetas de valor del Codebook (código -> etiqueta, renombrando categorías)
+if cb is not None and st.sidebar.toggle("Aplicar etiquetas del Codebook", value=True):
+    df, cb_reporte = apply_value_labels(df, build_value_labels(cb))
+    if not cb_reporte.empty:
+        with st.sidebar.expander(f"⚠️ Valores fuera del Codebook ({len(cb_reporte)})"):
+            st.dataframe(cb_reporte, use_container_width=True, hide_index=True)
+
+# =========================================================
+# Envíos duplicados (misma política que app.py, antes de los filtros)
+# =========================================================
+def _por_nombre(nombres):
+    # primera columna cuyo nombre coincide (sin mayúsculas) con alguno de `nombres`
+    low = {c.lower(): c for c in df.columns}
+    return next((low[n.lower()] for n in nombres if n.lower() in low), None)
+
+
+# app1 no tiene mapeo de variables: los roles se toman por nombre de columna
+roles = {r: _por_nombre([r]) for r in RESPUESTAS_CLAVE}
+roles.update(sector=_por_nombre(["SECTOR"]),
+             lat=_por_nombre(["p002__Latitude", "lat", "latitude"]),
+             lon=_por_nombre(["p002__Longitude", "lon", "longitude"]))
+df, *_ = panel_duplicados(df, roles)
+
 # =========================================================
 # Filtros globales (Sidebar)
 # =========================================================
@@ -280,6 +307,9 @@ for k, v in extra_filters.items():
     if v != "<todos>":
         work = work.loc[work[k] == v]
 
+# Zona GPS (rectángulo o radio) sobre el mismo filtro, con el GPS hallado por nombre
+work = panel_zona(df, work, roles["lat"], roles["lon"])
+
 work = work.copy()  # evita SetWithCopy
 work = ensure_string_cols(work)
 
@@ -358,6 +388,15 @@ with tab_cruces:
 # ---------------------------------------------------------
 # Mapa (GPS)
 # ---------------------------------------------------------
+class DeckCompacto(pdk.Deck):
+    """Deck cuyo JSON va sin sangría (pydeck usa indent=2: con miles de puntos el
+    espaciado pesa más que los datos). Streamlit serializa con to_json(); se parte del
+    to_json() público de pydeck y sólo se vuelve a escribir sin espacios."""
+
+    def to_json(self):
+        return json.dumps(json.loads(super().to_json()), sort_keys=True, separators=(",", ":"))
+
+
 with tab_mapa:
     st.subheader("Mapa de puntos GPS")
 
@@ -376,44 +415,46 @@ with tab_mapa:
     lon_col = st.selectbox("Columna Longitud", ["<ninguna>"] + list(work.columns),
                            index=(["<ninguna>"] + list(work.columns)).index(lon_default) if lon_default != "<ninguna>" else 0)
 
+    def _puntos(filas, lat, lon, ocultos):
+        # Payload mínimo en lugar de todas las columnas de `work`: posición redondeada a
+        # 1e-6° (~0,1 m), color del sector como uint8 y su etiqueta sólo para el tooltip.
+        # Claves cortas: pydeck serializa a JSON una lista de registros.
+        color_by_sector = st.toggle("Colorear por SECTOR", value=sector_col is not None)
+        t0 = time.perf_counter()
+        pts = pd.DataFrame({"x": np.round(lon, 6), "y": np.round(lat, 6)})
+        tooltip_txt = ""
+        get_color = [0, 100, 200]
+        if sector_col:
+            sec = work.loc[filas, sector_col].astype("category")
+            pts["s"] = sec.astype(str).to_numpy()
+            tooltip_txt = "{s}"
+            if color_by_sector:
+                # Codifica sector (0..n) para color
+                pts["c"] = ((sec.cat.codes.to_numpy().astype("int64") * 35) % 255).astype("uint8")
+                get_color = "[c, 80, 200]"
+
+        layer = pdk.Layer(
+            "ScatterplotLayer",
+            pts,
+            get_position=["x", "y"],
+            get_radius=10,
+            get_color=get_color,
+            pickable=True,
+        )
+        view_state = pdk.ViewState(latitude=float(lat.mean()), longitude=float(lon.mean()), zoom=13)
+        deck = DeckCompacto(layers=[layer], initial_view_state=view_state, tooltip={"text": tooltip_txt})
+        kb = len(deck.to_json().encode("utf-8")) / 1024
+        st.pydeck_chart(deck)
+        st.caption(f"{len(pts):,} puntos" + (f" ({ocultos:,} ocultos por LOD)" if ocultos else "")
+                   + f" · carga útil {kb:,.0f} KB · preparada en "
+                   f"{(time.perf_counter() - t0) * 1000:,.0f} ms.")
+
     if lat_col == "<ninguna>" or lon_col == "<ninguna>":
         st.info("Selecciona columnas de Latitud y Longitud.")
     else:
-        mdf = work.copy()
-        mdf["_lat"] = pd.to_numeric(mdf[lat_col], errors="coerce")
-        mdf["_lon"] = pd.to_numeric(mdf[lon_col], errors="coerce")
-        mdf = mdf.dropna(subset=["_lat", "_lon"])
-
-        if len(mdf) == 0:
-            st.info("No hay puntos válidos para graficar con el filtro actual.")
-        else:
-            color_by_sector = st.toggle("Colorear por SECTOR", value=("SECTOR" in mdf.columns))
-            tooltip_txt = "{SECTOR}" if "SECTOR" in mdf.columns else ""
-
-            if color_by_sector:
-                # Codifica sector (0..n) para color
-                codes = mdf["SECTOR"].astype("category").cat.codes if "SECTOR" in mdf.columns else 0
-                mdf = mdf.assign(_color=(codes * 35) % 255)
-                get_color = "[_color, 80, 200]"
-            else:
-                get_color = [0, 100, 200]
-
-            layer = pdk.Layer(
-                "ScatterplotLayer",
-                mdf,
-                get_position=["_lon", "_lat"],
-                get_radius=10,
-                get_color=get_color,
-                pickable=True,
-            )
-            view_state = pdk.ViewState(
-                latitude=float(mdf["_lat"].mean()),
-                longitude=float(mdf["_lon"].mean()),
-                zoom=13
-            )
-            st.pydeck_chart(pdk.Deck(layers=[layer], initial_view_state=view_state,
-                                     tooltip={"text": tooltip_txt}))
-            st.caption("El mapa respeta los filtros activos (ej. SECTOR).")
+        panel_mapa(work, lat_col, lon_col, sector_col, cols_indicador=list(work.columns),
+                   deck=DeckCompacto, puntos=_puntos)
+        st.caption("El mapa respeta los filtros activos (ej. SECTOR).")
 
 # ---------------------------------------------------------
 # Nube — Abiertas
@@ -438,6 +479,8 @@ with tab_nube:
                                       help="Genera combinaciones frecuentes (ej. 'apoyo_tecnico').")
         with col3:
             keep_numbers = st.checkbox("Conservar números", value=False)
+            stem = st.checkbox("Agrupar variantes (raíz)", value=False,
+                               help="Cuenta 'calle' y 'calles' como un mismo término; se muestra la forma más frecuente.")
             collocations = st.checkbox("Colocaciones WordCloud", value=False,
                                        help="Si está activo, WordCloud detecta combinaciones frecuentes internamente.")
 
@@ -451,38 +494,28 @@ with tab_nube:
             if not cols_sel:
                 st.warning("Selecciona al menos una columna de texto.")
             else:
-                textos = work[cols_sel].astype(str).fillna("")
-                concatenado = "\n".join([" ".join(row) for row in textos.values.tolist()])
-                limpio = clean_text_spanish(concatenado)
-                tokens = tokenize_es(limpio, min_len=min_len, stopwords_extra=sw_extra, keep_numbers=keep_numbers)
-
-                if use_bigrams:
-                    tokens += make_ngrams(tokens, n=2, min_len=min_len)
-
-                freqs = Counter(tokens)
-                freqs = Counter({k: v for k, v in freqs.items() if v >= min_freq})
+                # limpieza por columna sobre todo el dataset (una vez por texto distinto, en
+                # paralelo si son muchos), persistida en data/.cache_texto
+                limpias = pd.concat([serie_en_disco(df[c].astype("string").fillna(""),
+                                                    lambda s: map_distintos(s, clean_text_spanish).astype(str),
+                                                    "clean_es")
+                                     for c in cols_sel], axis=1).loc[work.index]
+                grupos = work[sector_col].astype("string").fillna("(Sin dato)") if sector_col else None
+                # conteo por respuesta, sin concatenar el corpus en un único texto
+                conteo, conteo_sector = contar_terminos(
+                    iter_respuestas(limpias, grupos), min_len=min_len, sw=stopwords_con(sw_extra),
+                    keep_numbers=keep_numbers, use_bigrams=use_bigrams, stem=stem)
+                freqs = Counter({k: v for k, v in conteo.items() if v >= min_freq})
 
                 if len(freqs) == 0:
                     st.info("Sin términos suficientes con los criterios actuales. Ajusta filtros/columnas.")
                 else:
-                    wc = WordCloud(
-                        background_color="white",
-                        width=1400,
-                        height=700,
-                        max_words=max_pal,
-                        collocations=collocations
-                    ).generate_from_frequencies(freqs)
-
-                    fig = plt.figure(figsize=(12, 6))
-                    plt.imshow(wc, interpolation="bilinear")
-                    plt.axis("off")
-                    st.pyplot(fig, use_container_width=True)
-
-                    # Descarga de la nube (PNG)
-                    buf = BytesIO()
-                    fig.savefig(buf, format="png", dpi=200, bbox_inches="tight")
-                    st.download_button("⬇️ Descargar nube (PNG)", data=buf.getvalue(),
-                                       file_name="nube_palabras.png", mime="image/png")
+                    # se dibuja en segundo plano (caché por frecuencias + opciones) mientras se
+                    # pintan las tablas; imagen y PNG se colocan al final
+                    nube_ph = st.empty()
+                    nube_ph.caption("Generando nube…")
+                    nube_fut = nube_async(freqs, width=1400, height=700, max_words=max_pal,
+                                          collocations=collocations)
 
                     # Tabla de frecuencias (CSV)
                     df_freq = (pd.DataFrame(freqs.items(), columns=["termino", "frecuencia"])
@@ -498,6 +531,29 @@ with tab_nube:
                         mime="text/csv"
                     )
 
+                    if len(conteo_sector) > 1:
+                        st.markdown("### Frecuencias por SECTOR (top 20 por sector)")
+                        df_sec = pd.DataFrame(
+                            [(g, k, v) for g, c in sorted(conteo_sector.items())
+                             for k, v in c.most_common(20) if v >= min_freq],
+                            columns=[sector_col, "termino", "frecuencia"])
+                        st.dataframe(df_sec, use_container_width=True, height=420)
+                        st.download_button(
+                            "⬇️ Descargar frecuencias por sector (CSV)",
+                            data=df_sec.to_csv(index=False).encode("utf-8"),
+                            file_name="frecuencias_abiertas_sector.csv",
+                            mime="text/csv"
+                        )
+
+                    try:
+                        img = nube_fut.result()
+                        with nube_ph.container():
+                            st.image(img.array, use_column_width=True)
+                            st.download_button("⬇️ Descargar nube (PNG)", data=img.png,
+                                               file_name="nube_palabras.png", mime="image/png")
+                    except Exception as e:
+                        nube_ph.warning(f"No se pudo generar la nube: {e}")
+
 # ---------------------------------------------------------
 # Diccionario (Codebook)
 # ---------------------------------------------------------
@@ -527,10 +583,7 @@ with tab_export:
     else:
         st.dataframe(st.session_state["last_table"].head(50), use_container_width=True, height=350)
         fn = f"{st.session_state['last_table_name']}.xlsx"
-        buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-            st.session_state["last_table"].to_excel(writer, index=False, sheet_name="Resultado")
-        st.download_button("⬇️ Descargar Excel", data=buffer.getvalue(),
+        st.download_button("⬇️ Descargar Excel", data=libro_bytes([("Resultado", st.session_state["last_table"])]),
                            file_name=fn, mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
 # ---------------------------------------------------------
@@ -1,9 +1,24 @@
-import os, re, io
+import os, html
 import pandas as pd
 import numpy as np
 import streamlit as st
 import plotly.express as px
 
+from encuesta.anexo import panel_anexo
+from encuesta.armonizar import aplicar_armonizacion, cargar_mapeos
+from encuesta.codebook import build_value_labels, apply_value_labels
+from encuesta.datos import clean_label, make_unique_columns
+from encuesta.duplicados import panel_duplicados
+from encuesta.geo import panel_mapa, panel_zona
+from encuesta.lexico import cargar_stopwords
+from encuesta.nubes import nube_async
+from encuesta.textos import dtm_en_disco, huella, kwic
+from encuesta.codificacion import (
+    DICCIONARIO_EJEMPLO, NO_CLASIFICADO, aplicar_manual, codificar, compilar, parse_diccionario, resumen,
+)
+from encuesta.similares import agrupar, representantes
+from encuesta.tabulados import crosstab_pct, subset, vc_percent
+
 st.set_page_config(page_title="Plan de Tabulados — Encuesta", layout="wide")
 # ---- Estilos para tabs: más espacio y salto de línea si no caben ----
 st.markdown("""
@@ -40,124 +55,6 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- FALTANTES (no tabular) ---
-MISSING_LABELS = {
-    "", "(Sin dato)", "No contestó", "No contesto", "No respondió", "No responde",
-    "No sabe/No responde", "NS/NR", "Ns/Nr", "NSNR", "No aplica", "NA", "N/A",
-    "Sin respuesta", "NR"
-}
-def _is_missing_label(x: str) -> bool:
-    return str(x).strip() in MISSING_LABELS
-
-# --- FALTANTES (no tabular) ---
-MISSING_LABELS = {
-    "", "(Sin dato)", "No contestó", "No contesto", "No respondió", "No responde",
-    "No sabe/No responde", "NS/NR", "Ns/Nr", "NSNR", "No aplica", "NA", "N/A",
-    "Sin respuesta", "NR"
-}
-def _is_missing_label(x: str) -> bool:
-    return str(x).strip() in MISSING_LABELS
-
-# -------- Helpers --------
-def clean_label(s: str) -> str:
-    s = re.sub(r"\s+", " ", str(s)).strip()
-    rep = {"√≠":"í","√≥":"ó","√±":"ñ","√©":"é","√í":"á","√∫":"ú","###":""}
-    for k,v in rep.items():
-        s = s.replace(k,v)
-    return s
-
-def _make_unique_columns(cols):
-    seen = {}
-    new_cols = []
-    for c in cols:
-        base = str(c)
-        if base not in seen:
-            seen[base] = 1
-            new_cols.append(base)
-        else:
-            seen[base] += 1
-            new_cols.append(f"{base} ({seen[base]})")
-    return new_cols
-
-def vc_percent(df, col, by=None):
-    # Etiquetas como texto y NaN -> "(Sin dato)"
-    def cat(s):
-        return s.astype("object").where(s.notna(), "(Sin dato)").astype(str)
-
-    if by is not None:
-        tmp = pd.DataFrame({by: cat(df[by]), col: cat(df[col])})
-        # Excluir faltantes en la variable analizada
-        tmp = tmp[~tmp[col].isin(MISSING_LABELS)]
-        if tmp.empty:
-            return pd.DataFrame(columns=[by, col, "n", "%"])
-        t = tmp.groupby([by, col], dropna=False).size().rename("n").reset_index()
-        t["%"] = t.groupby(by)["n"].transform(lambda s: (s/s.sum()*100).round(1))
-        return t
-    else:
-        s = cat(df[col])
-        s = s[~s.isin(MISSING_LABELS)]
-        if s.empty:
-            return pd.DataFrame(columns=[col, "n", "%"])
-        t = s.value_counts(dropna=False).rename_axis(col).reset_index(name="n")
-        total = t["n"].sum()
-        t["%"] = (t["n"]/total*100).round(1) if total else 0
-        return t
-
-
-def crosstab_pct(df, r, c, by=None):
-    def cat(s):
-        return s.astype("object").where(s.notna(), "(Sin dato)").astype(str)
-
-    if by is not None:
-        out = []
-        for g, sub in df.groupby(by):
-            rr = cat(sub[r]); cc = cat(sub[c])
-            mask = (~rr.isin(MISSING_LABELS)) & (~cc.isin(MISSING_LABELS))
-            rr, cc = rr[mask], cc[mask]
-            if (len(rr)==0) or (len(cc)==0):
-                continue
-            tab = pd.crosstab(rr, cc, dropna=False)
-            tab.columns = tab.columns.astype(str)
-            tab["n_fila"] = tab.sum(axis=1)
-            pct = (tab.div(tab["n_fila"].replace(0, np.nan), axis=0)*100).round(1)
-            tab = tab.drop(columns=["n_fila"])
-            tab["__grupo__"] = str(g); tab["__tipo__"] = "n"
-            pct["__grupo__"] = str(g); pct["__tipo__"] = "%"
-            out.append(tab.reset_index().rename(columns={"index": r}))
-            out.append(pct.reset_index().rename(columns={"index": r}))
-        return pd.concat(out, ignore_index=True) if out else pd.DataFrame()
-    else:
-        rr = cat(df[r]); cc = cat(df[c])
-        mask = (~rr.isin(MISSING_LABELS)) & (~cc.isin(MISSING_LABELS))
-        rr, cc = rr[mask], cc[mask]
-        if (len(rr)==0) or (len(cc)==0):
-            return pd.DataFrame()
-        tab = pd.crosstab(rr, cc, dropna=False)
-        tab.columns = tab.columns.astype(str)
-        tab["n_fila"] = tab.sum(axis=1)
-        pct = (tab.div(tab["n_fila"].replace(0, np.nan), axis=0)*100).round(1)
-        tab = tab.drop(columns=["n_fila"])
-        tab["__tipo__"] = "n"; pct["__tipo__"] = "%"
-        return pd.concat(
-            [tab.reset_index().rename(columns={"index": r}),
-             pct.reset_index().rename(columns={"index": r})],
-            ignore_index=True
-        )
-
-
-def export_xlsx(sheets_dict):
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        for sheet, df in sheets_dict.items():
-            if isinstance(df, dict):
-                startrow = 0
-                for name, sub in df.items():
-                    sub.to_excel(writer, index=False, sheet_name=sheet, startrow=startrow)
-                    startrow += len(sub) + 3
-            else:
-                df.to_excel(writer, index=False, sheet_name=sheet)
-    return output.getvalue()
-
 # -------- Data load (fixed /data + engine=openpyxl) --------
 st.sidebar.title("⚙️ Datos")
 uploaded = st.sidebar.file_uploader("Sube CSV/Excel (opcional)", type=["csv","xlsx"])
@@ -196,7 +93,18 @@ if os.path.exists(CODEBOOK_PATH):
         st.warning(f"No se pudo leer Codebook en {CODEBOOK_PATH}. Detalle: {e}")
 
 df = df.rename(columns={c: clean_label(c) for c in df.columns})
-df.columns = _make_unique_columns(df.columns)
+df.columns = make_unique_columns(df.columns)
+
+# ---------- Etiquetas de valor del Codebook (código -> etiqueta) ----------
+usar_etiquetas = st.sidebar.toggle("Aplicar etiquetas del Codebook", value=True, key="cb_labels",
+                                   help="Reemplaza códigos crudos (1, 2, 0…) por su etiqueta del Codebook.")
+if codebook is not None and usar_etiquetas:
+    df, cb_reporte = apply_value_labels(df, build_value_labels(codebook))
+    if not cb_reporte.empty:
+        with st.sidebar.expander(f"⚠️ Valores fuera del Codebook ({len(cb_reporte)})"):
+            st.dataframe(cb_reporte, use_container_width=True, hide_index=True)
+# Mapeos de armonización aprobados (se editan en la pestaña "Armonización" de app.py)
+df = aplicar_armonizacion(df, cargar_mapeos())
 
 # -------- Variable mapper --------
 st.sidebar.header("🧭 Mapeo de variables")
@@ -270,6 +178,22 @@ p041 = pick("p041 (abierta)", ["p041"])
 p38tx = pick("p38tx (abierta)", ["p38tx","p038tx","p38"])
 p024  = pick("p024 (abierta)",  ["p024"])
 
+# Roles del plan de tabulados -> columna mapeada (motor compartido en encuesta/)
+roles = dict(
+    sector=sector,
+    p004=p004, p005=p005, p006=p006, p007=p007, p008=p008,
+    nviv=nviv, p009a=p009a, p009b=p009b, p010=p010, sexoj=sexoj, p011=p011,
+    sexom=sexom, sexoh=sexoh, sexonh=sexonh, sexonm=sexonm,
+    p012=p012, p013=p013, p014=p014, p022=p022,
+    p015=p015, p016=p016, p017=p017, p018=p018, p019=p019, p020=p020, p021=p021,
+    p025=p025, p026=p026, p027=p027, p028=p028, p029=p029, p030=p030, p031=p031, p032=p032,
+    p035=p035, p035tx=p035tx, p036=p036,
+    lat=lat_col, lon=lon_col,
+)
+
+# ---------- Envíos duplicados (misma política que app.py, antes de los filtros) ----------
+df, *_ = panel_duplicados(df, roles)
+
 # -------- Filtros --------
 st.sidebar.header("Filtros")
 work = df.copy()
@@ -280,15 +204,9 @@ if sector != "<ninguna>":
     else: work = df.index == -1
 work = df[work] if isinstance(work, pd.Series) else df
 
-def is_vivienda_or_mixto(v):
-    if v is None: return False
-    s = str(v).strip().lower()
-    return ("vivienda" in s) or ("mixto" in s) or ("vivienda–negocio" in s) or ("vivienda-negocio" in s)
+# ---------- Zona GPS (índice espacial, una vez por versión de los datos) ----------
+work = panel_zona(df, work, lat_col, lon_col)
 
-def is_negocio_or_mixto(v):
-    if v is None: return False
-    s = str(v).strip().lower()
-    return ("negocio" in s) or ("mixto" in s) or ("vivienda–negocio" in s) or ("vivienda-negocio" in s)
 
 # -------- Header & KPIs --------
 st.title("📊 Plan de Tabulados y Cruces — Anexo Estadístico")
@@ -344,9 +262,7 @@ with tabB:
 
 with tabC:
     st.subheader("BLOQUE C – Hogares dentro de la estructura (p004 = vivienda o mixto)")
-    sub = work.copy()
-    if p004 != "<ninguna>":
-        sub = sub[[True if is_vivienda_or_mixto(v) else False for v in sub[p004]]]
+    sub = subset(work, "vivienda", p004)
     st.markdown("**Tabulados simples**")
     for col, label in [(nviv,"Nº de hogares (nvivienda)"),
                        (p009a,"Nº de espacios habitables (p009a)"),
@@ -388,9 +304,7 @@ with tabC:
 
 with tabD:
     st.subheader("BLOQUE D – Situación socioeconómica (p004 = vivienda o mixto)")
-    sub = work.copy()
-    if p004 != "<ninguna>":
-        sub = sub[[True if is_vivienda_or_mixto(v) else False for v in sub[p004]]]
+    sub = subset(work, "vivienda", p004)
     st.markdown("**Tabulados simples**")
     for col, label in [(p012,"Año de residencia (p012)"), (p013,"Nº de personas con ingresos (p013)")]:
         if col!="<ninguna>":
@@ -417,9 +331,7 @@ with tabD:
 
 with tabE:
     st.subheader("BLOQUE E – Acceso a servicios y saneamiento (p004 = vivienda o mixto)")
-    sub = work.copy()
-    if p004 != "<ninguna>":
-        sub = sub[[True if is_vivienda_or_mixto(v) else False for v in sub[p004]]]
+    sub = subset(work, "vivienda", p004)
     st.markdown("**Tabulados simples**")
     for col, label in [(p015,"Servicios básicos (p015)"), (p016,"Frecuencia acceso agua (p016)"),
                        (p017,"Fuente de agua (p017)"), (p018,"Tipo de sanitario (p018)"),
@@ -443,9 +355,7 @@ with tabE:
 
 with tabF:
     st.subheader("BLOQUE F – Negocios (p004 = negocio o mixto)")
-    sub = work.copy()
-    if p004 != "<ninguna>":
-        sub = sub[[True if is_negocio_or_mixto(v) else False for v in sub[p004]]]
+    sub = subset(work, "negocio", p004)
     st.markdown("**Tabulados simples**")
     for col, label in [(p025,"Actividad principal (p025)"), (p026,"Tiempo de operación (p026)"),
                        (p027,"Permisos de operación (p027)"), (p028,"Tenencia local (p028)"),
@@ -532,186 +442,161 @@ with tabI:
     st.caption("Las reglas de indicadores son heurísticas; ajustables a tu codificación exacta.")
 
 # ---- TEXTO (abiertas) ----
+nube_pendiente = None   # (placeholder, Future) de la nube; se completa al final del script
 
-# ---- TEXTO (abiertas) ----
-with tabTXT:
-    st.subheader("Análisis de preguntas abiertas")
+@st.cache_resource(show_spinner=False, max_entries=32)
+def _dtm_cached(col: str, huella_col: str, huella_stop: int, stem: bool, _serie: pd.Series, _stop: frozenset):
+    # memoria del proceso -> data/.cache_texto (npz + vocabulario) -> ajuste
+    return dtm_en_disco(_serie, _stop, stem=stem)
 
-    # 🔌 Interruptor: si no lo activas, NO se ejecuta nada de esta pestaña
-    activar_texto = st.toggle("Activar análisis de texto (abiertas)", value=False, help="Activa para calcular frecuencias y nubes")
-    if not activar_texto:
-        st.info("Activa el análisis para calcular frecuencias y nubes de palabras.")
-        st.stop()  # Importante: evita ejecutar el resto y posibles errores
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _codificador_cached(dict_text: str):
+    return compilar(parse_diccionario(dict_text))
 
-    import re, numpy as np, pandas as pd
-    import nltk
-    from sklearn.feature_extraction.text import CountVectorizer
-    from wordcloud import WordCloud
-    from unidecode import unidecode
+@st.cache_data(show_spinner="Agrupando respuestas similares…", max_entries=16)
+def _grupos_cached(col: str, huella_col: str, huella_stop: int, umbral: float, stem: bool,
+                   _serie: pd.Series, _stop: frozenset):
+    return agrupar(_serie, _stop, umbral=umbral, stem=stem)
 
-    # Garantizar stopwords español
-    try:
-        from nltk.corpus import stopwords
-        _ = stopwords.words("spanish")
-    except:
-        nltk.download("stopwords")
-        from nltk.corpus import stopwords
-
-    # Stopwords ampliadas
-    stop_es = set(stopwords.words("spanish")) | {
-        "si","no","sì","sí","mas","más","tambien","también","pues","porque",
-        "q","que","ya","solo","sólo","alli","allí","ahi","ahí","aqui","aquí"
-    }
-
-    # Etiquetas / expresiones de no-respuesta
-    MISSING_LABELS = {
-        "", "(Sin dato)", "No contestó", "No contesto", "No respondió", "No responde",
-        "No sabe/No responde", "NS/NR", "Ns/Nr", "NSNR", "No aplica", "NA", "N/A",
-        "Sin respuesta", "NR"
-    }
-    MISSING_TEXT_PATTERNS = (
-        r"^no\s*contesta.?$|^no\s*respond[eió].?$|^ns/?nr$|^no\s*sabe\s*/?\s*no\s*responde$|^sin\s*respuesta$|^na$|^n/?a$",
-    )
-    def is_missing_text(s: str) -> bool:
-        s = str(s or "").strip().lower()
-        if s in {m.lower() for m in MISSING_LABELS}: return True
-        for pat in MISSING_TEXT_PATTERNS:
-            if re.match(pat, s, flags=re.I): return True
-        return False
-
-    def norm(s):
-        if pd.isna(s): return ""
-        s = str(s).replace("\n"," ").lower()
-        s = re.sub(r"\s+", " ", s).strip()
-        return unidecode(s)
+with tabTXT:
+    st.subheader("Análisis de preguntas abiertas")
 
+    # 🔌 Interruptor: si no lo activas, NO se calcula nada de esta pestaña
+    activar_texto = st.toggle("Activar análisis de texto (abiertas)", value=False, help="Activa para calcular frecuencias y nubes")
     # Columnas seleccionadas en la barra lateral
     text_cols = [c for c in [p040, p041, p38tx, p024] if c != "<ninguna>" and c in work.columns]
-    if not text_cols:
+    if not activar_texto:
+        st.info("Activa el análisis para calcular frecuencias y nubes de palabras.")
+    elif not text_cols:
         st.warning("Selecciona al menos una columna abierta (p040, p041, p38tx, p024) en la barra lateral.")
-        st.stop()
-
-    st.caption("Columnas analizadas: " + ", ".join(text_cols))
-
-    # Construcción de corpus filtrando no-respuestas
-    corpora = {}
-    for col in text_cols:
-        raw = work[col].astype(str)
-        raw = raw[~raw.map(is_missing_text)]
-        txt = raw.map(norm)
-        txt = txt[txt.str.len() > 0]
-        corpora[col] = txt
-
-    # ===== Frecuencias =====
-    st.markdown("### Frecuencias")
-    n_top = st.slider("Top términos a mostrar", 10, 50, 20, key="txt_topn")
-
-    def top_ngrams(series, n=1, top=20):
-        series = series[series.str.len() > 0]
-        if series.empty:
-            return pd.DataFrame(columns=["término","frecuencia"])
-        vect = CountVectorizer(ngram_range=(n,n), stop_words=list(stop_es), min_df=2)
-        try:
-            X = vect.fit_transform(series)
-        except ValueError:
-            return pd.DataFrame(columns=["término","frecuencia"])
-        if X.shape[1] == 0:
-            return pd.DataFrame(columns=["término","frecuencia"])
-        freqs = np.asarray(X.sum(axis=0)).ravel()
-        vocab = np.array(vect.get_feature_names_out())
-        order = freqs.argsort()[::-1][:top]
-        return pd.DataFrame({"término": vocab[order], "frecuencia": freqs[order]})
-
-    for col in text_cols:
-        st.markdown(f"**{col}**")
-        s = corpora[col]
-        if s.empty:
-            st.info("Sin texto utilizable (todo fue vacío o no-respuesta).")
-            continue
-        c1, c2 = st.columns(2)
-        with c1:
-            st.write("Unigramas (palabras)")
-            st.dataframe(top_ngrams(s, 1, n_top), use_container_width=True)
-        with c2:
-            st.write("Bigramas (parejas de palabras)")
-            st.dataframe(top_ngrams(s, 2, n_top), use_container_width=True)
-
-   # ===== Nube de palabras =====
-st.markdown("### Nube de palabras")
-
-# Usa una key ÚNICA que no esté en ningún otro widget
-col_wc = st.selectbox(
-    "Selecciona columna para la nube",
-    options=text_cols,
-    index=0,
-    key="txt_wc_select"   # <--- NUEVA key para evitar DuplicateWidgetID
-)
-
-txt_series = corpora.get(col_wc, pd.Series(dtype=str))
-txt_wc = " ".join(txt_series.tolist()).strip()
-
-if len(txt_wc) < 3:
-    st.info("No hay texto suficiente para generar la nube (se excluyeron vacíos / No contestó).")
-else:
-    try:
-        wc = WordCloud(
-            width=1000, height=400,
-            background_color="white",
-            stopwords=stop_es,
-            collocations=False
-        ).generate(txt_wc)
-
-        img = wc.to_array()
-        # ✅ En st.image el argumento correcto es use_column_width (no use_container_width)
-        st.image(img, use_column_width=True)
-
-    except Exception as e:
-        st.warning(f"No se pudo generar la nube: {e}")
-
+    else:
+        # Stopwords ampliadas (léxico empaquetado + data/stopwords_extra.txt; sin descargas)
+        stop_es = cargar_stopwords()
+
+        st.caption("Columnas analizadas: " + ", ".join(text_cols))
+
+        usar_raiz = st.toggle("Agrupar variantes (raíz)", value=False, key="txt_stem",
+                              help="Cuenta 'calle' y 'calles' como un mismo término (raíz Snowball); se muestra la forma más frecuente.")
+        # Construcción de corpus filtrando no-respuestas: una matriz (1,2)-gramas por columna
+        # y versión del dataset; el filtro por sector es un corte de filas
+        dtms = {col: _dtm_cached(col, huella(df[col]), hash(stop_es), usar_raiz, df[col], stop_es) for col in text_cols}
+        corpora = {col: d.textos[d.filas(work.index)] for col, d in dtms.items()}
+
+        # ===== Frecuencias =====
+        st.markdown("### Frecuencias")
+        n_top = st.slider("Top términos a mostrar", 10, 50, 20, key="txt_topn")
+
+        for col in text_cols:
+            st.markdown(f"**{col}**")
+            s = corpora[col]
+            if s.empty:
+                st.info("Sin texto utilizable (todo fue vacío o no-respuesta).")
+                continue
+            c1, c2 = st.columns(2)
+            with c1:
+                st.write("Unigramas (palabras)")
+                st.dataframe(dtms[col].frecuencias(work.index, 1, n_top), use_container_width=True)
+            with c2:
+                st.write("Bigramas (parejas de palabras)")
+                st.dataframe(dtms[col].frecuencias(work.index, 2, n_top), use_container_width=True)
+
+        # ===== Búsqueda (índice invertido de la matriz) =====
+        st.markdown("### Buscar en respuestas")
+        b1, b2 = st.columns([3, 1])
+        consulta = b1.text_input("Palabras a buscar", key="txt_buscar",
+                                 help='Todas las palabras deben aparecer; "entre comillas" busca la frase.')
+        col_bus = b2.selectbox("Columna", text_cols, key="txt_buscar_col")
+        if consulta.strip():
+            d = dtms[col_bus]
+            filas = d.buscar(consulta, work.index, stop_words=stop_es)
+            if not len(filas):
+                st.info("Sin respuestas que contengan la búsqueda (las stopwords se ignoran).")
+            else:
+                POR_PAG = 20
+                n_pag = (len(filas) - 1) // POR_PAG + 1
+                pag = st.number_input(f"Página (de {n_pag})", 1, n_pag, 1, key="txt_buscar_pag") if n_pag > 1 else 1
+                st.caption(f"{len(filas):,} respuestas coinciden.")
+                terminos = d.terminos_consulta(consulta, stop_es)
+                lineas = []
+                for i in filas[(pag - 1) * POR_PAG: pag * POR_PAG]:
+                    ctx = "".join(f"<mark>{html.escape(t)}</mark>" if m else html.escape(t)
+                                  for t, m in kwic(df.at[i, col_bus], terminos, stem=d.stem))
+                    meta = " · ".join(html.escape(str(work.at[i, c])) for c in (sector, p004)
+                                      if c != "<ninguna>" and c in work.columns)
+                    lineas.append(f"<li><b>{meta or i}</b> — {ctx}</li>")
+                st.markdown("<ul>" + "".join(lineas) + "</ul>", unsafe_allow_html=True)
+
+        # ===== Nube de palabras =====
+        st.markdown("### Nube de palabras")
+        col_wc = st.selectbox("Selecciona columna para la nube", options=text_cols, index=0, key="txt_wc_select")
+
+        # frecuencias de la misma matriz (ya sin stopwords); la imagen se dibuja en segundo
+        # plano y queda en caché por tabla de frecuencias: se muestra al final del script
+        freqs_wc = dtms[col_wc].frecuencias(work.index, 1, top=200, min_df=1)
+
+        if freqs_wc.empty:
+            st.info("No hay texto suficiente para generar la nube (se excluyeron vacíos / No contestó).")
+        else:
+            nube_pendiente = (st.empty(), nube_async(dict(zip(freqs_wc["término"], freqs_wc["frecuencia"]))))
+            nube_pendiente[0].caption("Generando nube…")
 
         # ======== CODIFICACIÓN AUTOMÁTICA ========
         st.markdown("### Codificación automática por diccionario")
-        st.caption("Edita las categorías y palabras clave (separadas por |). La primera coincidencia asigna la categoría.")
-
-        sample_dict = """salud: clinica|hospital|medico|enfermera|centro de salud|farmacia
-seguridad: robo|asalto|pandilla|violencia|iluminacion|policia
-vialidad: calle|bache|pavimento|tráfico|semáforo|pasarela
-agua: agua|tuberia|acueducto|pozo|lluvia
-residuos: basura|desecho|aseo|relleno|recoleccion|reciclaje
-otro: otro|varios|misc"""
-        dict_text = st.text_area("Diccionario (formato: categoria: palabra1|palabra2|...)", value=sample_dict, height=150, key="dict_text")
-
-        # Parsear diccionario
-        rules = []
-        for line in dict_text.splitlines():
-            if ":" in line:
-                cat, kw = line.split(":", 1)
-                cat = cat.strip()
-                kws = [w.strip() for w in kw.split("|") if w.strip()]
-                if cat and kws: rules.append((cat, kws))
-
-        col_to_code = st.selectbox("Columna a codificar", options=text_cols, index=0, key="sel_code_col")
-
-        def auto_code(text):
-            t = norm(text)
-            for cat, kws in rules:
-                for w in kws:
-                    if w and re.search(rf"\b{re.escape(unidecode(w.lower()))}\b", t):
-                        return cat
-            return "No clasificado"
+        st.caption("Edita las categorías y palabras clave (separadas por |). El orden de las líneas es la "
+                   "prioridad: la primera categoría encontrada es la principal; con multi-etiqueta se listan todas.")
+
+        dict_text = st.text_area("Diccionario (formato: categoria: palabra1|palabra2|...)",
+                                 value=DICCIONARIO_EJEMPLO, height=150, key="dict_text")
+        cod1, cod2, cod3 = st.columns(3)
+        col_to_code = cod1.selectbox("Columna a codificar", options=text_cols, index=0, key="sel_code_col")
+        multi_lbl = cod2.toggle("Multi-etiqueta", value=False, key="code_multi")
+        por_sector = cod3.toggle("Resumen por sector", value=False, key="code_sector",
+                                 disabled=sector == "<ninguna>")
+
+        # ===== Respuestas similares: una categoría manual por grupo =====
+        manual_col = st.session_state.setdefault("code_manual", {}).setdefault(col_to_code, {})
+        grupos_txt = None
+        if st.toggle("Agrupar respuestas similares (codificación manual)", value=False, key="code_sim",
+                     help="Reúne respuestas casi iguales para leer un representante por grupo y asignarle una categoría."):
+            s1, s2 = st.columns(2)
+            umbral_sim = s1.slider("Similitud mínima", 0.3, 0.9, 0.5, step=0.05, key="code_sim_umbral")
+            min_tam = s2.number_input("Tamaño mínimo de grupo", 1, 1000, 2, key="code_sim_min")
+            grupos_txt = _grupos_cached(col_to_code, huella(df[col_to_code]), hash(stop_es), umbral_sim, usar_raiz,
+                                        df[col_to_code], stop_es)
+            reps = representantes(grupos_txt, work.index, min_tamano=min_tam)
+            st.caption(f"{len(reps):,} grupos con {reps['tamaño'].sum():,} respuestas. "
+                       "La categoría elegida se aplica a todas las respuestas del grupo.")
+            reps["categoría manual"] = reps["representante"].map(manual_col).astype("object")
+            editado = st.data_editor(
+                reps, hide_index=True, use_container_width=True,
+                column_config={"grupo": None, "categoría manual": st.column_config.SelectboxColumn(
+                    options=[c for c, _ in parse_diccionario(dict_text)] + [NO_CLASIFICADO])},
+                disabled=["representante", "tamaño", "variantes"],
+                key=f"code_sim_ed_{col_to_code}_{hash(tuple(reps['grupo']))}")
+            for rep, cat in zip(editado["representante"], editado["categoría manual"]):
+                if isinstance(cat, str) and cat:
+                    manual_col[rep] = cat
+                else:
+                    manual_col.pop(rep, None)
 
         if st.button("Aplicar codificación", use_container_width=True):
-            coded = work[[col_to_code]].copy()
-            coded["categoria_auto"] = work[col_to_code].apply(auto_code)
-            st.success("Codificación aplicada.")
+            codificador = _codificador_cached(dict_text)
+            coded = work[[col_to_code]].join(codificar(work[col_to_code], codificador))
+            fuente = "auto"
+            if grupos_txt is not None and manual_col:
+                coded = aplicar_manual(coded, grupos_txt["representante"].map(manual_col))
+                fuente = "final"
+            if sector != "<ninguna>":
+                coded.insert(0, sector, work[sector])
+            st.success(f"Codificación aplicada ({len(coded):,} respuestas, {len(codificador.categorias)} categorías"
+                       + (f"; {coded['categoria_manual'].notna().sum():,} con categoría manual)." if fuente == "final" else ")."))
             st.dataframe(coded.head(50), use_container_width=True)
 
             # Resumen
-            resumen = coded["categoria_auto"].value_counts(dropna=False).rename_axis("categoria").reset_index(name="n")
-            total = resumen["n"].sum()
-            resumen["%"] = (resumen["n"]/total*100).round(1) if total else 0
-            st.markdown("**Resumen de categorías (auto)**")
-            st.dataframe(resumen, use_container_width=True)
+            res_cod = resumen(coded, by=work[sector] if (por_sector and sector != "<ninguna>") else None,
+                              multi=multi_lbl, fuente=fuente)
+            st.markdown(f"**Resumen de categorías ({'auto + manual' if fuente == 'final' else 'auto'})**")
+            st.dataframe(res_cod, use_container_width=True, hide_index=True)
 
             # Exportar CSV
             st.download_button(
@@ -772,200 +657,29 @@ Este es un manual de respaldo. Para mostrar tu manual propio:
         st.error(f"No se pudo renderizar el manual: {e}")
         st.text_area("Contenido de respaldo", value=DEFAULT_MD, height=320)
 
-# ---- TEXTO (abiertas) ----
-with tabTXT:
-    st.subheader("Análisis de preguntas abiertas")
-
-    # 🔌 Interruptor: evita ejecutar nada si la pestaña no se usa
-    activar_texto = st.toggle("Activar análisis de texto (abiertas)", value=False, help="Activa para calcular frecuencias y nubes")
-    if not activar_texto:
-        st.info("Activa el análisis para calcular frecuencias y nubes de palabras.")
-        st.stop()
-
-    import re, numpy as np, pandas as pd
-    import nltk
-    from sklearn.feature_extraction.text import CountVectorizer
-    from wordcloud import WordCloud
-    from unidecode import unidecode
-
-    # Garantizar stopwords español
-    try:
-        from nltk.corpus import stopwords
-        _ = stopwords.words("spanish")
-    except:
-        nltk.download("stopwords")
-        from nltk.corpus import stopwords
-
-    stop_es = set(stopwords.words("spanish")) | {
-        "si","no","sì","sí","mas","más","tambien","también","pues","porque",
-        "q","que","ya","solo","sólo","alli","allí","ahi","ahí","aqui","aquí"
-    }
-
-    MISSING_LABELS = {
-        "", "(Sin dato)", "No contestó", "No contesto", "No respondió", "No responde",
-        "No sabe/No responde", "NS/NR", "Ns/Nr", "NSNR", "No aplica", "NA", "N/A",
-        "Sin respuesta", "NR"
-    }
-    MISSING_TEXT_PATTERNS = (
-        r"^no\s*contesta.?$|^no\s*respond[eió].?$|^ns/?nr$|^no\s*sabe\s*/?\s*no\s*responde$|^sin\s*respuesta$|^na$|^n/?a$",
-    )
-    def is_missing_text(s: str) -> bool:
-        s = str(s or "").strip().lower()
-        if s in {m.lower() for m in MISSING_LABELS}: return True
-        for pat in MISSING_TEXT_PATTERNS:
-            if re.match(pat, s, flags=re.I): return True
-        return False
-
-    def norm(s):
-        if pd.isna(s): return ""
-        s = str(s).replace("\n"," ").lower()
-        s = re.sub(r"\s+", " ", s).strip()
-        return unidecode(s)
-
-    text_cols = [c for c in [p040, p041, p38tx, p024] if c != "<ninguna>" and c in work.columns]
-    if not text_cols:
-        st.warning("Selecciona al menos una columna abierta (p040, p041, p38tx, p024) en la barra lateral.")
-        st.stop()
-
-    st.caption("Columnas analizadas: " + ", ".join(text_cols))
-
-    corpora = {}
-    for col in text_cols:
-        raw = work[col].astype(str)
-        raw = raw[~raw.map(is_missing_text)]
-        txt = raw.map(norm)
-        txt = txt[txt.str.len() > 0]
-        corpora[col] = txt
-
-    st.markdown("### Frecuencias")
-    n_top = st.slider("Top términos a mostrar", 10, 50, 20, key="txt_topn")
-
-    def top_ngrams(series, n=1, top=20):
-        series = series[series.str.len() > 0]
-        if series.empty:
-            return pd.DataFrame(columns=["término","frecuencia"])
-        vect = CountVectorizer(ngram_range=(n,n), stop_words=list(stop_es), min_df=2)
-        try:
-            X = vect.fit_transform(series)
-        except ValueError:
-            return pd.DataFrame(columns=["término","frecuencia"])
-        if X.shape[1] == 0:
-            return pd.DataFrame(columns=["término","frecuencia"])
-        freqs = np.asarray(X.sum(axis=0)).ravel()
-        vocab = np.array(vect.get_feature_names_out())
-        order = freqs.argsort()[::-1][:top]
-        return pd.DataFrame({"término": vocab[order], "frecuencia": freqs[order]})
-
-    for col in text_cols:
-        st.markdown(f"**{col}**")
-        s = corpora[col]
-        if s.empty:
-            st.info("Sin texto utilizable (todo fue vacío o no-respuesta).")
-            continue
-        c1, c2 = st.columns(2)
-        with c1:
-            st.write("Unigramas (palabras)")
-            st.dataframe(top_ngrams(s, 1, n_top), use_container_width=True)
-        with c2:
-            st.write("Bigramas (parejas de palabras)")
-            st.dataframe(top_ngrams(s, 2, n_top), use_container_width=True)
-
-    st.markdown("### Nube de palabras")
-    col_wc = st.selectbox("Selecciona columna para la nube", options=text_cols, index=0, key="sel_wc")
-    txt_series = corpora.get(col_wc, pd.Series(dtype=str))
-    txt_wc = " ".join(txt_series.tolist()).strip()
-
-    if len(txt_wc) < 3:
-        st.info("No hay texto suficiente para generar la nube (se excluyeron vacíos / No contestó).")
-    else:
-        try:
-            wc = WordCloud(width=1000, height=400, background_color="white",
-                           stopwords=stop_es, collocations=False).generate(txt_wc)
-            img = wc.to_array()
-            if img is None:
-                st.info("No fue posible generar la imagen de la nube con el texto disponible.")
-            else:
-                st.image(img, use_container_width=True)
-        except Exception as e:
-            st.warning(f"No se pudo generar la nube: {e}")
-
-
 with tabEXPORT:
     st.subheader("Exportar anexos a Excel (tabulados y cruces)")
-    sheets = {}
-    if p004!="<ninguna>": sheets["B_p004"] = vc_percent(work, p004, by=sector if sector!='<ninguna>' else None)
-    if p005!="<ninguna>": sheets["B_p005"] = vc_percent(work, p005, by=sector if sector!='<ninguna>' else None)
-    if p006!="<ninguna>": sheets["B_p006"] = vc_percent(work, p006, by=sector if sector!='<ninguna>' else None)
-    if p007!="<ninguna>": sheets["B_p007"] = vc_percent(work, p007, by=sector if sector!='<ninguna>' else None)
-    if p008!="<ninguna>": sheets["B_p008"] = vc_percent(work, p008, by=sector if sector!='<ninguna>' else None)
-    if p004!="<ninguna>" and p005!="<ninguna>": sheets["B_p004x_p005"] = crosstab_pct(work, p004, p005, by=sector if sector!='<ninguna>' else None)
-    for other, key in [(p006,"p005x_p006"),(p007,"p005x_p007"),(p008,"p005x_p008")]:
-        if p005!="<ninguna>" and other!="<ninguna>":
-            sheets[f"B_{key}"] = crosstab_pct(work, p005, other, by=sector if sector!='<ninguna>' else None)
-    for other, key in [(p006,"p004x_p006"),(p007,"p004x_p007"),(p008,"p004x_p008")]:
-        if p004!="<ninguna>" and other!="<ninguna>":
-            sheets[f"B_{key}"] = crosstab_pct(work, p004, other, by=sector if sector!='<ninguna>' else None)
+    # Plan B–G completo por sector; se genera sólo al pedirlo (antes se recalculaba en cada rerun)
+    panel_anexo(work, roles, by=sector if sector != "<ninguna>" else None, key="exp_anexo")
+    if sector != "<ninguna>":
+        st.markdown("**Un libro por sector**")
+        st.caption("Totales (por sector) y un libro por cada sector, en paralelo; se descargan juntos en un zip.")
+        panel_anexo(work, roles, by=sector, key="exp_lote", por_sector=sector)
+
 # ---- MAPA GPS ----
 with tabMAP:
     st.subheader("Mapa de coordenadas GPS")
-
     if lat_col != "<ninguna>" and lon_col != "<ninguna>":
-        m = work.copy()
-
-        # Convertir a numérico y limpiar
-        m["_lat"] = pd.to_numeric(m[lat_col], errors="coerce")
-        m["_lon"] = pd.to_numeric(m[lon_col], errors="coerce")
-        m = m.dropna(subset=["_lat", "_lon"])
-        m = m[(m["_lat"].between(-90, 90)) & (m["_lon"].between(-180, 180))]
-
-        if m.empty:
-            st.info("No hay coordenadas válidas después de la limpieza.")
-        else:
-            # st.map requiere columnas 'lat' y 'lon'
-            map_df = m.rename(columns={"_lat": "lat", "_lon": "lon"})[["lat", "lon"]]
-            st.map(map_df, use_container_width=True)
-            st.caption(f"{len(map_df):,} puntos mostrados.")
+        panel_mapa(work, lat_col, lon_col, sector,
+                   cols_indicador=[c for c in (sector, p004, p005, p006, p007, p008, p010, sexoj, p015, p018,
+                                               p021, p027, p035, p036) if c != "<ninguna>"])
     else:
         st.info("Selecciona las columnas de LATITUD y LONGITUD en la barra lateral.")
 
-    subC = work.copy()
-    if p004!="<ninguna>":
-        subC = subC[[True if is_vivienda_or_mixto(v) else False for v in subC[p004]]]
-    for col, key in [(nviv,"C_nvivienda"),(p009a,"C_p009a"),(p009b,"C_p009b"),(p010,"C_p010"),(sexoj,"C_sexoj"),(p011,"C_p011")]:
-        if col!="<ninguna>": sheets[key] = vc_percent(subC, col, by=sector if sector!='<ninguna>' else None)
-    for r,c,key in [(sexoj,p010,"C_sexoj_x_p010"),(sexoj,p015,"C_sexoj_x_p015"),(sexoj,p005,"C_sexoj_x_p005"),
-                    (sexoj,p014,"C_sexoj_x_p014"),(sexoj,p011,"C_sexoj_x_p011"),(p010,p015,"C_p010_x_p015"),
-                    (p010,p005,"C_p010_x_p005")]:
-        if r!="<ninguna>" and c!="<ninguna>": sheets[key] = crosstab_pct(subC, r, c, by=sector if sector!='<ninguna>' else None)
-
-    subD = subC
-    for col, key in [(p012,"D_p012"),(p013,"D_p013"),(p014,"D_p014"),(p022,"D_p022")]:
-        if col!="<ninguna>": sheets[key] = vc_percent(subD, col, by=sector if sector!='<ninguna>' else None)
-    for r,c,key in [(p014,sexoj,"D_p014_x_sexoj"),(p013,p011,"D_p013_x_p011"),(p022,p010,"D_p022_x_p010"),(p022,p015,"D_p022_x_p015")]:
-        if r!="<ninguna>" and c!="<ninguna>": sheets[key] = crosstab_pct(subD, r, c, by=sector if sector!='<ninguna>' else None)
-
-    subE = subC
-    for col, key in [(p015,"E_p015"),(p016,"E_p016"),(p017,"E_p017"),(p018,"E_p018"),(p019,"E_p019"),(p020,"E_p020"),(p021,"E_p021")]:
-        if col!="<ninguna>": sheets[key] = vc_percent(subE, col, by=sector if sector!='<ninguna>' else None)
-    for r,c,key in [(p015,p010,"E_p015_x_p010"),(p015,sexoj,"E_p015_x_sexoj"),(p015,p005,"E_p015_x_p005"),
-                    (p016,p017,"E_p016_x_p017"),(p018,p019,"E_p018_x_p019"),(p020,p021,"E_p020_x_p021")]:
-        if r!="<ninguna>" and c!="<ninguna>": sheets[key] = crosstab_pct(subE, r, c, by=sector if sector!='<ninguna>' else None)
-
-    subF = work.copy()
-    if p004!="<ninguna>":
-        subF = subF[[True if is_negocio_or_mixto(v) else False for v in subF[p004]]]
-    for col, key in [(p025,"F_p025"),(p026,"F_p026"),(p027,"F_p027"),(p028,"F_p028"),(p029,"F_p029"),(p030,"F_p030"),(p031,"F_p031"),(p032,"F_p032")]:
-        if col!="<ninguna>": sheets[key] = vc_percent(subF, col, by=sector if sector!='<ninguna>' else None)
-    for r,c,key in [(p025,p027,"F_p025_x_p027"),(p027,p028,"F_p027_x_p028"),(p030,p029,"F_p030_x_p029"),(p026,p027,"F_p026_x_p027"),(p031,p027,"F_p031_x_p027")]:
-        if r!="<ninguna>" and c!="<ninguna>": sheets[key] = crosstab_pct(subF, r, c, by=sector if sector!='<ninguna>' else None)
-
-    for col, key in [(p036,"G_p036"),(p035,"G_p035"),(p035tx,"G_p035tx")]:
-        if col!="<ninguna>": sheets[key] = vc_percent(work, col, by=sector if sector!='<ninguna>' else None)
-    for r,c,key in [(p036,p004,"G_p036_x_p004"),(p036,sexoj,"G_p036_x_sexoj"),(p035,p035tx,"G_p035_x_p035tx")]:
-        if r!="<ninguna>" and c!="<ninguna>": sheets[key] = crosstab_pct(work, r, c, by=sector if sector!='<ninguna>' else None)
-
-    if sheets:
-        data = export_xlsx(sheets)
-        st.download_button("⬇️ Descargar Anexo Estadístico (Excel)", data=data, file_name="anexo_estadistico.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    else:
-        st.info("Configura el mapeo de variables para habilitar la exportación.")
+# ---- Nube de palabras (dibujada en segundo plano mientras se pintaba el resto)
+if nube_pendiente is not None:
+    ph, fut = nube_pendiente
+    try:
+        ph.image(fut.result().array, use_column_width=True)
+    except Exception as e:
+        ph.warning(f"No se pudo generar la nube: {e}")
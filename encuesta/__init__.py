@@ -0,0 +1 @@
+"""Utilidades compartidas por los tableros (app.py, appfn.py, app1.py)."""
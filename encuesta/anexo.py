@@ -0,0 +1,330 @@
+# Anexo estadístico como trabajo bajo demanda: el libro (o el zip con un libro por sector)
+# se genera sólo al pedirlo, en un hilo aparte que informa su avance, y los bytes quedan en
+# una caché LRU en memoria con clave = huella de (datos filtrados, mapeo, desagregación, plan).
+# panel_anexo es la interfaz común de los tableros (botón, avance y descarga).
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from .excel import escribir_libro, libro_bytes
+from .paralelo import enviar, jobs_default
+from .tabulados import ROLES_INDICADORES, build_table, indicadores, plan_tables, table_columns
+
+MAX_ANEXOS = 8
+_FORMATO = "2"   # subir si cambia el contenido o el formato del libro
+HOJA_INDICADORES = "I_indicadores"
+
+_CACHE: "OrderedDict[str, bytes]" = OrderedDict()
+_TRABAJOS: dict = {}
+_LOCK = threading.Lock()
+_HILO = ThreadPoolExecutor(max_workers=1, thread_name_prefix="anexo")
+
+
+def entradas(m: dict, keys=None) -> list:
+    """Entradas del plan con sus variables mapeadas (sólo `keys`, si se da)."""
+    return [e for e in plan_tables(m) if keys is None or e[0] in keys]
+
+
+def _columnas(df: pd.DataFrame, m: dict, plan: list, con_indicadores: bool = False) -> list:
+    """Columnas que necesita el plan (y los indicadores, si se piden)."""
+    cols = set().union(*(table_columns(e, m) for e in plan)) if plan else set()
+    if con_indicadores:
+        cols |= {m[r] for r in ROLES_INDICADORES if m.get(r) not in (None, "<ninguna>")}
+    return sorted(cols & set(df.columns))
+
+
+def huella_anexo(df: pd.DataFrame, m: dict, by: str | None = None, keys=None) -> str:
+    """Clave de caché: contenido e índice (= filtros) de las columnas que usa el plan,
+    mapeo de roles, desagregación y tablas pedidas."""
+    plan = entradas(m, keys)
+    cols = _columnas(df, m, plan)
+    h = hashlib.sha1(_FORMATO.encode())
+    h.update(pd.util.hash_pandas_object(df.index.to_series(), index=False).to_numpy().tobytes())
+    for c in cols:
+        h.update(c.encode("utf-8"))
+        h.update(pd.util.hash_pandas_object(df[c], index=False).to_numpy().tobytes())
+    meta = [sorted((k, str(v)) for k, v in m.items()), by, [list(map(str, e)) for e in plan]]
+    h.update(json.dumps(meta, ensure_ascii=False, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+@dataclass
+class Trabajo:
+    clave: str
+    total: int
+    hechas: int = 0
+    etapa: str = "En cola"
+    futuro: Future = field(default_factory=Future)
+    tiempos: list = field(default_factory=list)   # lote: {libro, hojas, segundos}
+
+    @property
+    def progreso(self) -> float:
+        """0..1; el cierre del libro cuenta como un paso más."""
+        return min(self.hechas / (self.total + 1), 1.0)
+
+    def listo(self) -> bool:
+        return self.futuro.done()
+
+    def resultado(self) -> bytes:
+        return self.futuro.result()
+
+
+def trabajo_anexo(clave: str) -> Trabajo | None:
+    """Trabajo en curso o terminado para esa huella (None si nunca se pidió o ya salió
+    de la caché)."""
+    with _LOCK:
+        return _TRABAJOS.get(clave)
+
+
+def _guardar(clave: str, data: bytes):
+    with _LOCK:
+        _CACHE[clave] = data
+        _CACHE.move_to_end(clave)
+        while len(_CACHE) > MAX_ANEXOS:
+            viejo, _ = _CACHE.popitem(last=False)
+            _TRABAJOS.pop(viejo, None)
+
+
+def _lanzar(clave: str, total: int, tarea) -> Trabajo:
+    """Encola tarea(trabajo) -> bytes una sola vez por clave (aunque varias sesiones la
+    pidan); si ya está en caché, el Trabajo nace terminado. Un trabajo fallido se relanza."""
+    with _LOCK:
+        t = _TRABAJOS.get(clave)
+        if t is not None and not (t.listo() and t.futuro.exception() is not None):
+            return t
+        t = _TRABAJOS[clave] = Trabajo(clave, total=total)
+        if clave in _CACHE:
+            t.hechas, t.etapa = t.total + 1, "Listo"
+            t.futuro.set_result(_CACHE[clave])
+            return t
+
+    def correr():
+        if not t.futuro.set_running_or_notify_cancel():
+            return
+        try:
+            data = tarea(t)
+            _guardar(clave, data)
+            t.hechas, t.etapa = t.total + 1, "Listo"
+            t.futuro.set_result(data)
+        except Exception as e:
+            t.etapa = "Error"
+            t.futuro.set_exception(e)
+
+    _HILO.submit(correr)
+    return t
+
+
+def hojas_anexo(df: pd.DataFrame, m: dict, by: str | None = None, keys=None, con_indicadores: bool = False):
+    """Genera (hoja, tabla) en el orden del plan; al final, los indicadores del bloque I
+    si se piden. Cada tabla se calcula sólo cuando el escritor la pide."""
+    cache = {}
+    for entry in entradas(m, keys):
+        yield entry[0], build_table(df, entry, m, by=by, _cache=cache)
+    if con_indicadores:
+        yield HOJA_INDICADORES, indicadores(df, m, by=by)
+
+
+def _bloque(df: pd.DataFrame, m: dict, by, keys) -> list:
+    """Tablas de un subconjunto del plan (corre en un proceso del pool)."""
+    return list(hojas_anexo(df, m, by, keys))
+
+
+def escribir_anexo(destino: str, df: pd.DataFrame, m: dict, by: str | None = None, keys=None,
+                   jobs: int = 1, con_indicadores: bool = False) -> int:
+    """Escribe el anexo en `destino`. Con jobs > 1 las tablas se reparten por bloques en
+    el pool de procesos y se escriben en el orden del plan a medida que llegan.
+    Devuelve nº de hojas."""
+    plan = entradas(m, keys)
+    if jobs <= 1 or len(plan) < 2:
+        return escribir_libro(hojas_anexo(df, m, by, keys, con_indicadores), destino)
+    df = df[_columnas(df, m, plan, con_indicadores)]
+    # tramos contiguos del plan ordenado por subconjunto (todos/vivienda/negocio): cada
+    # proceso filtra sólo los subconjuntos de su tramo, una vez cada uno
+    orden = [e[0] for e in sorted(plan, key=lambda e: e[1])]
+    paso = -(-len(orden) // min(jobs, len(orden)))
+    bloques = [orden[i:i + paso] for i in range(0, len(orden), paso)]
+    futs = [enviar(_bloque, df, m, by, set(b), jobs=jobs) for b in bloques]
+
+    def hojas():
+        listas = {}
+        for f in futs:
+            listas.update(f.result())
+        for e in plan:
+            yield e[0], listas.pop(e[0])
+        if con_indicadores:
+            yield HOJA_INDICADORES, indicadores(df, m, by=by)
+
+    return escribir_libro(hojas(), destino)
+
+
+def lanzar_anexo(df: pd.DataFrame, m: dict, by: str | None = None, keys=None,
+                 clave: str | None = None) -> Trabajo:
+    """Encola la generación del anexo y devuelve el Trabajo para seguir su avance."""
+    clave = clave or huella_anexo(df, m, by, keys)
+    plan = entradas(m, keys)
+    df = df[_columnas(df, m, plan)].copy()   # el hilo trabaja sobre su propia copia
+
+    def tarea(t: Trabajo) -> bytes:
+        def hojas():
+            # cada tabla se escribe en cuanto se calcula: en memoria sólo hay una a la vez
+            for hoja in hojas_anexo(df, m, by, keys):
+                yield hoja
+                t.hechas += 1
+
+        t.etapa = "Tabulando"
+        return libro_bytes(hojas())
+
+    return _lanzar(clave, len(plan), tarea)
+
+
+# ---------- Lote: un libro por sector + totales, en un zip ----------
+def nombre_archivo(nombre, usados: set) -> str:
+    """Nombre de archivo seguro y único a partir de una etiqueta de sector."""
+    base = re.sub(r"[^\w\-]+", "_", str(nombre), flags=re.UNICODE).strip("_") or "sin_nombre"
+    cand, k = base[:80], 1
+    while cand.lower() in usados:
+        k += 1
+        cand = f"{base[:80]}_{k}"
+    usados.add(cand.lower())
+    return cand
+
+
+def _libro(i: int, df: pd.DataFrame, m: dict, by, keys, tmpdir: str, con_indicadores: bool) -> tuple:
+    """Un libro del lote en un .xlsx temporal (corre en un proceso del pool)."""
+    t0 = time.perf_counter()
+    fd, ruta = tempfile.mkstemp(suffix=".xlsx", dir=tmpdir)
+    os.close(fd)
+    n = escribir_libro(hojas_anexo(df, m, by, keys, con_indicadores), ruta, tmpdir)
+    return i, ruta, time.perf_counter() - t0, n
+
+
+def escribir_lote(destino: str, df: pd.DataFrame, m: dict, sector_col: str, by: str | None = None,
+                  keys=None, jobs: int | None = None, con_indicadores: bool = False, avance=None) -> list:
+    """Zip en `destino` con el libro de Totales (desagregado por `by`) y un libro por
+    cada valor de `sector_col`. Los libros se reparten en el pool de procesos de
+    encuesta.paralelo (`jobs`; 1 = en este proceso). avance(fila) se llama al terminar
+    cada libro; devuelve las filas {libro, hojas, segundos} en orden de llegada."""
+    plan = entradas(m, keys)
+    df = df[sorted(set(_columnas(df, m, plan, con_indicadores)) | {sector_col})]
+    sectores = sorted(df[sector_col].dropna().unique(), key=str)
+    libros = [("Totales", df, by)] + [(s, df[df[sector_col] == s], None) for s in sectores]
+    jobs = jobs_default() if jobs is None else max(int(jobs), 1)
+    tmpdir = tempfile.mkdtemp(prefix="anexo_lote_")
+    try:
+        args = [(i, d, m, b, keys, tmpdir, con_indicadores) for i, (_, d, b) in enumerate(libros)]
+        if jobs == 1:
+            hechos = (_libro(*a) for a in args)
+        else:
+            hechos = (f.result() for f in as_completed([enviar(_libro, *a, jobs=jobs) for a in args]))
+        rutas, tiempos = {}, []
+        for i, ruta, seg, n in hechos:
+            rutas[i] = ruta
+            tiempos.append({"libro": str(libros[i][0]), "hojas": n, "segundos": round(seg, 2)})
+            if avance is not None:
+                avance(tiempos[-1])
+        usados = set()
+        # los .xlsx ya vienen comprimidos: ZIP_STORED evita recomprimirlos
+        with zipfile.ZipFile(destino, "w", zipfile.ZIP_STORED) as z:
+            for i, (nombre, _, _) in enumerate(libros):
+                z.write(rutas[i], f"anexo_{nombre_archivo(nombre, usados)}.xlsx")
+        return tiempos
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def huella_lote(df: pd.DataFrame, m: dict, sector_col: str, by: str | None = None, keys=None) -> str:
+    return "lote:" + hashlib.sha1((sector_col + huella_anexo(df, m, by, keys)).encode("utf-8")).hexdigest()
+
+
+def lanzar_lote(df: pd.DataFrame, m: dict, sector_col: str, by: str | None = None, keys=None,
+                jobs: int | None = None, clave: str | None = None) -> Trabajo:
+    """Encola escribir_lote; el avance cuenta libros terminados y Trabajo.tiempos guarda
+    hojas y segundos por libro."""
+    clave = clave or huella_lote(df, m, sector_col, by, keys)
+    # el hilo trabaja sobre su propia copia, sólo de las columnas del plan, sector y `by`
+    df = df[sorted(set(_columnas(df, m, entradas(m, keys))) | {sector_col} | ({by} if by else set()))].copy()
+    total = 1 + df[sector_col].nunique()
+
+    def tarea(t: Trabajo) -> bytes:
+        def avance(fila):
+            t.tiempos.append(fila)
+            t.hechas += 1
+
+        t.etapa = "Generando libros"
+        fd, ruta = tempfile.mkstemp(suffix=".zip")
+        os.close(fd)
+        try:
+            escribir_lote(ruta, df, m, sector_col, by, keys, jobs, avance=avance)
+            with open(ruta, "rb") as f:
+                return f.read()
+        finally:
+            os.remove(ruta)
+
+    return _lanzar(clave, total, tarea)
+
+
+# ---------- Panel para los tableros (botón, avance y descarga) ----------
+def panel_anexo(df, m, by=None, keys=None, key="anexo", por_sector=None):
+    """Botón -> trabajo en segundo plano con barra de avance -> descarga. El libro queda
+    guardado mientras no cambien los datos, los filtros, el mapeo ni el plan. Con
+    `por_sector` (columna), un zip con el libro de Totales y uno por cada sector.
+    Streamlit se importa aquí: el resto del módulo (y la CLI) no lo necesita."""
+    import streamlit as st
+
+    lote = por_sector is not None
+    clave = huella_lote(df, m, por_sector, by, keys) if lote else huella_anexo(df, m, by, keys)
+    t = trabajo_anexo(clave)
+    if t is None:
+        n = len(entradas(m, keys))
+        if not n:
+            st.info("Configura el mapeo de variables para habilitar la exportación.")
+            return
+        etiqueta = (f"🗂️ Generar un libro por sector ({df[por_sector].nunique()} + Totales, zip)" if lote
+                    else f"⚙️ Generar anexo ({n} tablas)")
+        if not st.button(etiqueta, key=f"{key}_gen"):
+            if not lote:
+                st.caption("El libro se genera al pedirlo y se conserva mientras no cambien los datos, los filtros ni el mapeo.")
+            return
+        t = (lanzar_lote(df, m, por_sector, by, keys, clave=clave) if lote
+             else lanzar_anexo(df, m, by, keys, clave=clave))
+    sondeo = not t.listo()
+
+    @st.fragment(run_every=0.5 if sondeo else None)
+    def _avance():
+        if not t.listo():
+            unidad = "libros" if lote else "tablas"
+            st.progress(t.progreso, text=f"{t.etapa}… {min(t.hechas, t.total)}/{t.total} {unidad}")
+            if t.tiempos:
+                st.dataframe(pd.DataFrame(t.tiempos), hide_index=True, use_container_width=True)
+        elif sondeo:
+            st.rerun()   # terminó: un rerun completo deja de sondear y muestra la descarga
+        elif t.futuro.exception() is not None:
+            st.error(f"No se pudo generar el anexo: {t.futuro.exception()}")
+            if st.button("Reintentar", key=f"{key}_reintentar"):
+                (lanzar_lote(df, m, por_sector, by, keys, clave=clave) if lote
+                 else lanzar_anexo(df, m, by, keys, clave=clave))
+                st.rerun()
+        elif lote:
+            st.download_button("⬇️ Descargar anexos por sector (zip)", data=t.resultado(),
+                               file_name="anexos_por_sector.zip", mime="application/zip", key=f"{key}_dl")
+            if t.tiempos:
+                tiempos = pd.DataFrame(t.tiempos)
+                st.caption(f"{len(tiempos)} libros · {tiempos['segundos'].sum():,.1f} s de cálculo en total.")
+                st.dataframe(tiempos, hide_index=True, use_container_width=True)
+        else:
+            st.download_button("⬇️ Descargar Anexo Estadístico (Excel)", data=t.resultado(),
+                               file_name="anexo_estadistico.xlsx",
+                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                               key=f"{key}_dl")
+    _avance()
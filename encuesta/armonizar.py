@@ -0,0 +1,120 @@
+# Armonización de categorías: agrupa variantes de escritura ("Vivienda–negocio",
+# "vivienda-negocio", "VIVIENDA NEGOCIO") y las fusiona vía códigos de categoría.
+import json, os, re, unicodedata
+from difflib import SequenceMatcher
+
+import numpy as np
+import pandas as pd
+
+ARMONIZACION_PATH = "data/armonizacion.json"
+
+# Columnas con más valores distintos que esto se consideran texto libre
+MAX_DISTINCT = 400
+
+_DASHES = re.compile(r"[‐-―−_/]+")
+_NON_ALNUM = re.compile(r"[^a-z0-9 ]+")
+_SPACES = re.compile(r"\s+")
+
+
+def norm_key(s) -> str:
+    """Clave normalizada: minúsculas, sin acentos, guiones/puntuación -> espacio."""
+    s = _DASHES.sub(" ", str(s).lower().replace("-", " "))
+    s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode("ascii")
+    s = _NON_ALNUM.sub(" ", s)
+    return _SPACES.sub(" ", s).strip()
+
+
+def propose_merges(s: pd.Series, threshold: float = 0.88) -> pd.DataFrame:
+    """Propone fusiones sobre los valores DISTINTOS de una columna.
+
+    1) Variantes con la misma clave normalizada se agrupan directamente.
+    2) Claves distintas se unen si su similitud (difflib) >= threshold.
+    El canónico de cada grupo es la variante más frecuente.
+    Devuelve una fila por variante a fusionar: valor, canonico, n, similitud.
+    """
+    cols = ["valor", "canonico", "n", "similitud"]
+    vc = s.dropna().astype(str).str.strip()
+    vc = vc[vc != ""].value_counts()
+    if vc.empty or len(vc) > MAX_DISTINCT:
+        return pd.DataFrame(columns=cols)
+
+    keys = pd.Series([norm_key(v) for v in vc.index], index=vc.index)
+    uniq = list(dict.fromkeys(keys.tolist()))
+
+    # union-find sobre claves distintas (k^2 sólo sobre k claves, no sobre filas)
+    parent = list(range(len(uniq)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    sim = {}
+    for i in range(len(uniq)):
+        sm = SequenceMatcher(None, uniq[i], autojunk=False)
+        for j in range(i + 1, len(uniq)):
+            sm.set_seq2(uniq[j])
+            if sm.real_quick_ratio() < threshold or sm.quick_ratio() < threshold:
+                continue
+            r = sm.ratio()
+            if r >= threshold:
+                parent[find(j)] = find(i)
+                sim[uniq[j]] = max(sim.get(uniq[j], 0.0), r)
+                sim[uniq[i]] = max(sim.get(uniq[i], 0.0), r)
+
+    key_pos = {k: i for i, k in enumerate(uniq)}
+    groups = pd.DataFrame({"valor": vc.index, "n": vc.values,
+                           "grupo": [find(key_pos[k]) for k in keys.values],
+                           "clave": keys.values})
+    # value_counts ya viene ordenado desc: la primera variante del grupo es la canónica
+    groups["canonico"] = groups.groupby("grupo")["valor"].transform("first")
+    out = groups[groups["valor"] != groups["canonico"]].copy()
+    if out.empty:
+        return pd.DataFrame(columns=cols)
+    out["similitud"] = [1.0 if k == norm_key(c) else round(sim.get(k, 0.0), 3)
+                        for k, c in zip(out["clave"], out["canonico"])]
+    return out[cols].sort_values(["canonico", "n"], ascending=[True, False]).reset_index(drop=True)
+
+
+def apply_mapping(s: pd.Series, mapping: dict) -> pd.Series:
+    """Aplica {variante: canónico} remapeando CÓDIGOS de categoría (sin .map por fila)."""
+    if not mapping:
+        return s
+    cat = s.astype("category")
+    old = cat.cat.categories
+    target = [mapping.get(str(c), str(c)) for c in old]
+    new_cats = pd.Index(pd.unique(pd.Series(target, dtype=object)))
+    remap = new_cats.get_indexer(target)
+    codes = cat.cat.codes.to_numpy()
+    new_codes = np.where(codes >= 0, remap[codes], -1)
+    return pd.Series(pd.Categorical.from_codes(new_codes, categories=new_cats),
+                     index=s.index, name=s.name)
+
+
+def aplicar_armonizacion(df: pd.DataFrame, mappings: dict) -> pd.DataFrame:
+    """Aplica los mapeos aprobados (por columna) a las columnas presentes en df."""
+    if not mappings:
+        return df
+    out = df.copy()
+    for col, mapping in mappings.items():
+        if col in out.columns and mapping:
+            out[col] = apply_mapping(out[col], mapping)
+    return out
+
+
+def cargar_mapeos(path: str = ARMONIZACION_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as fh:
+            data = json.load(fh)
+        return {str(k): {str(a): str(b) for a, b in v.items()} for k, v in data.items()}
+    except Exception:
+        return {}
+
+
+def guardar_mapeos(mappings: dict, path: str = ARMONIZACION_PATH) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    clean = {k: v for k, v in mappings.items() if v}
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(clean, fh, ensure_ascii=False, indent=2, sort_keys=True)
@@ -0,0 +1,94 @@
+# Anexo estadístico sin navegador (cron, pipelines):
+#   python -m encuesta.cli --mapeo data/mapeo_variables.json --salida anexo_estadistico.xlsx
+# Mismo motor que los tableros: lectura y preparación de encuesta.datos, plan B–G de
+# encuesta.tabulados, indicadores del bloque I y escritura en streaming de encuesta.excel.
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+from .anexo import entradas, escribir_anexo, escribir_lote
+from .datos import CODEBOOK_PATH, DATA_PATH_XLSX, MAPEO_PATH, cargar_mapeo, leer_base, preparar
+from .paralelo import jobs_default
+
+
+def _args(argv=None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(
+        prog="python -m encuesta.cli",
+        description="Genera el anexo estadístico (tabulados B–G + indicadores) sin Streamlit.")
+    ap.add_argument("--datos", default=DATA_PATH_XLSX, help=f"base CSV/Excel (por defecto {DATA_PATH_XLSX})")
+    ap.add_argument("--codebook", default=CODEBOOK_PATH, help=f"Codebook (por defecto {CODEBOOK_PATH}; se omite si no existe)")
+    ap.add_argument("--mapeo", default=MAPEO_PATH,
+                    help=f"JSON rol -> columna, el que descarga el tablero (por defecto {MAPEO_PATH}; "
+                         "sin archivo, cada rol usa la columna de igual nombre)")
+    ap.add_argument("--salida", default=None,
+                    help="archivo de salida (por defecto anexo_estadistico.xlsx, o anexos_por_sector.zip con --por-sector)")
+    ap.add_argument("--sector", action="append", default=[], metavar="VALOR",
+                    help="limita la base a ese sector (repetible), como la vista «Sólo un sector»")
+    ap.add_argument("--por-sector", action="store_true",
+                    help="un libro por sector además del de Totales, en un zip")
+    ap.add_argument("--desagregar", action="store_true", help="tablas de Totales desagregadas por sector")
+    ap.add_argument("--jobs", type=int, default=None, help=f"procesos en paralelo (por defecto {jobs_default()})")
+    ap.add_argument("--sin-etiquetas", action="store_true", help="no aplicar las etiquetas del Codebook")
+    ap.add_argument("--sin-armonizar", action="store_true", help="no aplicar data/armonizacion.json")
+    return ap.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    a = _args(argv)
+    jobs = jobs_default() if a.jobs is None else max(a.jobs, 1)
+    salida = a.salida or ("anexos_por_sector.zip" if a.por_sector else "anexo_estadistico.xlsx")
+    tiempos = []
+    t0 = time.perf_counter()
+
+    def etapa(nombre, desde, detalle=""):
+        tiempos.append((nombre, time.perf_counter() - desde, detalle))
+
+    t = time.perf_counter()
+    if not os.path.exists(a.datos):
+        print(f"No se encontró la base {a.datos}.", file=sys.stderr)
+        return 2
+    df = leer_base(a.datos)
+    etapa("Lectura", t, f"{len(df):,} filas · {df.shape[1]} columnas")
+
+    t = time.perf_counter()
+    df = preparar(df, a.codebook, etiquetas=not a.sin_etiquetas, armonizar=not a.sin_armonizar)
+    m = cargar_mapeo(a.mapeo, df.columns)
+    if not os.path.exists(a.mapeo):
+        print(f"Aviso: no existe {a.mapeo}; roles asociados por nombre de columna.", file=sys.stderr)
+    sector = m.get("sector", "<ninguna>")
+    if (a.sector or a.por_sector or a.desagregar) and sector == "<ninguna>":
+        print("El mapeo no tiene columna de sector (rol «sector»).", file=sys.stderr)
+        return 2
+    if a.sector:
+        df = df[df[sector].astype(str).isin(a.sector)]
+        if df.empty:
+            print(f"Ningún registro con sector en {a.sector}.", file=sys.stderr)
+            return 2
+    plan = entradas(m)
+    if not plan:
+        print("Ninguna tabla del plan tiene todas sus variables mapeadas.", file=sys.stderr)
+        return 2
+    etapa("Preparación", t, f"{len(df):,} filas · {len(plan)} tablas del plan")
+
+    by = sector if a.desagregar else None
+    t = time.perf_counter()
+    if a.por_sector:
+        libros = escribir_lote(salida, df, m, sector, by=by, jobs=jobs, con_indicadores=True)
+        etapa("Tabulado y escritura", t, f"{len(libros)} libros · {jobs} procesos")
+    else:
+        n = escribir_anexo(salida, df, m, by=by, jobs=jobs, con_indicadores=True)
+        etapa("Tabulado y escritura", t, f"{n} hojas · {jobs} procesos")
+
+    print(f"Anexo -> {salida} ({os.path.getsize(salida) / 1024:,.0f} KB)")
+    for nombre, seg, detalle in tiempos + [("Total", time.perf_counter() - t0, "")]:
+        print(f"  {nombre:<22}{seg:8.2f} s  {detalle}")
+    if a.por_sector:
+        print(pd.DataFrame(libros).sort_values("segundos", ascending=False).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# Etiquetas de valor del Codebook: código -> etiqueta por variable, aplicadas
+# renombrando categorías (una operación por categoría distinta, no por fila).
+import numpy as np
+import pandas as pd
+
+from .armonizar import apply_mapping, norm_key
+
+# Nombres de columna aceptados en el Codebook (Esquema B del manual y Esquema A: variable|de|a)
+_VAR_COLS = ("variable",)
+_CODE_COLS = ("codigo", "code", "valor", "de")
+_LABEL_COLS = ("etiqueta del codigo", "etiqueta codigo", "etiqueta", "label", "a")
+
+
+def _find_col(columns, names):
+    keys = {norm_key(c): c for c in columns}
+    for n in names:
+        if n in keys:
+            return keys[n]
+    return None
+
+
+def code_key(v) -> str:
+    """Clave canónica de un código: 1, 1.0 y "1" -> "1"."""
+    if isinstance(v, (int, np.integer)):
+        return str(int(v))
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return str(v).strip()
+    if np.isfinite(f) and f.is_integer():
+        return str(int(f))
+    return str(v).strip()
+
+
+def build_value_labels(cb: pd.DataFrame) -> dict:
+    """{variable: {código: etiqueta}} a partir del Codebook (Variable rellenada hacia abajo)."""
+    if cb is None or cb.empty:
+        return {}
+    vcol = _find_col(cb.columns, _VAR_COLS)
+    ccol = _find_col(cb.columns, _CODE_COLS)
+    lcol = _find_col(cb.columns, _LABEL_COLS)
+    if vcol is None or ccol is None or lcol is None:
+        return {}
+    t = cb[[vcol, ccol, lcol]].copy()
+    t[vcol] = t[vcol].ffill()
+    t = t.dropna(subset=[vcol, ccol, lcol])
+    out = {}
+    for var, code, label in t.itertuples(index=False):
+        out.setdefault(str(var).strip(), {})[code_key(code)] = str(label).strip()
+    return out
+
+
+def match_variable(var: str, columns) -> str | None:
+    """Columna de datos para una variable del Codebook (ignora mayúsculas; admite nombres
+    truncados estilo Stata como 'p002__Lati~e')."""
+    low = {str(c).lower(): c for c in columns}
+    v = var.lower()
+    if v in low:
+        return low[v]
+    if "~" in v:
+        pre, suf = v.split("~", 1)
+        for lc, c in low.items():
+            if lc.startswith(pre) and lc.endswith(suf):
+                return c
+    return None
+
+
+def apply_value_labels(df: pd.DataFrame, labels: dict):
+    """Aplica las etiquetas del Codebook a las columnas que coinciden.
+
+    Devuelve (df_etiquetado, reporte) donde reporte lista los valores que no son
+    ni un código ni una etiqueta conocida: variable, columna, valor, n.
+    """
+    out = df.copy()
+    report = []
+    for var, codes in labels.items():
+        col = match_variable(var, out.columns)
+        if col is None or out[col].notna().sum() == 0:
+            continue
+        cat = out[col].astype("category")
+        known = set(codes.values())
+        mapping, unknown, hit = {}, [], False
+        for c in cat.cat.categories:
+            k = code_key(c)
+            hit |= k in codes
+            # los no reconocidos quedan como texto ("2.0" -> "2") para no mezclar tipos
+            mapping[str(c)] = codes.get(k, k)
+            if k not in codes and str(c).strip() not in known:
+                unknown.append(c)
+        if hit:
+            out[col] = apply_mapping(cat, mapping)
+        if unknown:
+            counts = cat.value_counts()
+            report += [(var, col, str(u), int(counts.get(u, 0))) for u in unknown]
+    return out, pd.DataFrame(report, columns=["variable", "columna", "valor", "n"])
@@ -0,0 +1,155 @@
+# Codificación automática por diccionario: el diccionario se compila una vez (palabras
+# sueltas en un conjunto, frases en una sola expresión tipo trie) y se aplica a los
+# textos DISTINTOS normalizados.
+import re
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from unidecode import unidecode
+
+from .paralelo import map_distintos
+from .textos import norm
+
+NO_CLASIFICADO = "No clasificado"
+
+DICCIONARIO_EJEMPLO = """salud: clinica|hospital|medico|enfermera|centro de salud|farmacia
+seguridad: robo|asalto|pandilla|violencia|iluminacion|policia
+vialidad: calle|bache|pavimento|tráfico|semáforo|pasarela
+agua: agua|tuberia|acueducto|pozo|lluvia
+residuos: basura|desecho|aseo|relleno|recoleccion|reciclaje
+otro: otro|varios|misc"""
+
+
+def parse_diccionario(texto: str):
+    """'categoria: palabra1|palabra2' por línea -> [(categoria, [palabras])] en orden
+    (el orden es la prioridad)."""
+    rules = []
+    for line in texto.splitlines():
+        if ":" in line:
+            cat, kw = line.split(":", 1)
+            cat = cat.strip()
+            kws = [w.strip() for w in kw.split("|") if w.strip()]
+            if cat and kws: rules.append((cat, kws))
+    return rules
+
+
+def _trie_regex(palabras) -> str:
+    """Alternativa equivalente a 'p1|p2|…' factorizando prefijos comunes (trie), para
+    que el motor no pruebe cada palabra por separado en cada posición."""
+    trie = {}
+    for w in palabras:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node):
+        fin = "" in node
+        alts = [re.escape(ch) + build(sub) for ch, sub in sorted(node.items()) if ch != ""]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if fin else body
+    return build(trie)
+
+
+def _es_palabra(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+_WORD = re.compile(r"\w+")
+
+
+@dataclass
+class Codificador:
+    categorias: list           # en orden de prioridad
+    simples: dict              # palabra clave de una sola palabra -> índices de categoría
+    patron: re.Pattern | None  # \b(?=(kw1|kw2|…)\b) para frases: coincidencias superpuestas
+    frases: dict               # frase normalizada -> índices de categoría
+    disparadores: frozenset    # primera palabra de cada frase (filtro previo)
+
+    def categorias_de(self, texto_norm: str) -> list:
+        """Índices de categoría (ordenados por prioridad) presentes en un texto normalizado.
+        Palabras sueltas: intersección de conjuntos; frases: la expresión compilada, sólo
+        si el texto contiene la primera palabra de alguna frase."""
+        toks = set(_WORD.findall(texto_norm))
+        hits = set()
+        for w in toks & self.simples.keys():
+            hits.update(self.simples[w])
+        if self.patron is not None and (None in self.disparadores or not self.disparadores.isdisjoint(toks)):
+            for m in self.patron.finditer(texto_norm):
+                hits.update(self.frases[m.group(1)])
+        return sorted(hits)
+
+
+def compilar(rules) -> Codificador:
+    """Compila el diccionario una sola vez. Las frases van en una sola expresión (trie);
+    en una misma posición el trie devuelve la frase más larga, y las frases que son
+    prefijo de ella (con límite de palabra) heredan su categoría."""
+    categorias = [cat for cat, _ in rules]
+    kw_cats = {}
+    for i, (_, kws) in enumerate(rules):
+        for w in kws:
+            k = unidecode(w.lower())
+            if k:
+                kw_cats.setdefault(k, set()).add(i)
+    simples = {k: sorted(v) for k, v in kw_cats.items() if _WORD.fullmatch(k)}
+    frases = {k: v for k, v in kw_cats.items() if k not in simples}
+    for k in list(frases):
+        for p in frases:
+            if p != k and k.startswith(p) and _es_palabra(k[len(p) - 1]) != _es_palabra(k[len(p)]):
+                frases[k] = frases[k] | frases[p]
+    patron, disparadores = None, frozenset()
+    if frases:
+        # orden por longitud desc. para que el trie prefiera la frase más larga
+        palabras = sorted(frases, key=len, reverse=True)
+        patron = re.compile(rf"\b(?=({_trie_regex(palabras)})\b)")
+        disparadores = frozenset(m.group(0) if (m := re.match(r"\w+", k)) else None for k in frases)
+    return Codificador(categorias, simples, patron, {k: sorted(v) for k, v in frases.items()}, disparadores)
+
+
+def codificar(s: pd.Series, cod: Codificador, sep: str = " | ", jobs: int | None = None) -> pd.DataFrame:
+    """Codifica una columna de texto. Devuelve (mismo índice):
+    - categoria_auto: la categoría de mayor prioridad (o "No clasificado")
+    - categorias_auto: todas las categorías encontradas (multi-etiqueta), unidas por `sep`
+    Cada texto distinto se normaliza y se busca una sola vez."""
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    textos = map_distintos(pd.Series(uniques), norm, jobs=jobs)
+    t_codes, t_uniques = pd.factorize(textos)          # textos que normalizan igual
+    hits = [cod.categorias_de(t) for t in t_uniques]
+    cats = np.asarray(cod.categorias + [NO_CLASIFICADO], dtype=object)
+    prim = np.array([h[0] if h else -1 for h in hits], dtype=int)
+    todas = np.array([sep.join(cats[h]) if h else NO_CLASIFICADO for h in hits], dtype=object)
+    # expandir: texto normalizado -> valor distinto -> fila (NaN -> No clasificado)
+    prim_u = np.append(prim[t_codes], -1)[codes]
+    todas_u = np.append(todas[t_codes], NO_CLASIFICADO)[codes]
+    return pd.DataFrame({"categoria_auto": cats[prim_u], "categorias_auto": todas_u}, index=s.index)
+
+
+def aplicar_manual(coded: pd.DataFrame, manual: pd.Series) -> pd.DataFrame:
+    """Añade categoria_manual (Serie por fila, NaN = sin asignar) y las columnas
+    categoria_final / categorias_final: la manual cuando existe, si no la automática."""
+    manual = manual.reindex(coded.index)
+    return coded.assign(categoria_manual=manual,
+                        categoria_final=manual.fillna(coded["categoria_auto"]),
+                        categorias_final=manual.fillna(coded["categorias_auto"]))
+
+
+def resumen(coded: pd.DataFrame, by: pd.Series | None = None, multi: bool = False,
+            sep: str = " | ", fuente: str = "auto") -> pd.DataFrame:
+    """Conteo y % por categoría (opcionalmente por grupo, p.ej. SECTOR). Con multi=True
+    cada respuesta cuenta en todas sus categorías; el % es sobre respuestas, no suma 100.
+    `fuente`: sufijo de las columnas a resumir ("auto" o "final", con la manual)."""
+    col = f"categorias_{fuente}" if multi else f"categoria_{fuente}"
+    t = pd.DataFrame({"categoria": coded[col]})
+    if by is not None:
+        t.insert(0, "grupo", by.reindex(coded.index).to_numpy())
+    base = t.groupby("grupo", dropna=False).size() if by is not None else len(t)
+    if multi:
+        t = t.assign(categoria=t["categoria"].str.split(sep, regex=False)).explode("categoria")
+    keys = ["grupo", "categoria"] if by is not None else ["categoria"]
+    out = t.groupby(keys, dropna=False).size().rename("n").reset_index()
+    den = out["grupo"].map(base) if by is not None else base
+    out["%"] = (out["n"] / den * 100).round(1)
+    return out.sort_values(keys[:-1] + ["n"], ascending=[True] * (len(keys) - 1) + [False]).reset_index(drop=True)
@@ -0,0 +1,70 @@
+# Carga y preparación de la base fuera de Streamlit: los mismos pasos que hace app.py
+# al arrancar (nombres de columna limpios y únicos, etiquetas del Codebook, armonización)
+# y el mapeo de roles del plan a columnas, leído de un JSON.
+import json
+import os
+import re
+
+import pandas as pd
+
+from .armonizar import aplicar_armonizacion, cargar_mapeos
+from .codebook import apply_value_labels, build_value_labels
+from .tabulados import PLAN
+
+DATA_PATH_XLSX = "data/respuestas.xlsx"
+CODEBOOK_PATH = "data/Codebook.xlsx"
+MAPEO_PATH = "data/mapeo_variables.json"
+
+
+def clean_label(s: str) -> str:
+    s = re.sub(r"\s+", " ", str(s)).strip()
+    rep = {"√≠": "í", "√≥": "ó", "√±": "ñ", "√©": "é", "√í": "á", "√∫": "ú", "###": ""}
+    for k, v in rep.items():
+        s = s.replace(k, v)
+    return s
+
+
+def make_unique_columns(cols):
+    seen, out = {}, []
+    for c in cols:
+        base = str(c)
+        if base not in seen:
+            seen[base] = 1; out.append(base)
+        else:
+            seen[base] += 1; out.append(f"{base} ({seen[base]})")
+    return out
+
+
+def leer_base(path: str) -> pd.DataFrame:
+    """CSV o Excel, con nombres de columna limpios y únicos."""
+    df = pd.read_csv(path) if path.lower().endswith(".csv") else pd.read_excel(path, engine="openpyxl")
+    df = df.rename(columns={c: clean_label(c) for c in df.columns})
+    df.columns = make_unique_columns(df.columns)
+    return df
+
+
+def preparar(df: pd.DataFrame, codebook_path: str | None = CODEBOOK_PATH, etiquetas: bool = True,
+             armonizar: bool = True) -> pd.DataFrame:
+    """Etiquetas de valor del Codebook (si existe) y mapeos de armonización aprobados."""
+    if etiquetas and codebook_path and os.path.exists(codebook_path):
+        labels = build_value_labels(pd.read_excel(codebook_path, engine="openpyxl"))
+        if labels:
+            df, _ = apply_value_labels(df, labels)
+    if armonizar:
+        df = aplicar_armonizacion(df, cargar_mapeos())
+    return df
+
+
+def cargar_mapeo(path: str, columnas) -> dict:
+    """{rol: columna} desde un JSON (como el que descarga el tablero). Sin archivo, cada
+    rol se asocia a la columna del mismo nombre (sin distinguir mayúsculas), si existe.
+    Columnas que no están en la base -> "<ninguna>"."""
+    cols = list(columnas)
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as fh:
+            m = {str(k): str(v) for k, v in json.load(fh).items()}
+    else:
+        por_nombre = {c.lower(): c for c in cols}
+        roles = {r for *_, rs in PLAN for r in rs} | {"sector"}
+        m = {r: por_nombre.get(r.lower(), "<ninguna>") for r in sorted(roles)}
+    return {k: (v if v in cols else "<ninguna>") for k, v in m.items()}
@@ -0,0 +1,217 @@
+# Detección de envíos duplicados: exactos (hash de columnas clave) y casi-duplicados
+# (mismo SECTOR, GPS a pocos metros y mismas respuestas clave) vía índice de rejilla.
+# panel_duplicados es el control común de la barra lateral de los tableros.
+import re
+
+import numpy as np
+import pandas as pd
+
+from .geo import AREA_ESTUDIO, a_metros, coords
+from .tabulados import MISSING_LABELS
+from .versiones import cell_hashes, huella, row_hashes
+
+# Columnas de metadatos que cambian entre envíos de la misma estructura
+_META = re.compile(r"^(llave|interview__id|id_[a-z]+|p002__\w+|objectid.*|fid.*)$", re.I)
+# Identificador del envío (un envío puede registrar varias estructuras en el mismo punto)
+_ENVIO = ("interview__id", "llave")
+
+POLITICAS = {
+    "conservar_primero": "Conservar el primero",
+    "conservar_ultimo": "Conservar el último",
+    "conservar_completo": "Conservar el más completo",
+    "marcar": "Sólo marcar (no eliminar)",
+}
+
+
+def columnas_clave_default(df: pd.DataFrame) -> list:
+    return [c for c in df.columns if not _META.match(str(c))]
+
+
+def columna_envio_default(df: pd.DataFrame) -> str | None:
+    low = {str(c).lower(): c for c in df.columns}
+    return next((low[n] for n in _ENVIO if n in low), None)
+
+
+def _sin_respuesta(df: pd.DataFrame, cols) -> np.ndarray:
+    """True donde todas las `cols` están vacías o son etiquetas de faltante."""
+    vacio = np.ones(len(df), dtype=bool)
+    for c in cols:
+        s = df[c]
+        vacio &= (s.isna() | s.astype(str).str.strip().isin(MISSING_LABELS)).to_numpy()
+    return vacio
+
+
+def _codigos_envio(s: pd.Series) -> np.ndarray:
+    """Código por envío; cada registro sin identificador cuenta como un envío propio."""
+    codes = pd.factorize(s)[0]
+    sin = codes < 0
+    codes[sin] = -1 - np.arange(int(sin.sum()))
+    return codes
+
+
+def _union_find(n, i, j) -> np.ndarray:
+    """Componentes conexas de los pares (i, j) -> id de grupo por registro."""
+    parent = np.arange(n)
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+    for a, b in zip(i.tolist(), j.tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    return np.array([find(x) for x in range(n)])
+
+
+def exact_groups(df: pd.DataFrame, cols) -> np.ndarray:
+    """Id de grupo por registro (posición del primer registro con el mismo hash)."""
+    h = row_hashes(cell_hashes(df, list(cols)))
+    first = pd.Series(np.arange(len(df))).groupby(h, sort=False).transform("min")
+    return first.to_numpy()
+
+
+def near_pairs(df: pd.DataFrame, lat_col, lon_col, sector_col=None, answer_cols=(),
+               radio_m: float = 5.0, area: dict = AREA_ESTUDIO, envio_col=None):
+    """Pares (i, j), i < j, de registros del mismo bloque (sector + respuestas clave) a
+    <= radio_m metros. Rejilla de celdas de radio_m: sólo se comparan celdas vecinas.
+    Con `envio_col` sólo se emparejan registros de envíos distintos (las estructuras de un
+    mismo envío comparten punto GPS sin ser duplicados). Registros sin ninguna respuesta
+    clave no se emparejan: que falten todas no es coincidencia."""
+    lat, lon = coords(df, lat_col, lon_col, area)
+    ok = np.isfinite(lat) & np.isfinite(lon)
+    if len(answer_cols):
+        ok &= ~_sin_respuesta(df, answer_cols)
+    idx = np.flatnonzero(ok)
+    if len(idx) < 2:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+    block_cols = ([sector_col] if sector_col else []) + list(answer_cols)
+    block = (row_hashes(cell_hashes(df.iloc[idx], block_cols)) if block_cols
+             else np.zeros(len(idx), dtype="uint64"))
+    x, y = a_metros(lat[idx], lon[idx])
+    pts = pd.DataFrame({"p": idx, "b": block, "cx": np.floor(x / radio_m).astype("int64"),
+                        "cy": np.floor(y / radio_m).astype("int64"), "x": x, "y": y,
+                        "e": _codigos_envio(df[envio_col].iloc[idx]) if envio_col else idx})
+
+    pares = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            vec = pts.assign(cx=pts["cx"] + dx, cy=pts["cy"] + dy)
+            m = pts.merge(vec, on=["b", "cx", "cy"], suffixes=("", "_2"))
+            m = m[(m["p"] < m["p_2"]) & (m["e"] != m["e_2"])]
+            d2 = (m["x"] - m["x_2"]) ** 2 + (m["y"] - m["y_2"]) ** 2
+            pares.append(m.loc[d2 <= radio_m ** 2, ["p", "p_2"]])
+    pares = pd.concat(pares).drop_duplicates()
+    return pares["p"].to_numpy(), pares["p_2"].to_numpy()
+
+
+def detectar(df: pd.DataFrame, cols_clave, lat_col=None, lon_col=None, sector_col=None,
+             answer_cols=(), radio_m: float = 5.0, envio_col=None) -> pd.DataFrame:
+    """Una fila por registro en un grupo de duplicados: fila, grupo, tipo, tamaño.
+    `envio_col` (p. ej. interview__id) evita tomar como cercanos a registros del mismo envío."""
+    n = len(df)
+    g_exact = exact_groups(df, cols_clave) if cols_clave else np.arange(n)
+    rep = g_exact != np.arange(n)
+    i, j = g_exact[rep], np.flatnonzero(rep)
+    tipo = np.where(np.bincount(g_exact, minlength=n)[g_exact] > 1, "exacto", "")
+    if lat_col and lon_col:
+        # sólo entre representantes: las copias exactas ya quedan unidas a su grupo
+        reps = np.flatnonzero(~rep)
+        ni, nj = near_pairs(df.iloc[reps], lat_col, lon_col, sector_col, answer_cols, radio_m,
+                            envio_col=envio_col)
+        ni, nj = reps[ni], reps[nj]
+        i, j = np.concatenate([i, ni]), np.concatenate([j, nj])
+        cerca = np.zeros(n, dtype=bool)
+        cerca[ni] = cerca[nj] = True
+        tipo = np.where((tipo == "") & cerca, "cercano", tipo)
+    if len(i) == 0:
+        return pd.DataFrame(columns=["fila", "grupo", "tipo", "tamaño"])
+    grupo = _union_find(n, i, j)
+    size = np.bincount(grupo, minlength=n)[grupo]
+    sel = np.flatnonzero(size > 1)
+    out = pd.DataFrame({"fila": df.index.to_numpy()[sel], "pos": sel, "grupo": grupo[sel],
+                        "tipo": tipo[sel], "tamaño": size[sel]})
+    todo_exacto = out["tipo"].eq("exacto").groupby(out["grupo"]).transform("all")
+    out["tipo"] = np.where(todo_exacto, "exacto", "cercano")
+    return out.sort_values(["grupo", "pos"]).reset_index(drop=True)
+
+
+def resolver(df: pd.DataFrame, grupos: pd.DataFrame, politica: str,
+             orden_col: str | None = "p002__Timestamp"):
+    """Aplica la política a los grupos detectados -> (df_limpio, n_eliminados).
+    'marcar' conserva todo y agrega la columna _duplicado (id de grupo)."""
+    if grupos.empty:
+        return df, 0
+    if politica == "marcar":
+        out = df.copy()
+        out["_duplicado"] = pd.Series(grupos["grupo"].to_numpy(), index=grupos["fila"].to_numpy())
+        return out, 0
+    g = grupos[["pos", "grupo"]].copy()
+    if politica == "conservar_completo":
+        g["orden"] = -df.iloc[g["pos"]].notna().sum(axis=1).to_numpy()
+    elif politica == "conservar_ultimo":
+        if orden_col and orden_col in df.columns:
+            ts = pd.to_datetime(df.iloc[g["pos"]][orden_col], errors="coerce")
+            g["orden"] = -ts.rank(method="first", na_option="top").to_numpy()
+        else:
+            g["orden"] = -g["pos"]
+    else:
+        g["orden"] = g["pos"]
+    keep = g.sort_values(["grupo", "orden", "pos"]).drop_duplicates("grupo")["pos"]
+    drop = np.setdiff1d(g["pos"].to_numpy(), keep.to_numpy())
+    mask = np.ones(len(df), dtype=bool)
+    mask[drop] = False
+    return df[mask], int(len(drop))
+
+
+# ---------- Panel para los tableros (barra lateral) ----------
+RESPUESTAS_CLAVE = ("p004", "p005", "p006", "p007", "p008", "p011")
+_NINGUNA = (None, "<ninguna>")
+_DETECTAR_ST = None
+
+
+def _detectar_por_huella(huella_datos: str, claves: tuple, lat_col, lon_col, sector_col, resp: tuple,
+                         radio: int, envio_col, _df: pd.DataFrame) -> pd.DataFrame:
+    return detectar(_df, list(claves), lat_col, lon_col, sector_col, list(resp), radio, envio_col)
+
+
+def panel_duplicados(df: pd.DataFrame, roles: dict):
+    """Política y criterios en la barra lateral -> (df_depurado, grupos, política, nº
+    eliminados). `roles` usa las claves del mapeo (sector, lat, lon, p004…). La detección
+    queda en st.cache_data por huella de los datos y criterios; Streamlit se importa aquí
+    para que el resto del módulo no lo necesite."""
+    import streamlit as st
+
+    global _DETECTAR_ST
+    if _DETECTAR_ST is None:
+        _DETECTAR_ST = st.cache_data(show_spinner=False, max_entries=4)(_detectar_por_huella)
+
+    st.sidebar.header("🧬 Duplicados")
+    politica = st.sidebar.selectbox(
+        "Política", ["ninguna"] + list(POLITICAS), key="dup_politica",
+        format_func=lambda k: POLITICAS.get(k, "No revisar duplicados"),
+        help="Exactos: mismas columnas clave (sin metadatos). Cercanos: mismo SECTOR y respuestas clave, "
+             "GPS a ≤ radio, entre envíos distintos.")
+    if politica == "ninguna":
+        return df, pd.DataFrame(), politica, 0
+
+    rol = lambda r: None if roles.get(r) in _NINGUNA else roles[r]
+    with st.sidebar.expander("Criterios"):
+        claves = st.multiselect("Columnas clave (exactos)", list(df.columns),
+                                default=columnas_clave_default(df), key="dup_claves")
+        resp = st.multiselect("Respuestas clave (cercanos)", list(df.columns),
+                              default=[rol(r) for r in RESPUESTAS_CLAVE if rol(r) in df.columns],
+                              key="dup_resp")
+        radio = st.slider("Radio GPS (m)", 1, 50, 5, key="dup_radio")
+    lat, lon = (rol("lat"), rol("lon")) if rol("lat") and rol("lon") else (None, None)
+    sector, envio = rol("sector"), columna_envio_default(df)
+    cols = [c for c in dict.fromkeys([*claves, *resp, lat, lon, sector, envio]) if c]
+    grupos = _DETECTAR_ST(huella(df[cols]), tuple(claves), lat, lon, sector, tuple(resp),
+                          radio, envio, df)
+    df, n = resolver(df, grupos, politica)
+    st.sidebar.caption(f"{grupos['grupo'].nunique() if len(grupos) else 0:,} grupos · "
+                       f"{len(grupos):,} registros · {n:,} eliminados")
+    return df, grupos, politica, n
@@ -0,0 +1,111 @@
+# Escritura de libros .xlsx en streaming: xlsxwriter en modo constant_memory escribe cada
+# fila en cuanto llega (a un archivo temporal, no a RAM) y las hojas se consumen de un
+# generador, así que el pico de memoria es ~una tabla aunque el anexo tenga cientos de hojas.
+import os
+import re
+import tempfile
+from typing import Iterable
+
+import pandas as pd
+import xlsxwriter
+
+MAX_NOMBRE = 31                      # límite de Excel para nombres de hoja
+ANCHO_MAX = 50
+_INVALIDOS = re.compile(r"[\[\]:*?/\\]")
+
+
+def nombre_hoja(nombre: str, usados: set) -> str:
+    """Nombre válido y único (sin []:*?/\\, ≤ 31 caracteres; sufijo ~2, ~3… si se repite)."""
+    base = _INVALIDOS.sub("_", str(nombre)).strip("'") or "Hoja"
+    cand, k = base[:MAX_NOMBRE], 1
+    while cand.lower() in usados:
+        k += 1
+        suf = f"~{k}"
+        cand = base[:MAX_NOMBRE - len(suf)] + suf
+    usados.add(cand.lower())
+    return cand
+
+
+def _es_pct(col) -> bool:
+    return str(col).strip().startswith("%") or str(col).strip().endswith("%")
+
+
+def _columnas(df: pd.DataFrame) -> list:
+    """Columnas como listas de tipos de Python (None para faltantes; fechas como texto)."""
+    out = []
+    for j in range(df.shape[1]):
+        c = df.iloc[:, j]
+        if not (pd.api.types.is_numeric_dtype(c) or pd.api.types.is_object_dtype(c)
+                or pd.api.types.is_string_dtype(c)):
+            c = c.astype(str).where(c.notna())
+        out.append(c.astype(object).where(c.notna(), None).tolist())
+    return out
+
+
+class _Formatos:
+    def __init__(self, wb: xlsxwriter.Workbook):
+        self.encabezado = wb.add_format({"bold": True, "bg_color": "#DDEBF7", "bottom": 1,
+                                         "text_wrap": True, "valign": "top"})
+        self.pct = wb.add_format({"num_format": "0.0"})
+
+
+def _escribir_tabla(ws, df: pd.DataFrame, fila: int, fmt: _Formatos) -> int:
+    """Escribe encabezado + filas a partir de `fila`; devuelve la siguiente fila libre."""
+    ws.write_row(fila, 0, [str(c) for c in df.columns], fmt.encabezado)
+    for i, valores in enumerate(zip(*_columnas(df)), start=fila + 1):
+        ws.write_row(i, 0, valores)     # None -> celda vacía
+    return fila + len(df) + 1
+
+
+def _columnas_hoja(ws, tablas: list, fmt: _Formatos):
+    """Ancho por encabezado y una muestra de valores, y formato de % por columna (antes
+    de escribir filas: en constant_memory no se puede volver atrás)."""
+    anchos, pct = {}, set()
+    for df in tablas:
+        muestra = df.head(200)
+        for j, c in enumerate(df.columns):
+            largo = max([len(str(c))] + [len(str(v)) for v in muestra.iloc[:, j].tolist()])
+            anchos[j] = max(anchos.get(j, 0), largo)
+            if _es_pct(c):
+                pct.add(j)
+    for j, a in anchos.items():
+        ws.set_column(j, j, min(a + 2, ANCHO_MAX), fmt.pct if j in pct else None)
+
+
+def escribir_libro(hojas: Iterable, destino: str, tmpdir: str | None = None) -> int:
+    """Escribe en `destino` un .xlsx a partir de pares (nombre, tabla), donde tabla es un
+    DataFrame o {título: DataFrame} (sub-tablas apiladas, 2 filas en blanco entre ellas).
+    `hojas` puede ser un generador: cada tabla se escribe y se suelta antes de pedir la
+    siguiente. Encabezados resaltados, columnas de % con un decimal. Devuelve nº de hojas."""
+    wb = xlsxwriter.Workbook(destino, {"constant_memory": True, "tmpdir": tmpdir or tempfile.gettempdir()})
+    fmt, usados, n = _Formatos(wb), set(), 0
+    try:
+        for nombre, tabla in hojas:
+            ws = wb.add_worksheet(nombre_hoja(nombre, usados))
+            tablas = list(tabla.values()) if isinstance(tabla, dict) else [tabla]
+            _columnas_hoja(ws, tablas, fmt)
+            fila = 0
+            for df in tablas:
+                fila = _escribir_tabla(ws, df, fila, fmt) + 2
+            if len(tablas) == 1:
+                ws.freeze_panes(1, 0)
+            n += 1
+        if not n:
+            wb.add_worksheet("Vacío")
+    finally:
+        wb.close()
+    return n
+
+
+def libro_bytes(hojas: Iterable, tmpdir: str | None = None) -> bytes:
+    """escribir_libro a un archivo temporal y devuelve su contenido (el .xlsx comprimido,
+    no las tablas: es lo único que pasa por memoria de una vez)."""
+    fd, ruta = tempfile.mkstemp(suffix=".xlsx", dir=tmpdir)
+    os.close(fd)
+    try:
+        escribir_libro(hojas, ruta, tmpdir)
+        with open(ruta, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(ruta)
+
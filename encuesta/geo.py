@@ -0,0 +1,383 @@
+# Coordenadas GPS: corrección de escala, área de estudio y agregación en celdas
+# (hexágonos o cuadrados) para no enviar cada punto al navegador. Al final, los controles
+# compartidos de los tableros (filtro "Zona GPS" y pestaña de mapa).
+import html
+
+import numpy as np
+import pandas as pd
+
+from .versiones import huella
+
+# Área de estudio (grados decimales). Ajustar si cambia el levantamiento.
+AREA_ESTUDIO = {"lat_min": 13.46, "lat_max": 13.51, "lon_min": -89.35, "lon_max": -89.29}
+
+M_LAT = 110_540.0   # metros por grado de latitud
+M_LON = 111_320.0   # metros por grado de longitud en el ecuador (× cos(lat))
+MAX_PUNTOS = 3_000  # vista automática: por encima de esto se agregan en celdas
+PRESUPUESTO_PUNTOS = 20_000  # vista de puntos: máximo que se envía al navegador (LOD)
+
+
+def area_centro(area: dict = AREA_ESTUDIO):
+    return ((area["lat_min"] + area["lat_max"]) / 2, (area["lon_min"] + area["lon_max"]) / 2)
+
+
+def coord_decimal(s, ref: float) -> np.ndarray:
+    """Corrige coordenadas exportadas sin separador decimal (134863287 -> 13.4863287,
+    -893230154 -> -89.3230154) alineando el orden de magnitud con `ref`."""
+    x = pd.to_numeric(pd.Series(s), errors="coerce").to_numpy(dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shift = np.floor(np.log10(np.abs(x))) - np.floor(np.log10(abs(ref)))
+    shift = np.where(np.isfinite(shift) & (shift > 0), shift, 0)
+    return x / np.power(10.0, shift)
+
+
+def coords(df: pd.DataFrame, lat_col: str, lon_col: str, area: dict = AREA_ESTUDIO):
+    """(lat, lon) como arrays float64 en grados decimales; NaN si falta o está fuera de rango."""
+    lat0, lon0 = area_centro(area)
+    lat = coord_decimal(df[lat_col], lat0)
+    lon = coord_decimal(df[lon_col], lon0)
+    bad = ~((np.abs(lat) <= 90) & (np.abs(lon) <= 180))
+    lat[bad] = np.nan
+    lon[bad] = np.nan
+    return lat, lon
+
+
+def en_area(lat, lon, area: dict = AREA_ESTUDIO) -> np.ndarray:
+    return ((lat >= area["lat_min"]) & (lat <= area["lat_max"]) &
+            (lon >= area["lon_min"]) & (lon <= area["lon_max"]))
+
+
+# ---------- Proyección local y agregación en celdas ----------
+def a_metros(lat, lon, lat0: float | None = None):
+    """Proyección equirectangular local (x, y) en metros; lat0 = latitud de referencia
+    (por defecto la media). Suficiente a escala de barrio."""
+    lat0 = np.nanmean(lat) if lat0 is None else lat0
+    return np.asarray(lon) * M_LON * np.cos(np.deg2rad(lat0)), np.asarray(lat) * M_LAT
+
+
+def a_grados(x, y, lat0: float):
+    return np.asarray(y) / M_LAT, np.asarray(x) / (M_LON * np.cos(np.deg2rad(lat0)))
+
+
+def extension_m(lat, lon) -> float:
+    """Lado mayor (metros) del rectángulo que contiene los puntos."""
+    if not len(lat):
+        return 0.0
+    x, y = a_metros(lat, lon)
+    return float(max(np.ptp(x), np.ptp(y)))
+
+
+def usar_celdas(lat, lon, lado_m: float, max_puntos: int = MAX_PUNTOS) -> bool:
+    """Vista automática: celdas si hay muchos puntos y el área abarca varias celdas;
+    si el filtro ya acerca a una zona pequeña (o hay pocos puntos), puntos."""
+    return len(lat) > max_puntos and extension_m(lat, lon) > 4 * lado_m
+
+
+def _hex(x, y, lado):
+    """Celda hexagonal (punta arriba, coordenadas axiales q, r) y su centro."""
+    q = (np.sqrt(3) / 3 * x - y / 3) / lado
+    r = (2 / 3 * y) / lado
+    # redondeo cúbico: el entero más cercano que cumple q + r + s = 0
+    s = -q - r
+    rq, rr, rs = np.rint(q), np.rint(r), np.rint(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    q, r = rq.astype("int64"), rr.astype("int64")
+    return q, r, lado * np.sqrt(3) * (q + r / 2), lado * 1.5 * r
+
+
+def _cuadrado(x, y, lado):
+    i, j = np.floor(x / lado).astype("int64"), np.floor(y / lado).astype("int64")
+    return i, j, (i + 0.5) * lado, (j + 0.5) * lado
+
+
+def agregar_celdas(lat, lon, lado_m: float = 100.0, forma: str = "hex", valor=None,
+                   lat0: float | None = None) -> pd.DataFrame:
+    """Cuenta los puntos (lat, lon sin NaN) por celda. Una fila por celda ocupada:
+    lat, lon (centro), n, pct (% de puntos con `valor` verdadero, si se da) y poligono
+    ([[lon, lat], …] para PolygonLayer). Binning entero vectorizado sobre la proyección
+    local en metros; `lado_m` = lado del hexágono o del cuadrado."""
+    lat, lon = np.asarray(lat, dtype="float64"), np.asarray(lon, dtype="float64")
+    cols = ["lat", "lon", "n"] + (["pct"] if valor is not None else []) + ["poligono"]
+    if not len(lat):
+        return pd.DataFrame(columns=cols)
+    lat0 = float(np.mean(lat)) if lat0 is None else lat0
+    x, y = a_metros(lat, lon, lat0)
+    i, j, cx, cy = (_hex if forma == "hex" else _cuadrado)(x, y, lado_m)
+    # (i, j) -> una clave entera por celda
+    inv, claves = pd.factorize((i - i.min()) * (j.max() - j.min() + 1) + (j - j.min()))
+    primero = np.zeros(len(claves), dtype="int64")
+    primero[inv[::-1]] = np.arange(len(inv))[::-1]
+    cx, cy = cx[primero], cy[primero]
+    out = pd.DataFrame({"n": np.bincount(inv, minlength=len(claves))})
+    out["lat"], out["lon"] = a_grados(cx, cy, lat0)
+    if valor is not None:
+        si = np.bincount(inv, weights=np.asarray(valor, dtype="float64"), minlength=len(claves))
+        out["pct"] = (si / out["n"] * 100).round(1)
+    if forma == "hex":
+        ang = np.deg2rad(np.arange(6) * 60 + 30)
+        vx, vy = lado_m * np.cos(ang), lado_m * np.sin(ang)
+    else:
+        vx, vy = np.array([-.5, .5, .5, -.5]) * lado_m, np.array([-.5, -.5, .5, .5]) * lado_m
+    plat, plon = a_grados(cx[:, None] + vx, cy[:, None] + vy, lat0)
+    out["poligono"] = np.stack([plon, plat], axis=2).round(6).tolist()
+    return out[cols].sort_values("n", ascending=False, ignore_index=True)
+
+
+def rampa_color(v, alfa: int = 170) -> np.ndarray:
+    """Colores RGBA uint8 (amarillo -> naranja -> rojo) para v en [0, 1]."""
+    v = np.clip(np.nan_to_num(np.asarray(v, dtype="float64")), 0, 1)
+    paradas = np.array([[255, 237, 160], [254, 178, 76], [240, 59, 32], [189, 0, 38]], dtype="float64")
+    pos = v * (len(paradas) - 1)
+    k = np.minimum(pos.astype(int), len(paradas) - 2)
+    t = (pos - k)[:, None]
+    rgb = paradas[k] * (1 - t) + paradas[k + 1] * t
+    return np.column_stack([rgb, np.full(len(v), alfa)]).round().astype("uint8")
+
+
+# ---------- Submuestreo para la vista de puntos (LOD) ----------
+def _tope(tam: np.ndarray, presupuesto: int) -> int:
+    """Mayor c con sum(min(tam, c)) <= presupuesto (búsqueda binaria)."""
+    lo, hi = 0, int(tam.max())
+    while lo < hi:
+        c = (lo + hi + 1) // 2
+        if np.minimum(tam, c).sum() <= presupuesto:
+            lo = c
+        else:
+            hi = c - 1
+    return lo
+
+
+def muestra_lod(lat, lon, estrato=None, presupuesto: int = PRESUPUESTO_PUNTOS,
+                lado_m: float | None = None, semilla: int = 0) -> np.ndarray:
+    """Posiciones (ordenadas) de a lo sumo `presupuesto` puntos que conservan la
+    cobertura espacial. Estratos = celda cuadrada × `estrato` (p. ej. SECTOR); cada
+    estrato recibe min(tamaño, c) puntos con el mayor tope c que cabe, así que las zonas
+    densas, donde los puntos se tapan, se aclaran y las dispersas se ven completas. Si
+    hay más estratos que presupuesto, primero uno por cada valor de `estrato`.
+    `lado_m` por defecto: ~presupuesto/4 celdas sobre el rectángulo de los puntos.
+    Determinista para las mismas entradas y `semilla`."""
+    lat, lon = np.asarray(lat, dtype="float64"), np.asarray(lon, dtype="float64")
+    n = len(lat)
+    if n <= presupuesto:
+        return np.arange(n)
+    if lado_m is None:
+        lado_m = max(extension_m(lat, lon) / np.sqrt(presupuesto / 4), 1.0)
+    x, y = a_metros(lat, lon)
+    i, j, _, _ = _cuadrado(x, y, lado_m)
+    sec = (np.zeros(n, dtype="int64") if estrato is None
+           else pd.factorize(np.asarray(estrato, dtype=object), use_na_sentinel=False)[0])
+    celda = (i - i.min()) * (j.max() - j.min() + 1) + (j - j.min())
+    grupo, uniq = pd.factorize(celda * (int(sec.max()) + 1) + sec)
+    tam = np.bincount(grupo, minlength=len(uniq))
+    rng = np.random.default_rng(semilla)
+    c = _tope(tam, presupuesto)
+    cuota = np.minimum(tam, c)
+    # lo que sobra del presupuesto: +1 a estratos que aún tienen puntos, en orden aleatorio
+    orden = rng.permutation(len(tam))
+    orden = orden[tam[orden] > c]
+    if c == 0:
+        sec_grupo = np.zeros(len(tam), dtype="int64")
+        sec_grupo[grupo] = sec
+        primero = np.zeros(len(orden), dtype=bool)
+        primero[np.unique(sec_grupo[orden], return_index=True)[1]] = True
+        orden = np.concatenate([orden[primero], orden[~primero]])
+    cuota[orden[:presupuesto - int(cuota.sum())]] += 1
+    # dentro de cada estrato, los primeros según una clave aleatoria
+    pos = np.lexsort((rng.random(n), grupo))
+    inicio = np.concatenate(([0], np.cumsum(tam)[:-1]))
+    g = grupo[pos]
+    return np.sort(pos[np.arange(n) - inicio[g] < cuota[g]])
+
+
+# ---------- Índice espacial (rejilla uniforme) ----------
+class IndiceEspacial:
+    """Rejilla uniforme sobre las coordenadas limpias, construida una vez por versión
+    de los datos. Los puntos se ordenan por celda (clave = fila · ancho + columna), así
+    que un rectángulo se resuelve con una búsqueda binaria por fila de celdas y un
+    filtro exacto sólo sobre los candidatos. Las consultas devuelven etiquetas de fila."""
+
+    def __init__(self, lat, lon, index, lado_m: float = 50.0):
+        lat, lon = np.asarray(lat, dtype="float64"), np.asarray(lon, dtype="float64")
+        ok = np.isfinite(lat) & np.isfinite(lon)
+        self.lado = lado_m
+        self.n = int(ok.sum())
+        self.lat0 = float(lat[ok].mean()) if self.n else 0.0
+        x, y = a_metros(lat[ok], lon[ok], self.lat0)
+        ix, iy = np.floor(x / lado_m).astype("int64"), np.floor(y / lado_m).astype("int64")
+        self.ix0, self.iy0 = (int(ix.min()), int(iy.min())) if self.n else (0, 0)
+        self.ancho = int(ix.max() - self.ix0 + 1) if self.n else 1
+        self.alto = int(iy.max() - self.iy0 + 1) if self.n else 0
+        clave = (iy - self.iy0) * self.ancho + (ix - self.ix0)
+        orden = np.argsort(clave, kind="stable")
+        self.clave, self.x, self.y = clave[orden], x[orden], y[orden]
+        self.filas = pd.Index(index)[ok][orden]
+        self.lat, self.lon = lat[ok][orden], lon[ok][orden]
+
+    def limites(self) -> dict:
+        """Rectángulo que contiene todos los puntos (formato de AREA_ESTUDIO)."""
+        if not self.n:
+            return dict(AREA_ESTUDIO)
+        return {"lat_min": float(self.lat.min()), "lat_max": float(self.lat.max()),
+                "lon_min": float(self.lon.min()), "lon_max": float(self.lon.max())}
+
+    def _candidatos(self, x0, x1, y0, y1) -> np.ndarray:
+        """Posiciones de los puntos en las celdas que tocan el rectángulo (metros)."""
+        ia = max(int(np.floor(x0 / self.lado)) - self.ix0, 0)
+        ib = min(int(np.floor(x1 / self.lado)) - self.ix0, self.ancho - 1)
+        ja = max(int(np.floor(y0 / self.lado)) - self.iy0, 0)
+        jb = min(int(np.floor(y1 / self.lado)) - self.iy0, self.alto - 1)
+        if ia > ib or ja > jb:
+            return np.empty(0, dtype="int64")
+        filas = np.arange(ja, jb + 1) * self.ancho
+        lo = np.searchsorted(self.clave, filas + ia, side="left")
+        hi = np.searchsorted(self.clave, filas + ib, side="right")
+        largo = hi - lo
+        # concatenación de los tramos [lo, hi) sin bucle
+        return np.repeat(lo - np.concatenate(([0], np.cumsum(largo)[:-1])), largo) + np.arange(largo.sum())
+
+    def rectangulo(self, lat_min, lat_max, lon_min, lon_max) -> pd.Index:
+        x, y = a_metros(np.array([lat_min, lat_max]), np.array([lon_min, lon_max]), self.lat0)
+        pos = self._candidatos(x.min(), x.max(), y.min(), y.max())
+        ok = ((self.lat[pos] >= lat_min) & (self.lat[pos] <= lat_max) &
+              (self.lon[pos] >= lon_min) & (self.lon[pos] <= lon_max))
+        return self.filas[pos[ok]]
+
+    def radio(self, lat, lon, metros: float) -> pd.Index:
+        cx, cy = a_metros(np.array([lat]), np.array([lon]), self.lat0)
+        cx, cy = float(cx[0]), float(cy[0])
+        pos = self._candidatos(cx - metros, cx + metros, cy - metros, cy + metros)
+        ok = (self.x[pos] - cx) ** 2 + (self.y[pos] - cy) ** 2 <= metros ** 2
+        return self.filas[pos[ok]]
+
+
+# ---------- Filtro "Zona GPS" para los tableros (barra lateral) ----------
+_INDICE_ST = None
+
+
+def _indice_por_huella(huella_lat: str, huella_lon: str, lat_col: str, lon_col: str,
+                       _df: pd.DataFrame) -> IndiceEspacial:
+    lat, lon = coords(_df, lat_col, lon_col)
+    return IndiceEspacial(lat, lon, _df.index)
+
+
+def panel_zona(df: pd.DataFrame, work: pd.DataFrame, lat_col, lon_col) -> pd.DataFrame:
+    """Radio "Zona GPS" (Todas / Rectángulo / Radio) en la barra lateral; devuelve `work`
+    limitado a las filas dentro de la zona. El índice se construye sobre `df` una vez por
+    versión de las coordenadas (st.cache_resource); Streamlit se importa aquí."""
+    if lat_col in (None, "<ninguna>") or lon_col in (None, "<ninguna>"):
+        return work
+    import streamlit as st
+
+    global _INDICE_ST
+    if _INDICE_ST is None:
+        _INDICE_ST = st.cache_resource(show_spinner=False, max_entries=4)(_indice_por_huella)
+
+    zona = st.sidebar.radio("Zona GPS", ["Todas", "Rectángulo", "Radio"], horizontal=True, key="flt_zona",
+                            help="Limita todas las tablas a las estructuras dentro de un área del mapa.")
+    if zona == "Todas":
+        return work
+    idx_geo = _INDICE_ST(huella(df[lat_col]), huella(df[lon_col]), lat_col, lon_col, df)
+    lim = idx_geo.limites()
+    if zona == "Rectángulo":
+        rng_lat = st.sidebar.slider("Latitud", lim["lat_min"] - 1e-4, lim["lat_max"] + 1e-4,
+                                    (lim["lat_min"] - 1e-4, lim["lat_max"] + 1e-4),
+                                    step=1e-5, format="%.5f", key="flt_zona_lat")
+        rng_lon = st.sidebar.slider("Longitud", lim["lon_min"] - 1e-4, lim["lon_max"] + 1e-4,
+                                    (lim["lon_min"] - 1e-4, lim["lon_max"] + 1e-4),
+                                    step=1e-5, format="%.5f", key="flt_zona_lon")
+        en_zona = idx_geo.rectangulo(*rng_lat, *rng_lon)
+    else:
+        z1, z2 = st.sidebar.columns(2)
+        lat_c = z1.number_input("Lat. centro", value=(lim["lat_min"] + lim["lat_max"]) / 2,
+                                format="%.6f", key="flt_zona_clat")
+        lon_c = z2.number_input("Lon. centro", value=(lim["lon_min"] + lim["lon_max"]) / 2,
+                                format="%.6f", key="flt_zona_clon")
+        metros = st.sidebar.slider("Radio (m)", 25, 3000, 300, step=25, key="flt_zona_m")
+        en_zona = idx_geo.radio(lat_c, lon_c, metros)
+    work = work[work.index.isin(en_zona)]
+    st.sidebar.caption(f"{len(work):,} registros en la zona.")
+    return work
+
+
+# ---------- Pestaña de mapa para los tableros (celdas o puntos con LOD) ----------
+_LOD_ST = None
+
+
+def _lod_por_huella(huella_lat: str, huella_lon: str, huella_sec: str, presupuesto: int, _lat, _lon, _sec):
+    # una muestra por estado de filtros: los reruns no vuelven a sortear
+    return muestra_lod(_lat, _lon, _sec, presupuesto)
+
+
+def panel_mapa(df: pd.DataFrame, lat_col, lon_col, sector_col=None, cols_indicador=(), ambito=None,
+               deck=None, puntos=None):
+    """Mapa de `df`: celdas agregadas (con % opcional de un valor de `cols_indicador`) o
+    puntos submuestreados por LOD (celdas × `sector_col`). Vista, forma y tamaño de celda
+    se eligen arriba (claves map_*). `deck`: clase de pydeck.Deck a usar (p. ej. una con
+    JSON compacto). `puntos(filas, lat, lon, ocultos)` dibuja la vista de puntos en lugar
+    de st.map (filas = etiquetas de `df` de los puntos mostrados). Streamlit y pydeck se
+    importan aquí."""
+    import pydeck as pdk
+    import streamlit as st
+
+    global _LOD_ST
+    if _LOD_ST is None:
+        _LOD_ST = st.cache_data(show_spinner=False, max_entries=16)(_lod_por_huella)
+    deck = deck or pdk.Deck
+    sector_col = None if sector_col in (None, "<ninguna>") else sector_col
+    sufijo = f" (vista: {ambito})." if ambito else "."
+
+    lat, lon = coords(df, lat_col, lon_col)
+    ok = np.isfinite(lat) & np.isfinite(lon)
+    if not ok.any():
+        st.info("No hay coordenadas válidas después de la limpieza.")
+        return
+    lat, lon = lat[ok], lon[ok]
+    g1, g2, g3 = st.columns(3)
+    modo = g1.radio("Vista", ["Automática", "Celdas", "Puntos"], horizontal=True, key="map_modo",
+                    help="Automática: celdas si hay muchos puntos en un área amplia; puntos al filtrar una zona pequeña.")
+    forma = g2.radio("Celda", ["Hexágono", "Cuadrado"], horizontal=True, key="map_forma")
+    lado = g3.slider("Tamaño de celda (m)", 25, 500, 100, step=25, key="map_lado")
+
+    if modo == "Celdas" or (modo == "Automática" and usar_celdas(lat, lon, lado)):
+        # sólo se envían las celdas agregadas (conteo y % opcional de un indicador)
+        i1, i2 = st.columns(2)
+        cols_ind = [c for c in dict.fromkeys(cols_indicador) if c in df.columns]
+        ind_col = i1.selectbox("Indicador por celda (opcional)", ["<ninguno>"] + cols_ind, key="map_ind")
+        valor = None
+        if ind_col != "<ninguno>":
+            ind_val = i2.selectbox("Valor", df[ind_col].astype(str).value_counts().index[:30].tolist(),
+                                   key="map_ind_val")
+            valor = (df[ind_col].astype(str) == ind_val).to_numpy()[ok]
+        agg = agregar_celdas(lat, lon, lado, "hex" if forma == "Hexágono" else "cuadrado", valor)
+        escala = agg["pct"] / 100 if valor is not None else np.log1p(agg["n"]) / np.log1p(agg["n"].max())
+        agg["color"] = rampa_color(escala).tolist()
+        tip = "{n} puntos" + (f"<br/>{html.escape(str(ind_col))} = {html.escape(ind_val)}: {{pct}}%"
+                              if valor is not None else "")
+        capa = pdk.Layer("PolygonLayer", agg[["poligono", "n", "color"] + (["pct"] if valor is not None else [])],
+                         get_polygon="poligono", get_fill_color="color", get_line_color=[80, 80, 80, 80],
+                         line_width_min_pixels=0.5, pickable=True)
+        vista = pdk.ViewState(latitude=float(lat.mean()), longitude=float(lon.mean()), zoom=14)
+        st.pydeck_chart(deck(layers=[capa], initial_view_state=vista, tooltip={"html": tip}),
+                        use_container_width=True)
+        st.caption(f"{len(lat):,} puntos en {len(agg):,} celdas de {lado} m" + sufijo)
+        return
+
+    tope = st.select_slider("Máx. puntos (LOD)", ["Todos", 5_000, 10_000, 20_000, 50_000],
+                            value=PRESUPUESTO_PUNTOS, key="map_lod",
+                            help="Submuestreo por celdas y SECTOR: aclara las zonas donde los puntos se tapan.")
+    if tope != "Todos" and len(lat) > tope:
+        sec = df[sector_col] if sector_col else pd.Series("", index=df.index)
+        pos = _LOD_ST(huella(df[lat_col]), huella(df[lon_col]), huella(sec), tope,
+                      lat, lon, sec.to_numpy()[ok])
+    else:
+        pos = np.arange(len(lat))
+    ocultos = len(lat) - len(pos)
+    if puntos is not None:
+        puntos(df.index[ok][pos], lat[pos], lon[pos], ocultos)
+        return
+    st.map(pd.DataFrame({"lat": lat[pos], "lon": lon[pos]}), use_container_width=True)
+    st.caption(f"{len(pos):,} puntos mostrados" + (f" · {ocultos:,} ocultos por LOD" if ocultos else "") + sufijo)
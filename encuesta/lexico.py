@@ -0,0 +1,88 @@
+# Léxico español sin red: stopwords de nltk (copia empaquetada), las de app1.py y las
+# ampliadas de la pestaña Texto, normalizadas sin acentos en un único frozenset.
+import os
+import unicodedata
+from functools import lru_cache
+
+STOPWORDS_EXTRA_PATH = "data/stopwords_extra.txt"
+
+# Copia de nltk.corpus.stopwords.words("spanish") (lista Snowball): evita nltk.download
+NLTK_ES = """
+de la que el en y a los del se las por un para con no una su al lo como más pero sus le
+ya o este sí porque esta entre cuando muy sin sobre también me hasta hay donde quien desde
+todo nos durante todos uno les ni contra otros ese eso ante ellos e esto mí antes algunos
+qué unos yo otro otras otra él tanto esa estos mucho quienes nada muchos cual poco ella
+estar estas algunas algo nosotros mi mis tú te ti tu tus ellas nosotras vosotros vosotras
+os mío mía míos mías tuyo tuya tuyos tuyas suyo suya suyos suyas nuestro nuestra nuestros
+nuestras vuestro vuestra vuestros vuestras esos esas estoy estás está estamos estáis están
+esté estés estemos estéis estén estaré estarás estará estaremos estaréis estarán estaría
+estarías estaríamos estaríais estarían estaba estabas estábamos estabais estaban estuve
+estuviste estuvo estuvimos estuvisteis estuvieron estuviera estuvieras estuviéramos
+estuvierais estuvieran estuviese estuvieses estuviésemos estuvieseis estuviesen estando
+estado estada estados estadas estad he has ha hemos habéis han haya hayas hayamos hayáis
+hayan habré habrás habrá habremos habréis habrán habría habrías habríamos habríais habrían
+había habías habíamos habíais habían hube hubiste hubo hubimos hubisteis hubieron hubiera
+hubieras hubiéramos hubierais hubieran hubiese hubieses hubiésemos hubieseis hubiesen
+habiendo habido habida habidos habidas soy eres es somos sois son sea seas seamos seáis
+sean seré serás será seremos seréis serán sería serías seríamos seríais serían era eras
+éramos erais eran fui fuiste fue fuimos fuisteis fueron fuera fueras fuéramos fuerais
+fueran fuese fueses fuésemos fueseis fuesen sintiendo sentido sentida sentidos sentidas
+siente sentid tengo tienes tiene tenemos tenéis tienen tenga tengas tengamos tengáis
+tengan tendré tendrás tendrá tendremos tendréis tendrán tendría tendrías tendríamos
+tendríais tendrían tenía tenías teníamos teníais tenían tuve tuviste tuvo tuvimos
+tuvisteis tuvieron tuviera tuvieras tuviéramos tuvierais tuvieran tuviese tuvieses
+tuviésemos tuvieseis tuviesen teniendo tenido tenida tenidos tenidas tened
+""".split()
+
+# Ampliadas (pestaña Texto de app.py/appfn.py y STOPWORDS_ES de app1.py)
+EXTRA_ES = """
+si sì mas tambien pues q solo sólo alli allí ahi ahí aqui aquí
+ser siendo sido hoy año años mes meses día días así cada
+""".split()
+
+
+def normalizar(w: str) -> str:
+    """Minúsculas y sin acentos (misma forma que el texto normalizado de las abiertas)."""
+    w = unicodedata.normalize("NFKD", str(w).strip().lower())
+    return "".join(c for c in w if not unicodedata.combining(c))
+
+
+STOPWORDS_ES = frozenset(normalizar(w) for w in NLTK_ES + EXTRA_ES)
+
+
+@lru_cache(maxsize=8)
+def _leer_extra(path: str, mtime: float) -> frozenset:
+    with open(path, encoding="utf-8") as f:
+        return frozenset(normalizar(l) for l in f if l.strip() and not l.lstrip().startswith("#"))
+
+
+def cargar_stopwords(path: str = STOPWORDS_EXTRA_PATH, extra=()) -> frozenset:
+    """STOPWORDS_ES + las del proyecto (un término por línea en `path`, '#' comenta)
+    + `extra`. El archivo se relee sólo si cambia su fecha de modificación."""
+    sw = STOPWORDS_ES
+    if path and os.path.exists(path):
+        sw = sw | _leer_extra(path, os.path.getmtime(path))
+    if extra:
+        sw = sw | {normalizar(w) for w in extra if str(w).strip()}
+    return sw
+
+
+# ---------- Raíces (Snowball español) ----------
+_STEMMER = None
+
+
+@lru_cache(maxsize=200_000)
+def raiz(token: str) -> str:
+    """Raíz Snowball de un token, memorizada por token distinto (compartida entre
+    columnas y reruns del proceso). nltk se importa sólo la primera vez."""
+    global _STEMMER
+    if _STEMMER is None:
+        from nltk.stem.snowball import SpanishStemmer
+        _STEMMER = SpanishStemmer()
+    return _STEMMER.stem(token)
+
+
+def etiquetas_raices(formas: dict) -> dict:
+    """{raíz: Counter(forma: n)} -> {raíz: forma más frecuente} (para mostrar "calles"
+    en lugar de "call")."""
+    return {r: max(c.items(), key=lambda kv: (kv[1], kv[0]))[0] for r, c in formas.items() if c}
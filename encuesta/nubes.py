@@ -0,0 +1,90 @@
+# Nubes de palabras: el layout de WordCloud es caro, así que cada imagen se guarda en una
+# caché LRU en memoria con clave = hash de (tabla de frecuencias, opciones) y se dibuja en
+# un hilo aparte para que la página siga pintándose mientras tanto.
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+MAX_NUBES = 32
+OPCIONES_DEFAULT = dict(width=1000, height=400, background_color="white", max_words=200,
+                        collocations=False, colormap=None, random_state=0)
+
+_CACHE: "OrderedDict[str, Nube]" = OrderedDict()
+_EN_CURSO: dict = {}
+_LOCK = threading.Lock()
+_HILO = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nube")
+
+
+@dataclass(frozen=True)
+class Nube:
+    png: bytes          # imagen lista para descargar
+    array: np.ndarray   # (alto, ancho, 3) uint8 para st.image
+
+
+def _opciones(opciones: dict) -> dict:
+    return {**OPCIONES_DEFAULT, **opciones}
+
+
+def huella_nube(freqs: dict, **opciones) -> str:
+    """Clave de caché: frecuencias (ordenadas por término) + opciones de dibujo."""
+    items = sorted((str(k), float(v)) for k, v in freqs.items() if v > 0)
+    payload = json.dumps([items, sorted(_opciones(opciones).items())], ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _dibujar(freqs: dict, opciones: dict) -> Nube:
+    from wordcloud import WordCloud
+    wc = WordCloud(**opciones).generate_from_frequencies(freqs)
+    img = wc.to_image()
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return Nube(png=buf.getvalue(), array=np.asarray(img))
+
+
+def _guardar(clave: str, nube: Nube):
+    with _LOCK:
+        _CACHE[clave] = nube
+        _CACHE.move_to_end(clave)
+        while len(_CACHE) > MAX_NUBES:
+            _CACHE.popitem(last=False)
+        _EN_CURSO.pop(clave, None)
+
+
+def nube_async(freqs: dict, **opciones) -> Future:
+    """Future con la Nube: resuelto al instante si ya está en caché; si no, se dibuja en
+    el hilo de nubes (una sola vez aunque varias sesiones la pidan a la vez).
+    random_state fijo: la misma tabla produce siempre la misma imagen."""
+    clave = huella_nube(freqs, **opciones)
+    with _LOCK:
+        if clave in _CACHE:
+            _CACHE.move_to_end(clave)
+            fut = Future()
+            fut.set_result(_CACHE[clave])
+            return fut
+        if clave in _EN_CURSO:
+            return _EN_CURSO[clave]
+        freqs, opciones = dict(freqs), _opciones(opciones)
+
+        def tarea():
+            try:
+                nube = _dibujar(freqs, opciones)
+            except Exception:
+                with _LOCK:
+                    _EN_CURSO.pop(clave, None)
+                raise
+            _guardar(clave, nube)
+            return nube
+
+        fut = _EN_CURSO[clave] = _HILO.submit(tarea)
+        return fut
+
+
+def nube(freqs: dict, **opciones) -> Nube:
+    """Versión síncrona de nube_async."""
+    return nube_async(freqs, **opciones).result()
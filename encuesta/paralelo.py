@@ -0,0 +1,80 @@
+# Normalización de texto en paralelo: primero se deduplican los valores y sólo los
+# distintos se reparten, por bloques y en orden, a un pool de procesos reutilizable.
+# enviar() deja usar ese mismo pool para tareas sueltas (p. ej. los libros del anexo).
+import atexit
+import multiprocessing as mp
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import chain, repeat
+
+import numpy as np
+import pandas as pd
+
+# Por debajo de este nº de valores distintos el arranque del pool no compensa
+MIN_PARALELO = 20_000
+BLOQUE = 2_000
+
+_POOL = None
+_POOL_JOBS = 0
+
+
+def jobs_default() -> int:
+    env = os.environ.get("ENCUESTA_JOBS")
+    if env and env.isdigit():
+        return max(int(env), 1)
+    return max(min(os.cpu_count() or 1, 8), 1)
+
+
+def _pool(jobs: int) -> ProcessPoolExecutor:
+    """Pool compartido por el proceso (se recrea si cambia `jobs`). 'forkserver' evita
+    heredar hilos del servidor de Streamlit al hacer fork."""
+    global _POOL, _POOL_JOBS
+    if _POOL is None or _POOL_JOBS != jobs:
+        if _POOL is not None:
+            _POOL.shutdown(cancel_futures=True)
+        metodo = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        _POOL = ProcessPoolExecutor(max_workers=jobs, mp_context=mp.get_context(metodo))
+        _POOL_JOBS = jobs
+    return _POOL
+
+
+def enviar(fn, *args, jobs: int | None = None) -> Future:
+    """Encola fn(*args) en el pool compartido y devuelve su Future. fn debe ser una
+    función de módulo (picklable), igual que en map_lista."""
+    jobs = jobs_default() if jobs is None else max(int(jobs), 1)
+    return _pool(jobs).submit(fn, *args)
+
+
+@atexit.register
+def _cerrar_pool():
+    if _POOL is not None:
+        _POOL.shutdown(cancel_futures=True)
+
+
+def _aplicar(fn, valores):
+    return [fn(v) for v in valores]
+
+
+def map_lista(valores: list, fn, jobs: int | None = None, bloque: int = BLOQUE,
+              min_paralelo: int = MIN_PARALELO) -> list:
+    """[fn(v) for v in valores] en un pool de procesos, por bloques; el resultado
+    conserva el orden de entrada. fn debe ser una función de módulo (picklable)."""
+    jobs = jobs_default() if jobs is None else max(int(jobs), 1)
+    if jobs == 1 or len(valores) < min_paralelo:
+        return _aplicar(fn, valores)
+    bloques = [valores[i:i + bloque] for i in range(0, len(valores), bloque)]
+    return list(chain.from_iterable(_pool(jobs).map(_aplicar, repeat(fn), bloques)))
+
+
+def map_distintos(s: pd.Series, fn, jobs: int | None = None, **kw) -> pd.Series:
+    """fn aplicado una sola vez por valor distinto de `s` (NaN incluido como un valor
+    más) y expandido a todas las filas. Mismo índice que `s`."""
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    valores = list(uniques)
+    tiene_na = (codes < 0).any()
+    if tiene_na:
+        valores.append(np.nan)
+        codes = np.where(codes < 0, len(valores) - 1, codes)
+    out = np.empty(len(valores), dtype=object)
+    out[:] = map_lista(valores, fn, jobs=jobs, **kw)
+    return pd.Series(out[codes], index=s.index, dtype=object)
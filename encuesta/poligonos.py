@@ -0,0 +1,136 @@
+# Sector por polígono: une cada punto GPS con los límites oficiales de sector (GeoJSON
+# local) mediante un punto-en-polígono vectorizado (regla par-impar sobre todos los
+# anillos) con prefiltro por rectángulo envolvente, y compara con el SECTOR digitado.
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from unidecode import unidecode
+
+SECTORES_GEOJSON_PATH = "data/sectores.geojson"
+SECTOR_POLIGONO = "SECTOR_poligono"       # columna derivada
+FUERA = "(fuera de los polígonos)"         # con GPS pero en ningún polígono
+CAMPOS_NOMBRE = ("SECTOR", "sector", "Sector", "NOMBRE", "nombre", "name", "NAME")
+
+
+@dataclass(frozen=True)
+class Poligono:
+    nombre: str
+    x0: np.ndarray     # vértice inicial de cada arista (lon), todos los anillos juntos
+    y0: np.ndarray
+    x1: np.ndarray     # vértice final de cada arista
+    y1: np.ndarray
+    bbox: tuple        # (lon_min, lat_min, lon_max, lat_max)
+
+
+def _aristas(anillos) -> tuple:
+    """Aristas (x0, y0, x1, y1) de una lista de anillos [[lon, lat], …] (cerrados o no)."""
+    xs0, ys0, xs1, ys1 = [], [], [], []
+    for anillo in anillos:
+        a = np.asarray(anillo, dtype="float64")[:, :2]
+        if len(a) < 3:
+            continue
+        b = np.roll(a, -1, axis=0)
+        keep = np.any(a != b, axis=1)             # quita la arista nula del cierre
+        xs0.append(a[keep, 0]); ys0.append(a[keep, 1]); xs1.append(b[keep, 0]); ys1.append(b[keep, 1])
+    return tuple(np.concatenate(v) if v else np.empty(0) for v in (xs0, ys0, xs1, ys1))
+
+
+def _nombre(props: dict, campo: str | None, k: int) -> str:
+    if campo and campo in props:
+        return str(props[campo])
+    for c in CAMPOS_NOMBRE:
+        if props.get(c) not in (None, ""):
+            return str(props[c])
+    return f"Polígono {k + 1}"
+
+
+def leer_geojson(texto: str, campo: str | None = None) -> list:
+    """[Poligono] a partir de un FeatureCollection con Polygon / MultiPolygon (lon, lat).
+    Los huecos y las partes de un MultiPolygon entran como anillos del mismo polígono."""
+    gj = json.loads(texto)
+    feats = gj.get("features", [gj] if gj.get("type") == "Feature" else [])
+    out = []
+    for k, f in enumerate(feats):
+        geom = f.get("geometry") or {}
+        if geom.get("type") == "Polygon":
+            anillos = geom["coordinates"]
+        elif geom.get("type") == "MultiPolygon":
+            anillos = [r for parte in geom["coordinates"] for r in parte]
+        else:
+            continue
+        x0, y0, x1, y1 = _aristas(anillos)
+        if not len(x0):
+            continue
+        xs, ys = np.concatenate([x0, x1]), np.concatenate([y0, y1])
+        out.append(Poligono(_nombre(f.get("properties") or {}, campo, k), x0, y0, x1, y1,
+                            (xs.min(), ys.min(), xs.max(), ys.max())))
+    return out
+
+
+@lru_cache(maxsize=4)
+def _cargar(path: str, mtime: float, campo: str | None) -> tuple:
+    with open(path, encoding="utf-8") as f:
+        return tuple(leer_geojson(f.read(), campo))
+
+
+def cargar_poligonos(path: str = SECTORES_GEOJSON_PATH, campo: str | None = None) -> list:
+    """Polígonos de sector del GeoJSON local; [] si no existe (la función es opcional).
+    Se relee sólo si cambia el archivo."""
+    if not os.path.exists(path):
+        return []
+    return list(_cargar(path, os.path.getmtime(path), campo))
+
+
+def dentro(lat, lon, pol: Poligono) -> np.ndarray:
+    """Punto-en-polígono (par-impar) para arrays de puntos: rayo hacia +x, un paso
+    vectorizado por arista sobre los puntos que pasan el prefiltro por rectángulo."""
+    lat, lon = np.asarray(lat, dtype="float64"), np.asarray(lon, dtype="float64")
+    res = np.zeros(len(lat), dtype=bool)
+    lon_min, lat_min, lon_max, lat_max = pol.bbox
+    cand = np.flatnonzero((lon >= lon_min) & (lon <= lon_max) & (lat >= lat_min) & (lat <= lat_max))
+    if not len(cand):
+        return res
+    px, py = lon[cand], lat[cand]
+    par = np.zeros(len(cand), dtype=bool)
+    for x0, y0, x1, y1 in zip(pol.x0, pol.y0, pol.x1, pol.y1):
+        cruza = (y0 > py) != (y1 > py)
+        if cruza.any():
+            xc = x0 + (py - y0) * (x1 - x0) / (y1 - y0 if y1 != y0 else 1.0)
+            par ^= cruza & (px < xc)
+    res[cand] = par
+    return res
+
+
+def asignar_sector(lat, lon, poligonos: list) -> np.ndarray:
+    """Nombre del polígono que contiene cada punto (el primero, si se solapan); FUERA si
+    cae fuera de todos y None si no tiene coordenadas."""
+    lat, lon = np.asarray(lat, dtype="float64"), np.asarray(lon, dtype="float64")
+    libre = np.isfinite(lat) & np.isfinite(lon)
+    out = np.where(libre, FUERA, None).astype(object)
+    for pol in poligonos:
+        idx = np.flatnonzero(libre)
+        if not len(idx):
+            break
+        hit = idx[dentro(lat[idx], lon[idx], pol)]
+        out[hit] = pol.nombre
+        libre[hit] = False
+    return out
+
+
+def _clave(s: pd.Series) -> pd.Series:
+    return s.astype("string").str.strip().str.lower().map(lambda v: unidecode(v) if isinstance(v, str) else v)
+
+
+def discrepancias(df: pd.DataFrame, sector_col: str, derivado_col: str = SECTOR_POLIGONO) -> pd.DataFrame:
+    """Registros con GPS cuyo SECTOR digitado no coincide con el del polígono (comparación
+    sin acentos ni mayúsculas) o que caen fuera de todo polígono. Columna `motivo`."""
+    der = df[derivado_col]
+    distinto = der.notna() & (der != FUERA) & (_clave(df[sector_col]) != _clave(der)).fillna(True)
+    out = df.loc[distinto | (der == FUERA), [sector_col, derivado_col]].copy()
+    out.insert(0, "fila", out.index)
+    out["motivo"] = np.where(out[derivado_col] == FUERA, "fuera de los polígonos", "sector distinto")
+    return out.reset_index(drop=True)
@@ -0,0 +1,113 @@
+# Respuestas abiertas casi iguales ("falta de agua", "falta agua potable"): firmas
+# MinHash sobre el conjunto de palabras de cada respuesta DISTINTA normalizada y
+# buckets LSH por bandas; cada texto sólo se compara con los de sus buckets, así que el
+# coste es ~lineal en nº de respuestas distintas.
+import zlib
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from .lexico import raiz
+from .textos import _TOKEN, corpus
+
+_PRIMO = np.uint64(4_294_967_311)   # primo > 2**32: h(x) = (a·x + b) mod p sin desbordar
+
+
+def bandas_para(umbral: float, k: int = 64) -> tuple:
+    """(bandas, filas) con bandas·filas = k cuyo umbral LSH (1/b)^(1/r) queda más cerca
+    de `umbral` (similitud de Jaccard a partir de la cual dos textos suelen coincidir)."""
+    opciones = [(b, k // b) for b in range(1, k + 1) if k % b == 0]
+    return min(opciones, key=lambda br: abs((1 / br[0]) ** (1 / br[1]) - umbral))
+
+
+def _palabras(texto: str, stop_words, stem: bool) -> list:
+    toks = {t for t in _TOKEN.findall(texto) if t not in stop_words}
+    return sorted(raiz(t) for t in toks) if stem else sorted(toks)
+
+
+def firmas(conjuntos: list, k: int = 64, semilla: int = 0) -> np.ndarray:
+    """Matriz (n, k) uint64 de MinHash: para cada permutación aproximada (a·x+b mod p),
+    el mínimo sobre las palabras (crc32) de cada conjunto. Conjuntos vacíos -> p."""
+    rng = np.random.default_rng(semilla)
+    a = rng.integers(1, 2**31, size=k, dtype=np.uint64)
+    b = rng.integers(0, 2**31, size=k, dtype=np.uint64)
+    largos = np.fromiter((len(c) for c in conjuntos), dtype=np.int64, count=len(conjuntos))
+    sig = np.full((len(conjuntos), k), _PRIMO, dtype=np.uint64)
+    llenos = np.flatnonzero(largos)
+    if not len(llenos):
+        return sig
+    x = np.fromiter((zlib.crc32(w.encode("utf-8")) for c in conjuntos for w in c),
+                    dtype=np.uint64, count=int(largos.sum()))
+    inicios = np.concatenate(([0], np.cumsum(largos[llenos])[:-1]))
+    for i in range(0, k, 8):            # por tramos de permutaciones: memoria acotada
+        h = (a[i:i + 8, None] * x[None, :] + b[i:i + 8, None]) % _PRIMO
+        sig[llenos, i:i + 8] = np.minimum.reduceat(h, inicios, axis=1).T
+    return sig
+
+
+def _buckets(sig: np.ndarray, bandas: int, filas: int) -> sparse.csr_matrix:
+    """Incidencia textos × buckets LSH: un bucket por (banda, hash de sus `filas` MinHash)."""
+    n = len(sig)
+    mult = np.random.default_rng(1).integers(1, 2**63, size=filas, dtype=np.uint64)
+    ids, total = np.empty((n, bandas), dtype=np.int64), 0
+    for b in range(bandas):
+        clave = (sig[:, b * filas:(b + 1) * filas] * mult).sum(axis=1)   # desborda: es un hash
+        codes, uniq = pd.factorize(clave)
+        ids[:, b] = codes + total
+        total += len(uniq)
+    return sparse.csr_matrix((np.ones(n * bandas, dtype=np.int8), ids.ravel(), np.arange(0, n * bandas + 1, bandas)),
+                             shape=(n, total))
+
+
+def agrupar(s: pd.Series, stop_words=(), umbral: float = 0.5, k: int = 64, stem: bool = False,
+            semilla: int = 0) -> pd.DataFrame:
+    """Agrupa respuestas casi iguales de una columna abierta. Devuelve, por fila con
+    texto (mismo índice que `s`, sin vacíos ni no-respuestas):
+    - texto: respuesta normalizada
+    - grupo: id de grupo (posición de su texto líder entre los textos distintos)
+    - representante: texto líder del grupo (su respuesta más frecuente)
+    Agrupamiento por líder: de la respuesta más frecuente a la menos, cada texto aún
+    libre abre grupo y se queda con los textos libres de sus buckets LSH cuya similitud
+    estimada con él alcanza `umbral` (sin encadenamientos A~B~C). Las respuestas sin
+    palabras útiles (sólo stopwords) forman grupo por texto exacto."""
+    textos = corpus(s)
+    codes, uniques = pd.factorize(textos)
+    n = len(uniques)
+    if not n:
+        return pd.DataFrame({"texto": pd.Series(dtype=str), "grupo": pd.Series(dtype="int64"),
+                             "representante": pd.Series(dtype=str)})
+    conjuntos = [_palabras(t, stop_words, stem) for t in uniques]
+    sig = firmas(conjuntos, k=k, semilla=semilla)
+    M = _buckets(sig, *bandas_para(umbral, k))
+    vacio = np.fromiter((not c for c in conjuntos), dtype=bool, count=n)
+    tam = np.asarray(M.sum(axis=0)).ravel()
+    # sólo buscan candidatos los textos con algún bucket compartido
+    compartido = np.asarray(M[:, tam > 1].sum(axis=1)).ravel() > 0
+    MT = M.T.tocsr()
+    lider = np.full(n, -1, dtype=np.int64)
+    frec = np.bincount(codes, minlength=n)
+    for c in np.lexsort((np.arange(n), -frec)):
+        if lider[c] >= 0:
+            continue
+        lider[c] = c
+        if vacio[c] or not compartido[c]:
+            continue
+        bks = M.indices[M.indptr[c]:M.indptr[c + 1]]
+        bks = bks[tam[bks] > 1]
+        cand = np.unique(np.concatenate([MT.indices[MT.indptr[b]:MT.indptr[b + 1]] for b in bks]))
+        cand = cand[(lider[cand] < 0) & ~vacio[cand]]
+        if len(cand):
+            lider[cand[(sig[cand] == sig[c]).mean(axis=1) >= umbral]] = c
+    return pd.DataFrame({"texto": textos.to_numpy(), "grupo": lider[codes],
+                         "representante": uniques[lider][codes]}, index=textos.index)
+
+
+def representantes(grupos: pd.DataFrame, index=None, min_tamano: int = 1) -> pd.DataFrame:
+    """Un renglón por grupo (dentro de `index`, si se da): representante, tamaño (nº de
+    respuestas) y variantes (nº de textos distintos), ordenado por tamaño."""
+    g = grupos if index is None else grupos[grupos.index.isin(index)]
+    out = g.groupby("grupo", sort=False).agg(representante=("representante", "first"), tamaño=("texto", "size"),
+                                             variantes=("texto", "nunique")).reset_index()
+    out = out[out["tamaño"] >= min_tamano]
+    return out.sort_values(["tamaño", "representante"], ascending=[False, True]).reset_index(drop=True)
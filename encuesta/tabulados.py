@@ -0,0 +1,293 @@
+# Motor de tabulados: vc_percent / crosstab_pct y el plan de tabulados B–G del
+# anexo estadístico, independiente de Streamlit.
+import numpy as np
+import pandas as pd
+
+MISSING_LABELS = {
+    "", "(Sin dato)", "No contestó", "No contesto", "No respondió", "No responde",
+    "No sabe/No responde", "NS/NR", "Ns/Nr", "NSNR", "No aplica", "NA", "N/A",
+    "Sin respuesta", "NR"
+}
+
+
+def _cat(s: pd.Series) -> pd.Series:
+    # convierte a object, rellena NaN a "(Sin dato)" y fuerza str
+    return s.astype("object").where(s.notna(), "(Sin dato)").astype(str)
+
+
+def vc_percent(df, col, by=None):
+    if col not in df.columns: return pd.DataFrame(columns=[col, "n", "%"])
+    if by is not None and by not in df.columns: by = None
+
+    if by is None:
+        s = _cat(df[col])
+        s = s[~s.isin(MISSING_LABELS)]
+        if s.empty: return pd.DataFrame(columns=[col, "n", "%"])
+        t = s.value_counts(dropna=False).rename_axis(col).reset_index(name="n")
+        total = int(t["n"].sum())
+        t["%"] = (t["n"] / total * 100).round(1) if total else 0
+        return t
+
+    tmp = pd.DataFrame({by: _cat(df[by]), col: _cat(df[col])})
+    tmp = tmp[~tmp[col].isin(MISSING_LABELS)]
+    if tmp.empty: return pd.DataFrame(columns=[by, col, "n", "%"])
+    t = tmp.groupby([by, col], dropna=False).size().rename("n").reset_index()
+    t["%"] = t.groupby(by)["n"].transform(lambda s: (s/s.sum()*100).round(1))
+    return t
+
+
+def _one_crosstab(rr, cc):
+    tab = pd.crosstab(rr, cc, dropna=False)
+    tab.columns = tab.columns.astype(str)
+    tab["n_fila"] = tab.sum(axis=1)
+    pct = (tab.div(tab["n_fila"].replace(0, np.nan), axis=0)*100).round(1)
+    tab = tab.drop(columns=["n_fila"])
+    return tab, pct
+
+
+def crosstab_pct(df, r, c, by=None):
+    if (r not in df.columns) or (c not in df.columns):
+        return pd.DataFrame()
+
+    if by is None or by not in df.columns:
+        rr, cc = _cat(df[r]), _cat(df[c])
+        mask = (~rr.isin(MISSING_LABELS)) & (~cc.isin(MISSING_LABELS))
+        rr, cc = rr[mask], cc[mask]
+        if rr.empty or cc.empty: return pd.DataFrame()
+        tab, pct = _one_crosstab(rr, cc)
+        tab["__tipo__"] = "n"; pct["__tipo__"] = "%"
+        return pd.concat(
+            [tab.reset_index().rename(columns={"index": r}),
+             pct.reset_index().rename(columns={"index": r})],
+            ignore_index=True
+        )
+
+    # con 'by': iterar grupos
+    out = []
+    for g, sub in df.groupby(by, observed=True):
+        rr, cc = _cat(sub[r]), _cat(sub[c])
+        mask = (~rr.isin(MISSING_LABELS)) & (~cc.isin(MISSING_LABELS))
+        rr, cc = rr[mask], cc[mask]
+        if rr.empty or cc.empty: continue
+        tab, pct = _one_crosstab(rr, cc)
+        tab["__grupo__"] = str(g); tab["__tipo__"] = "n"
+        pct["__grupo__"] = str(g); pct["__tipo__"] = "%"
+        out.append(tab.reset_index().rename(columns={"index": r}))
+        out.append(pct.reset_index().rename(columns={"index": r}))
+    return pd.concat(out, ignore_index=True) if out else pd.DataFrame()
+
+
+# ---------- Subconjuntos por uso de estructura (p004) ----------
+def is_vivienda_or_mixto(v):
+    if v is None: return False
+    s = str(v).strip().lower()
+    return ("vivienda" in s) or ("mixto" in s) or ("vivienda–negocio" in s) or ("vivienda-negocio" in s)
+
+
+def is_negocio_or_mixto(v):
+    if v is None: return False
+    s = str(v).strip().lower()
+    return ("negocio" in s) or ("mixto" in s) or ("vivienda–negocio" in s) or ("vivienda-negocio" in s)
+
+
+def _subset_mask(s: pd.Series, fn) -> np.ndarray:
+    # fn se evalúa una vez por valor distinto y se expande por códigos de categoría
+    cat = s.astype("category")
+    flags = np.array([fn(v) for v in cat.cat.categories] + [False], dtype=bool)
+    return flags[cat.cat.codes.to_numpy()]
+
+
+SUBSETS = {"todos": None, "vivienda": is_vivienda_or_mixto, "negocio": is_negocio_or_mixto}
+
+
+def subset(df: pd.DataFrame, name: str, p004: str | None) -> pd.DataFrame:
+    fn = SUBSETS[name]
+    if fn is None or not p004 or p004 not in df.columns:
+        return df
+    return df[_subset_mask(df[p004], fn)]
+
+
+# ---------- Plan de tabulados (anexo estadístico) ----------
+# (clave de hoja, subconjunto, tipo "vc"/"xt", roles). Los roles se resuelven con el
+# mapeo de variables de la barra lateral ({rol: columna}).
+PLAN = [
+    ("B_p004", "todos", "vc", ("p004",)),
+    ("B_p005", "todos", "vc", ("p005",)),
+    ("B_p006", "todos", "vc", ("p006",)),
+    ("B_p007", "todos", "vc", ("p007",)),
+    ("B_p008", "todos", "vc", ("p008",)),
+    ("B_p004x_p005", "todos", "xt", ("p004", "p005")),
+    ("B_p005x_p006", "todos", "xt", ("p005", "p006")),
+    ("B_p005x_p007", "todos", "xt", ("p005", "p007")),
+    ("B_p005x_p008", "todos", "xt", ("p005", "p008")),
+    ("B_p004x_p006", "todos", "xt", ("p004", "p006")),
+    ("B_p004x_p007", "todos", "xt", ("p004", "p007")),
+    ("B_p004x_p008", "todos", "xt", ("p004", "p008")),
+
+    ("C_nvivienda", "vivienda", "vc", ("nviv",)),
+    ("C_p009a", "vivienda", "vc", ("p009a",)),
+    ("C_p009b", "vivienda", "vc", ("p009b",)),
+    ("C_p010", "vivienda", "vc", ("p010",)),
+    ("C_sexoj", "vivienda", "vc", ("sexoj",)),
+    ("C_p011", "vivienda", "vc", ("p011",)),
+    ("C_sexoj_x_p010", "vivienda", "xt", ("sexoj", "p010")),
+    ("C_sexoj_x_p015", "vivienda", "xt", ("sexoj", "p015")),
+    ("C_sexoj_x_p005", "vivienda", "xt", ("sexoj", "p005")),
+    ("C_sexoj_x_p014", "vivienda", "xt", ("sexoj", "p014")),
+    ("C_sexoj_x_p011", "vivienda", "xt", ("sexoj", "p011")),
+    ("C_p010_x_p015", "vivienda", "xt", ("p010", "p015")),
+    ("C_p010_x_p005", "vivienda", "xt", ("p010", "p005")),
+
+    ("D_p012", "vivienda", "vc", ("p012",)),
+    ("D_p013", "vivienda", "vc", ("p013",)),
+    ("D_p014", "vivienda", "vc", ("p014",)),
+    ("D_p022", "vivienda", "vc", ("p022",)),
+    ("D_p014_x_sexoj", "vivienda", "xt", ("p014", "sexoj")),
+    ("D_p013_x_p011", "vivienda", "xt", ("p013", "p011")),
+    ("D_p022_x_p010", "vivienda", "xt", ("p022", "p010")),
+    ("D_p022_x_p015", "vivienda", "xt", ("p022", "p015")),
+
+    ("E_p015", "vivienda", "vc", ("p015",)),
+    ("E_p016", "vivienda", "vc", ("p016",)),
+    ("E_p017", "vivienda", "vc", ("p017",)),
+    ("E_p018", "vivienda", "vc", ("p018",)),
+    ("E_p019", "vivienda", "vc", ("p019",)),
+    ("E_p020", "vivienda", "vc", ("p020",)),
+    ("E_p021", "vivienda", "vc", ("p021",)),
+    ("E_p015_x_p010", "vivienda", "xt", ("p015", "p010")),
+    ("E_p015_x_sexoj", "vivienda", "xt", ("p015", "sexoj")),
+    ("E_p015_x_p005", "vivienda", "xt", ("p015", "p005")),
+    ("E_p016_x_p017", "vivienda", "xt", ("p016", "p017")),
+    ("E_p018_x_p019", "vivienda", "xt", ("p018", "p019")),
+    ("E_p020_x_p021", "vivienda", "xt", ("p020", "p021")),
+
+    ("F_p025", "negocio", "vc", ("p025",)),
+    ("F_p026", "negocio", "vc", ("p026",)),
+    ("F_p027", "negocio", "vc", ("p027",)),
+    ("F_p028", "negocio", "vc", ("p028",)),
+    ("F_p029", "negocio", "vc", ("p029",)),
+    ("F_p030", "negocio", "vc", ("p030",)),
+    ("F_p031", "negocio", "vc", ("p031",)),
+    ("F_p032", "negocio", "vc", ("p032",)),
+    ("F_p025_x_p027", "negocio", "xt", ("p025", "p027")),
+    ("F_p027_x_p028", "negocio", "xt", ("p027", "p028")),
+    ("F_p030_x_p029", "negocio", "xt", ("p030", "p029")),
+    ("F_p026_x_p027", "negocio", "xt", ("p026", "p027")),
+    ("F_p031_x_p027", "negocio", "xt", ("p031", "p027")),
+
+    ("G_p036", "todos", "vc", ("p036",)),
+    ("G_p035", "todos", "vc", ("p035",)),
+    ("G_p035tx", "todos", "vc", ("p035tx",)),
+    ("G_p036_x_p004", "todos", "xt", ("p036", "p004")),
+    ("G_p036_x_sexoj", "todos", "xt", ("p036", "sexoj")),
+    ("G_p035_x_p035tx", "todos", "xt", ("p035", "p035tx")),
+]
+
+
+def _mapped(m: dict, role: str):
+    v = m.get(role)
+    return v if v and v != "<ninguna>" else None
+
+
+def plan_tables(m: dict):
+    """Entradas del PLAN con todas sus variables mapeadas: (clave, subconjunto, tipo, columnas)."""
+    out = []
+    for key, sub, kind, roles in PLAN:
+        cols = [_mapped(m, r) for r in roles]
+        if all(cols):
+            out.append((key, sub, kind, tuple(cols)))
+    return out
+
+
+def table_columns(entry, m: dict) -> set:
+    """Columnas de las que depende una tabla (variables + p004 del subconjunto + sector)."""
+    _, sub, _, cols = entry
+    deps = set(cols)
+    if sub != "todos" and _mapped(m, "p004"):
+        deps.add(m["p004"])
+    if _mapped(m, "sector"):
+        deps.add(m["sector"])
+    return deps
+
+
+def build_table(df: pd.DataFrame, entry, m: dict, by: str | None = None, _cache: dict | None = None):
+    key, sub, kind, cols = entry
+    if _cache is not None:
+        if sub not in _cache:
+            _cache[sub] = subset(df, sub, _mapped(m, "p004"))
+        base = _cache[sub]
+    else:
+        base = subset(df, sub, _mapped(m, "p004"))
+    if kind == "vc":
+        return vc_percent(base, cols[0], by=by)
+    return crosstab_pct(base, cols[0], cols[1], by=by)
+
+
+def build_annex(df: pd.DataFrame, m: dict, by: str | None = None, keys=None) -> dict:
+    """Calcula las tablas del plan (todas, o sólo `keys`) -> {clave de hoja: DataFrame}."""
+    cache = {}
+    out = {}
+    for entry in plan_tables(m):
+        if keys is not None and entry[0] not in keys:
+            continue
+        out[entry[0]] = build_table(df, entry, m, by=by, _cache=cache)
+    return out
+
+
+# ---------- Bloque I: indicadores (reglas heurísticas sobre las etiquetas) ----------
+ROLES_INDICADORES = ("p005", "sexoj", "p010", "p015", "p018", "p027", "p022", "p032", "p030", "p029")
+
+def _has(s: pd.Series, pat: str) -> pd.Series:
+    """.str.contains con regex y NA -> False."""
+    return s.str.contains(pat, regex=True, na=False)
+
+
+def _indicadores(base: pd.DataFrame, m: dict) -> dict:
+    ind = {}
+
+    def texto(role):
+        return base[m[role]].astype(str).str.lower()
+
+    def pct(mask):
+        return mask.mean() * 100 if len(mask) > 0 else np.nan
+
+    if _mapped(m, "p005"):
+        s = texto("p005")
+        ind["% estructuras en mal estado"] = pct(_has(s, r"\bmalo\b") | _has(s, r"\bmal\b"))
+    if _mapped(m, "sexoj"):
+        s = texto("sexoj")
+        ind["% hogares con jefatura femenina"] = pct(_has(s, "mujer") | _has(s, "femen"))
+    if _mapped(m, "p010"):
+        s = texto("p010")
+        ind["% hogares con tenencia precaria"] = pct(_has(s, "prest") | _has(s, "invad") | _has(s, "alquil.*sin")
+                                                     | _has(s, "sin.*titul"))
+    if _mapped(m, "p015"):
+        s = texto("p015")
+        ind["% hogares sin acceso a agua potable"] = pct(~(_has(s, "agua") | _has(s, "acued")))
+    if _mapped(m, "p018"):
+        s = texto("p018")
+        ind["% hogares con saneamiento inadecuado"] = pct(_has(s, "letrin") | _has(s, "ninguno") | _has(s, "compart"))
+    if _mapped(m, "p027"):
+        s = texto("p027")
+        ind["% negocios sin permisos"] = pct(_has(s, r"^no\b") | _has(s, r"\bninguno\b"))
+    if _mapped(m, "p022"):
+        ind["Promedio activos por hogar"] = pd.to_numeric(base[m["p022"]], errors="coerce").mean()
+    if _mapped(m, "p032"):
+        ind["Promedio activos por negocio"] = pd.to_numeric(base[m["p032"]], errors="coerce").mean()
+    if _mapped(m, "p030") and _mapped(m, "p029"):
+        num = pd.to_numeric(base[m["p030"]], errors="coerce")
+        den = pd.to_numeric(base[m["p029"]], errors="coerce").replace(0, np.nan)
+        ind["% negocios con personal formalizado"] = (num / den).mean() * 100 if den.notna().any() else np.nan
+    return ind
+
+
+def indicadores(df: pd.DataFrame, m: dict, by: str | None = None) -> pd.DataFrame:
+    """Indicadores del bloque I: columnas Indicador, Valor (y una columna por grupo de
+    `by`, si se da, además del Total)."""
+    ind = _indicadores(df, m)
+    out = pd.DataFrame({"Indicador": list(ind), "Valor": list(ind.values())})
+    if by is not None and by in df.columns and len(out):
+        out = out.rename(columns={"Valor": "Total"})
+        for g, sub in df.groupby(by, sort=True):
+            out[str(g)] = out["Indicador"].map(_indicadores(sub, m))
+    return out
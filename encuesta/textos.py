@@ -0,0 +1,374 @@
+# Preguntas abiertas: normalización del corpus y matriz documento-término (1,2)-gramas
+# ajustada una sola vez por columna; top-N, filtros y cortes por sector se responden
+# cortando filas de la matriz dispersa y sumando columnas. Corpus y matrices se
+# persisten en disco (CACHE_DIR) con clave = hash del contenido de la columna.
+import glob
+import hashlib
+import io
+import json
+import os
+import re
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from unidecode import unidecode
+
+from .lexico import etiquetas_raices, raiz
+from .paralelo import map_distintos
+from .tabulados import MISSING_LABELS
+from .versiones import huella
+
+_MISSING_LOWER = {m.lower() for m in MISSING_LABELS}
+MISSING_TEXT_PATTERNS = (
+    r"^no\s*contesta.?$|^no\s*respond[eió].?$|^ns/?nr$|^no\s*sabe\s*/?\s*no\s*responde$|^sin\s*respuesta$|^na$|^n/?a$",
+)
+_MISSING_RE = [re.compile(p, flags=re.I) for p in MISSING_TEXT_PATTERNS]
+
+
+def is_missing_text(s) -> bool:
+    s = str(s or "").strip().lower()
+    if s in _MISSING_LOWER: return True
+    return any(p.match(s) for p in _MISSING_RE)
+
+
+def norm(s) -> str:
+    if pd.isna(s): return ""
+    s = str(s).replace("\n", " ").lower()
+    s = re.sub(r"\s+", " ", s).strip()
+    return unidecode(s)
+
+
+def norm_respuesta(s) -> str:
+    """norm(s), o "" si es NaN o una no-respuesta."""
+    if pd.isna(s): return ""
+    s = str(s)
+    return "" if is_missing_text(s) else norm(s)
+
+
+def _strip_accents(s: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
+
+
+def clean_text_spanish(s: str) -> str:
+    if not isinstance(s, str):
+        return ""
+    s = s.lower()
+    s = _strip_accents(s)
+    s = re.sub(r"http\S+|www\.\S+", " ", s)    # URLs
+    s = re.sub(r"[@#]\w+", " ", s)             # @usuario, #hashtag
+    s = re.sub(r"[\U00010000-\U0010ffff]", " ", s)  # emojis/símbolos
+    s = re.sub(r"[^a-z0-9\s]", " ", s)         # mantener letras/números/espacio
+    s = re.sub(r"\s+", " ", s).strip()
+    return s
+
+
+def corpus(s: pd.Series, jobs: int | None = None) -> pd.Series:
+    """Texto normalizado sin no-respuestas ni vacíos/NaN (índice = filas originales).
+    Se normaliza una vez por valor distinto (en paralelo si son muchos)."""
+    out = map_distintos(s, norm_respuesta, jobs=jobs).astype(str)
+    return out[out.str.len() > 0]
+
+
+CACHE_DIR = "data/.cache_texto"
+CACHE_MAX_ARCHIVOS = 200
+_FORMATO = "2"   # subir si cambia corpus()/ajustar_dtm() para invalidar la caché
+
+
+_VACIO = pd.DataFrame(columns=["término", "frecuencia"])
+
+
+@dataclass
+class MatrizTerminos:
+    textos: pd.Series          # corpus normalizado (una fila por documento)
+    X: sparse.csr_matrix       # documentos × términos (conteos)
+    vocab: np.ndarray          # términos ("palabra" o "palabra palabra"; raíces si stem)
+    n: np.ndarray              # 1 = unigrama, 2 = bigrama
+    etiquetas: np.ndarray | None = None   # forma a mostrar por término (con stem)
+    stem: bool = False
+
+    @property
+    def nombres(self) -> np.ndarray:
+        return self.vocab if self.etiquetas is None else self.etiquetas
+
+    def filas(self, index=None) -> np.ndarray:
+        """Máscara de documentos cuyas filas originales están en `index` (None = todas)."""
+        if index is None:
+            return np.ones(len(self.textos), dtype=bool)
+        return self.textos.index.isin(index)
+
+    def frecuencias(self, index=None, n=1, top=20, min_df=2) -> pd.DataFrame:
+        """Top términos de n palabras en el subconjunto; min_df sobre ese subconjunto."""
+        cols = np.flatnonzero(self.n == n)
+        if not len(cols) or not self.X.shape[0]:
+            return _VACIO.copy()
+        Xs = self.X[self.filas(index)][:, cols]
+        freqs = np.asarray(Xs.sum(axis=0)).ravel()
+        docs = np.diff(Xs.tocsc().indptr)
+        ok = np.flatnonzero((docs >= min_df) & (freqs > 0))
+        if not len(ok):
+            return _VACIO.copy()
+        order = ok[np.lexsort((self.vocab[cols][ok], -freqs[ok]))][:top]
+        return pd.DataFrame({"término": self.nombres[cols][order], "frecuencia": freqs[order]})
+
+    # ---- índice invertido (término -> documentos): columnas de X en formato CSC
+    @cached_property
+    def _indice(self) -> sparse.csc_matrix:
+        return self.X.tocsc()
+
+    @cached_property
+    def _columna(self) -> dict:
+        return {t: j for j, t in enumerate(self.vocab)}
+
+    def terminos_consulta(self, consulta: str, stop_words=()) -> list:
+        """Términos del vocabulario que pide una consulta: cada palabra es un unigrama
+        (AND); un "texto entre comillas" pide sus bigramas consecutivos (frase, sin
+        stopwords). Normalizada igual que el corpus (y reducida a raíz si stem)."""
+        out = []
+        for k, parte in enumerate(re.split(r'"([^"]*)"', consulta)):
+            toks = [t for t in _TOKEN.findall(norm(parte)) if t not in stop_words]
+            if self.stem:
+                toks = [raiz(t) for t in toks]
+            out += [f"{a} {b}" for a, b in zip(toks, toks[1:])] if k % 2 and len(toks) > 1 else toks
+        return list(dict.fromkeys(out))
+
+    def buscar(self, consulta: str, index=None, stop_words=()) -> pd.Index:
+        """Filas originales (en `index`, si se da) cuyas respuestas contienen todos los
+        términos de la consulta. Intersección de listas de documentos del índice."""
+        terminos = self.terminos_consulta(consulta, stop_words)
+        if not terminos or any(t not in self._columna for t in terminos):
+            return self.textos.index[:0]
+        P = self._indice
+        docs = None
+        for j in sorted((self._columna[t] for t in terminos), key=lambda j: P.indptr[j + 1] - P.indptr[j]):
+            d = P.indices[P.indptr[j]:P.indptr[j + 1]]
+            docs = d if docs is None else np.intersect1d(docs, d, assume_unique=True)
+        filas = self.textos.index[np.sort(docs)]
+        return filas if index is None else filas[filas.isin(index)]
+
+    def _conteos_grupo(self, grupos: pd.Series, n: int):
+        """(etiquetas, columnas, F, D): frecuencia y nº de documentos de cada término de n
+        palabras por grupo, en una pasada dispersa (indicadora grupos × documentos @ X).
+        `grupos` indexada por fila original; documentos sin grupo se omiten."""
+        cols = np.flatnonzero(self.n == n)
+        codes, labels = pd.factorize(grupos.reindex(self.textos.index))
+        pos = np.flatnonzero(codes >= 0)
+        if not len(cols) or not len(pos):
+            return labels[:0], cols, None, None
+        G = sparse.csr_matrix((np.ones(len(pos)), (codes[pos], pos)),
+                              shape=(len(labels), len(self.textos)))
+        Xc = self.X[:, cols]
+        F = (G @ Xc).toarray()
+        D = (G @ (Xc > 0).astype("int64")).toarray()
+        return labels, cols, F, D
+
+    def _ranking(self, labels, cols, D, F, puntaje, top, min_df, extra=None) -> pd.DataFrame:
+        out = []
+        for k, lab in enumerate(labels):
+            ok = np.flatnonzero((D[k] >= min_df) & (F[k] > 0))
+            order = ok[np.lexsort((self.vocab[cols][ok], -puntaje[k][ok]))][:top]
+            t = pd.DataFrame({"grupo": lab, "término": self.nombres[cols][order],
+                              "frecuencia": F[k][order].astype(int)})
+            if extra is not None:
+                t[extra] = puntaje[k][order].round(3)
+            out.append(t)
+        return pd.concat(out, ignore_index=True)
+
+    def por_grupo(self, grupos: pd.Series, n=1, top=10, min_df=2) -> pd.DataFrame:
+        """Top términos por grupo (p.ej. SECTOR)."""
+        labels, cols, F, D = self._conteos_grupo(grupos, n)
+        if F is None:
+            return pd.DataFrame(columns=["grupo", "término", "frecuencia"])
+        return self._ranking(labels, cols, D, F, F, top, min_df)
+
+    def distintivos(self, grupos: pd.Series, n=1, top=10, min_df=2, metodo="log-odds",
+                    alpha0: float = 500.0) -> pd.DataFrame:
+        """Términos que caracterizan a cada grupo frente al resto.
+        - "log-odds": z del log-odds ratio con prior de Dirichlet informativo (Monroe et al.
+          2008): prior proporcional a la frecuencia global, con masa total `alpha0`.
+        - "tf-idf": frecuencia relativa en el grupo × idf suavizado sobre grupos (cada
+          grupo es un documento)."""
+        labels, cols, F, D = self._conteos_grupo(grupos, n)
+        if F is None:
+            return pd.DataFrame(columns=["grupo", "término", "frecuencia", "puntaje"])
+        nk = F.sum(axis=1, keepdims=True)
+        if metodo == "tf-idf":
+            df_g = (F > 0).sum(axis=0)
+            idf = np.log((1 + len(labels)) / (1 + df_g)) + 1
+            score = F / np.maximum(nk, 1) * idf
+        else:
+            tot = F.sum(axis=0)
+            a = alpha0 * tot / max(tot.sum(), 1)
+            y_o, n_o = tot - F, nk.sum() - nk
+            with np.errstate(divide="ignore", invalid="ignore"):
+                delta = (np.log((F + a) / (nk + alpha0 - F - a))
+                         - np.log((y_o + a) / (n_o + alpha0 - y_o - a)))
+                score = delta / np.sqrt(1 / (F + a) + 1 / (y_o + a))
+            score = np.nan_to_num(score, nan=0.0, posinf=0.0, neginf=0.0)
+        return self._ranking(labels, cols, D, F, score, top, min_df, extra="puntaje")
+
+
+_PALABRA = re.compile(r"\w+")
+
+
+def kwic(texto: str, terminos, stem: bool = False, ancho: int = 60) -> list:
+    """Palabra clave en contexto sobre el texto ORIGINAL: [(trozo, es_coincidencia)]
+    alrededor de la primera coincidencia (±`ancho` caracteres). Las palabras se comparan
+    normalizadas (sin acentos, minúsculas; raíz si stem) con las de `terminos`."""
+    texto = re.sub(r"\s+", " ", str(texto)).strip()
+    claves = {p for t in terminos for p in t.split(" ")}
+    spans = []
+    for m in _PALABRA.finditer(texto):
+        w = unidecode(m.group(0).lower())
+        if (raiz(w) if stem else w) in claves:
+            spans.append(m.span())
+    if not spans:
+        return [(texto[:2 * ancho] + ("…" if len(texto) > 2 * ancho else ""), False)]
+    ini, fin = max(spans[0][0] - ancho, 0), min(spans[0][1] + ancho, len(texto))
+    out, pos = [("…" if ini else "", False)], ini
+    for a, b in spans:
+        if a >= fin:
+            break
+        out += [(texto[pos:a], False), (texto[a:b], True)]
+        pos = b
+    out.append((texto[pos:max(fin, pos)] + ("…" if fin < len(texto) else ""), False))
+    return [(t, m) for t, m in out if t]
+
+
+def _n_palabras(vocab) -> np.ndarray:
+    return np.fromiter((t.count(" ") + 1 for t in vocab), dtype="int8", count=len(vocab))
+
+
+_TOKEN = re.compile(r"(?u)\b\w\w+\b")   # token_pattern por defecto de CountVectorizer
+
+
+class Analizador:
+    """Analizador (1,2)-gramas para CountVectorizer, equivalente al de sklearn con
+    stop_words, más la reducción opcional a raíz (Snowball, memorizada por token).
+    Con stem registra las formas vistas de cada raíz para poder mostrarlas."""
+
+    def __init__(self, stop_words, stem: bool = False):
+        self.stop = frozenset(stop_words)
+        self.stem = stem
+        self.formas = {}
+
+    def __call__(self, doc: str):
+        toks = [t for t in _TOKEN.findall(doc.lower()) if t not in self.stop]
+        if self.stem:
+            raices = [raiz(t) for t in toks]
+            for r, t in zip(raices, toks):
+                self.formas.setdefault(r, Counter())[t] += 1
+            toks = raices
+        return toks + [f"{a} {b}" for a, b in zip(toks, toks[1:])]
+
+    def etiquetas(self, vocab) -> np.ndarray | None:
+        if not self.stem:
+            return None
+        forma = etiquetas_raices(self.formas)
+        return np.asarray([" ".join(forma.get(p, p) for p in t.split(" ")) for t in vocab], dtype=object)
+
+
+def ajustar_dtm(s: pd.Series, stop_words, textos: pd.Series | None = None, stem: bool = False) -> MatrizTerminos:
+    """Ajusta un único CountVectorizer (1,2)-gramas sobre la columna completa
+    (`textos`: corpus ya normalizado de `s`, si se tiene; `stem`: agrupar por raíz)."""
+    from sklearn.feature_extraction.text import CountVectorizer
+    textos = corpus(s) if textos is None else textos
+    analizador = Analizador(stop_words, stem=stem)
+    vect = CountVectorizer(analyzer=analizador, min_df=1)
+    try:
+        X = vect.fit_transform(textos).tocsr()
+        vocab = np.asarray(vect.get_feature_names_out(), dtype=object)
+    except ValueError:             # vocabulario vacío (sólo stopwords o sin texto)
+        X = sparse.csr_matrix((len(textos), 0), dtype="int64")
+        vocab = np.empty(0, dtype=object)
+    return MatrizTerminos(textos=textos, X=X, vocab=vocab, n=_n_palabras(vocab),
+                          etiquetas=analizador.etiquetas(vocab), stem=stem)
+
+
+# ---------- Caché persistente (junto a los datos) ----------
+def _clave(*partes) -> str:
+    return hashlib.sha1("|".join(map(str, (_FORMATO,) + partes)).encode("utf-8")).hexdigest()
+
+
+def _escribir(path: str, escribir):
+    """Escritura atómica: archivo temporal + os.replace (lectores nunca ven medio archivo)."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    escribir(tmp)
+    os.replace(tmp, path)
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:          # otra sesión lo borró entre el glob y el stat
+        return 0.0
+
+
+def _podar(cache_dir: str, max_archivos: int = CACHE_MAX_ARCHIVOS):
+    """Borra los archivos terminados más antiguos por encima de max_archivos. Sólo mira
+    *.json / *.npz: los <path>.<pid>.tmp son escrituras en curso de otra sesión."""
+    archivos = [f for ext in ("*.json", "*.npz") for f in glob.glob(os.path.join(cache_dir, ext))]
+    archivos.sort(key=_mtime)
+    for f in archivos[:max(len(archivos) - max_archivos, 0)]:
+        try:
+            os.remove(f)
+        except OSError:
+            pass
+
+
+def serie_en_disco(s: pd.Series, fn, nombre: str, cache_dir: str | None = CACHE_DIR,
+                   _huella: str | None = None) -> pd.Series:
+    """fn(s) -> Serie de texto, leída de `cache_dir/<hash>.json` si ya se calculó para
+    este contenido de columna (cache_dir=None desactiva la caché)."""
+    if not cache_dir:
+        return fn(s)
+    path = os.path.join(cache_dir, _clave(nombre, _huella or huella(s)) + ".json")
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return pd.read_json(io.StringIO(f.read()), typ="series", orient="split",
+                                dtype=False, convert_dates=False).astype(str)
+    out = fn(s)
+    os.makedirs(cache_dir, exist_ok=True)
+    _escribir(path, lambda tmp: out.to_json(tmp, orient="split", force_ascii=False))
+    _podar(cache_dir)
+    return out
+
+
+def _guardar_npz(X, path):
+    with open(path, "wb") as f:
+        sparse.save_npz(f, X, compressed=True)
+
+
+def _guardar_json(obj, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+
+
+def dtm_en_disco(s: pd.Series, stop_words, cache_dir: str | None = CACHE_DIR,
+                 stem: bool = False) -> MatrizTerminos:
+    """ajustar_dtm con persistencia: matriz en `<hash>.npz` (comprimida) y vocabulario
+    (+ etiquetas si stem) en `<hash>.vocab.json`; el corpus normalizado se guarda aparte
+    con serie_en_disco."""
+    if not cache_dir:
+        return ajustar_dtm(s, stop_words, stem=stem)
+    h = huella(s)
+    textos = serie_en_disco(s, corpus, "corpus", cache_dir, _huella=h)
+    base = os.path.join(cache_dir, _clave("dtm", h, stem, "\n".join(sorted(stop_words))))
+    if os.path.exists(base + ".npz") and os.path.exists(base + ".vocab.json"):
+        X = sparse.load_npz(base + ".npz").tocsr()
+        with open(base + ".vocab.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        vocab = np.asarray(meta["vocab"], dtype=object)
+        etiquetas = np.asarray(meta["etiquetas"], dtype=object) if meta.get("etiquetas") is not None else None
+        return MatrizTerminos(textos=textos, X=X, vocab=vocab, n=_n_palabras(vocab), etiquetas=etiquetas,
+                              stem=stem)
+    d = ajustar_dtm(s, stop_words, textos=textos, stem=stem)
+    meta = {"vocab": d.vocab.tolist(), "etiquetas": None if d.etiquetas is None else d.etiquetas.tolist()}
+    _escribir(base + ".npz", lambda tmp: _guardar_npz(d.X, tmp))
+    _escribir(base + ".vocab.json", lambda tmp: _guardar_json(meta, tmp))
+    _podar(cache_dir)
+    return d
@@ -0,0 +1,149 @@
+# Motor de validación: reglas de rango, salto (skip) y consistencia evaluadas como
+# expresiones vectorizadas sobre todo el DataFrame, en una sola pasada.
+import numpy as np
+import pandas as pd
+
+from .codebook import code_key, match_variable
+from .geo import AREA_ESTUDIO, coords, en_area
+from .tabulados import MISSING_LABELS
+
+# Valores que en la exportación equivalen a "pregunta no contestada": los faltantes de
+# los tabulados, nulos pasados a texto y los "0"/"No" con que se exportan las casillas
+# sin marcar
+_NO_ANSWER = MISSING_LABELS | {"nan", "NaT", "None", "0", "0.0", "No"}
+
+BLOQUE_F = ["p025", "p026", "p027", "p028", "p029", "p030", "p031", "p032"]
+BLOQUE_C = ["p009a", "p009b", "p010", "p011", "sexom", "sexoh", "sexonh", "sexonm"]
+COMPOSICION = ["sexom", "sexoh", "sexonh", "sexonm"]
+
+
+def _by_category(s: pd.Series, fn) -> np.ndarray:
+    """Evalúa fn(categorías:str) -> bool una vez por valor distinto y expande por códigos."""
+    cat = s.astype("category")
+    cats = pd.Series(cat.cat.categories.astype(str))
+    flags = np.append(np.asarray(fn(cats), dtype=bool), False)  # código -1 (NaN) -> False
+    return flags[cat.cat.codes.to_numpy()]
+
+
+def es_negocio(s: pd.Series) -> np.ndarray:
+    return _by_category(s, lambda c: c.str.lower().str.contains("negocio|mixto|ambos", regex=True))
+
+
+def es_vivienda(s: pd.Series) -> np.ndarray:
+    return _by_category(s, lambda c: c.str.lower().str.contains("vivienda|mixto|ambos", regex=True))
+
+
+def contestada(s: pd.Series) -> np.ndarray:
+    """True donde hay respuesta. Las reglas de salto tratan un "No" explícito (y 0) como
+    no contestada: S01/S02 sólo cuentan un bloque si alguna pregunta tiene otro valor."""
+    if pd.api.types.is_numeric_dtype(s):
+        return (s.notna() & (s != 0)).to_numpy()
+    return _by_category(s, lambda c: ~c.str.strip().isin(_NO_ANSWER))
+
+
+def _num(df, col):
+    return pd.to_numeric(df[col], errors="coerce")
+
+
+def _rango(col, lo, hi):
+    def f(df, m):
+        x = _num(df, m[col])
+        return ((x < lo) | (x > hi)).to_numpy()
+    return f
+
+
+def _composicion(df, m):
+    parts = pd.concat([_num(df, m[c]) for c in COMPOSICION], axis=1)
+    total = _num(df, m["p011"])
+    ok = parts.notna().all(axis=1) & total.notna()
+    return (ok & (parts.sum(axis=1) != total)).to_numpy()
+
+
+def _formales(df, m):
+    return (_num(df, m["p030"]) > _num(df, m["p029"])).to_numpy()
+
+
+def _gps(area):
+    def f(df, m):
+        lat, lon = coords(df, m["lat"], m["lon"], area)
+        return ~en_area(lat, lon, area)
+    return f
+
+
+def _skip(bloque, es_objetivo):
+    def f(df, m):
+        cols = [m[v] for v in bloque if v in m]
+        resp = np.zeros(len(df), dtype=bool)
+        for c in cols:
+            resp |= contestada(df[c])
+        return resp & ~es_objetivo(df[m["p004"]])
+    return f
+
+
+def reglas(area: dict = AREA_ESTUDIO):
+    """Lista de reglas: (id, tipo, descripción, roles requeridos, función(df, m) -> máscara)."""
+    return [
+        ("R01", "rango", "p011 tamaño del hogar fuera de [1, 30]", ["p011"], _rango("p011", 1, 30)),
+        ("R02", "rango", "p029 trabajadores fuera de [0, 500]", ["p029"], _rango("p029", 0, 500)),
+        ("R03", "rango", "p030 formales fuera de [0, 500]", ["p030"], _rango("p030", 0, 500)),
+        ("R04", "rango", "p009a espacios habitables fuera de [0, 50]", ["p009a"], _rango("p009a", 0, 50)),
+        ("R05", "rango", "p009b niveles fuera de [0, 10]", ["p009b"], _rango("p009b", 0, 10)),
+        ("S01", "salto", "Bloque F contestado en estructura que no es negocio/mixto", ["p004"],
+         _skip(BLOQUE_F, es_negocio)),
+        ("S02", "salto", "Bloque C contestado en estructura que no es vivienda/mixto", ["p004"],
+         _skip(BLOQUE_C, es_vivienda)),
+        ("K01", "consistencia", "Mujeres + hombres + niños + niñas ≠ p011", COMPOSICION + ["p011"], _composicion),
+        ("K02", "consistencia", "p030 formales > p029 trabajadores", ["p030", "p029"], _formales),
+        ("K03", "consistencia", "GPS faltante o fuera del área de estudio", ["lat", "lon"], _gps(area)),
+    ]
+
+
+def _reglas_codebook(df, labels):
+    """Una regla por variable del Codebook: valor que no es código ni etiqueta conocida."""
+    out = []
+    for var, codes in labels.items():
+        col = match_variable(var, df.columns)
+        if col is None:
+            continue
+        allowed = set(codes) | set(codes.values())
+        def f(df, m, col=col, allowed=allowed):
+            return _by_category(df[col], lambda c: ~c.map(code_key).isin(allowed) & ~c.isin(allowed))
+        out.append((f"CB_{col}", "codebook", f"{col}: valor fuera del Codebook", [], f))
+    return out
+
+
+def validar(df: pd.DataFrame, m: dict, labels: dict | None = None, area: dict = AREA_ESTUDIO):
+    """Evalúa todas las reglas aplicables. m = {rol: columna} (p.ej. {"p011": "p011"}).
+
+    Devuelve (resumen, incidencias):
+    - resumen: regla, tipo, descripcion, n, % (reglas sin columnas mapeadas se omiten)
+    - incidencias: una fila por (registro, regla) violada
+    """
+    m = {k: v for k, v in m.items() if v and v != "<ninguna>" and v in df.columns}
+    todas = reglas(area) + _reglas_codebook(df, labels or {})
+    ids, info, masks = [], [], []
+    for rid, tipo, desc, req, fn in todas:
+        if any(r not in m for r in req):
+            continue
+        ids.append(rid); info.append((rid, tipo, desc))
+        masks.append(np.asarray(fn(df, m), dtype=bool))
+
+    if not masks:
+        return (pd.DataFrame(columns=["regla", "tipo", "descripcion", "n", "%"]),
+                pd.DataFrame(columns=["fila", "regla", "descripcion"]))
+
+    M = np.column_stack(masks)                       # registros × reglas
+    n = M.sum(axis=0)
+    resumen = pd.DataFrame(info, columns=["regla", "tipo", "descripcion"])
+    resumen["n"] = n
+    resumen["%"] = (n / max(len(df), 1) * 100).round(1)
+
+    rows, rules = np.nonzero(M)
+    incid = pd.DataFrame({"fila": df.index.to_numpy()[rows],
+                          "regla": np.asarray(ids, dtype=object)[rules],
+                          "descripcion": resumen["descripcion"].to_numpy()[rules]})
+    if "sector" in m:
+        incid.insert(1, "sector", df[m["sector"]].to_numpy()[rows])
+    if "p004" in m:
+        incid.insert(1, "p004", df[m["p004"]].to_numpy()[rows])
+    return resumen, incid
@@ -0,0 +1,156 @@
+# Diferencias entre versiones del dataset mediante hashes vectorizados por fila y por celda.
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from .tabulados import build_table, plan_tables, table_columns
+
+VERSIONES = {
+    "respuestas": "data/respuestas.xlsx",
+    "respuestas1": "data/respuestas1.xlsx",
+    "respuestas_corregidas": "respuestas_corregidas.xlsx",
+}
+CLAVES_DEFAULT = ["interview__id", "id_e", "id_h", "id_v"]
+
+
+def versiones_disponibles() -> dict:
+    return {k: p for k, p in VERSIONES.items() if os.path.exists(p)}
+
+
+_NA_HASH = np.uint64(0x5EED5EED5EED5EED)
+
+
+def huella(s: pd.Series | pd.DataFrame) -> str:
+    """Hash del contenido (e índice) de una columna, o de varias si se pasa un DataFrame:
+    identifica la versión del dataset (clave de las cachés de los tableros)."""
+    return hashlib.sha1(pd.util.hash_pandas_object(s, index=True).to_numpy().tobytes()).hexdigest()
+
+
+def col_hash(s: pd.Series) -> np.ndarray:
+    """Hash uint64 por celda. Numéricos como float64 (1 == 1.0); el resto se factoriza y
+    sólo se hashean los valores distintos (como texto), expandidos por código."""
+    if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        x = s.to_numpy(dtype="float64", na_value=np.nan)
+        h = pd.util.hash_array(x)
+        h[np.isnan(x)] = _NA_HASH
+        return h
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    uh = pd.util.hash_array(np.asarray(uniques, dtype=object).astype(str).astype(object))
+    return np.append(uh, _NA_HASH)[codes]
+
+
+def cell_hashes(df: pd.DataFrame, cols) -> np.ndarray:
+    """Matriz uint64 registros × columnas con el hash de cada celda (columna a columna)."""
+    if not len(cols):
+        return np.zeros((len(df), 0), dtype="uint64")
+    return np.column_stack([col_hash(df[c]) for c in cols])
+
+
+def row_hashes(H: np.ndarray) -> np.ndarray:
+    """Combina los hashes de celda en un hash por fila (sin volver a recorrer los datos)."""
+    if H.shape[1] == 0:
+        return np.zeros(H.shape[0], dtype="uint64")
+    pesos = (np.arange(1, H.shape[1] + 1, dtype="uint64") * np.uint64(0x9E3779B97F4A7C15))
+    with np.errstate(over="ignore"):
+        return np.bitwise_xor.reduce(H * pesos, axis=1)
+
+
+def record_keys(df: pd.DataFrame, keys) -> np.ndarray:
+    """Clave uint64 por registro: hash de las columnas clave combinado con el nº de
+    ocurrencia (desempata duplicados); sin claves, la posición de la fila."""
+    keys = [k for k in (keys or []) if k in df.columns]
+    if not keys:
+        return np.arange(len(df), dtype="uint64")
+    h = row_hashes(cell_hashes(df, keys))
+    occ = pd.Series(h).groupby(h, sort=False).cumcount().to_numpy().astype("uint64")
+    return row_hashes(np.column_stack([h, pd.util.hash_array(occ)]))
+
+
+def _registros(df, pos, keys):
+    cols = [k for k in (keys or []) if k in df.columns]
+    t = df.iloc[pos][cols].copy() if cols else pd.DataFrame(index=df.index[pos])
+    t.insert(0, "fila", df.index.to_numpy()[pos])
+    return t.reset_index(drop=True)
+
+
+def diff_versions(a: pd.DataFrame, b: pd.DataFrame, keys=None) -> dict:
+    """Compara dos versiones. Devuelve dict con:
+    agregados / eliminados / modificados (registros: fila + columnas clave),
+    cambios_col (columna, n), cols_nuevas / cols_eliminadas, cols_cambiadas (set),
+    detalle (fila_a, fila_b, columna, antes, despues; máx. 5000 celdas)."""
+    ka, kb = record_keys(a, keys), record_keys(b, keys)
+    comunes_cols = [c for c in a.columns if c in b.columns]
+
+    # emparejamiento por tabla hash de claves (sin comparar pares)
+    pos_b = pd.Index(kb).get_indexer(ka)
+    en_b = pos_b >= 0
+    pa, pb = np.flatnonzero(en_b), pos_b[en_b]
+    en_a = np.zeros(len(b), dtype=bool)
+    en_a[pb] = True
+
+    Ha = cell_hashes(a.iloc[pa], comunes_cols)
+    Hb = cell_hashes(b.iloc[pb], comunes_cols)
+    D = Ha != Hb                                  # celdas cambiadas (registros comunes)
+    filas_mod = (row_hashes(Ha) != row_hashes(Hb)) | D.any(axis=1)
+
+    n_col = D.sum(axis=0)
+    cambios = (pd.DataFrame({"columna": comunes_cols, "n": n_col})
+               .query("n > 0").sort_values("n", ascending=False).reset_index(drop=True))
+
+    r, c = np.nonzero(D)
+    r, c = r[:5000], c[:5000]
+    cols_arr = np.asarray(comunes_cols, dtype=object)
+    detalle = pd.DataFrame({
+        "fila_a": a.index.to_numpy()[pa[r]],
+        "fila_b": b.index.to_numpy()[pb[r]],
+        "columna": cols_arr[c],
+        "antes": [a.iat[pa[i], a.columns.get_loc(cols_arr[j])] for i, j in zip(r, c)],
+        "despues": [b.iat[pb[i], b.columns.get_loc(cols_arr[j])] for i, j in zip(r, c)],
+    })
+    return {
+        "agregados": _registros(b, np.flatnonzero(~en_a), keys),
+        "eliminados": _registros(a, np.flatnonzero(~en_b), keys),
+        "modificados": _registros(b, pb[filas_mod], keys),
+        "cambios_col": cambios,
+        "cols_nuevas": [c for c in b.columns if c not in a.columns],
+        "cols_eliminadas": [c for c in a.columns if c not in b.columns],
+        "cols_cambiadas": set(cambios["columna"]),
+        "detalle": detalle,
+    }
+
+
+def _long_counts(t: pd.DataFrame) -> pd.Series:
+    """Tabla (vc_percent o parte 'n' de crosstab_pct) -> Serie de conteos indexada por celda."""
+    if t is None or t.empty:
+        return pd.Series(dtype="float64")
+    if "__tipo__" in t.columns:
+        t = t[t["__tipo__"] == "n"].drop(columns=["__tipo__"])
+        ids = [t.columns[0]] + (["__grupo__"] if "__grupo__" in t.columns else [])
+        long = t.melt(id_vars=ids, var_name="__col__", value_name="n")
+        ids = ids + ["__col__"]
+    else:
+        ids = [c for c in t.columns if c not in ("n", "%")]
+        long = t
+    idx = long[ids].astype(str).agg(" | ".join, axis=1)
+    return pd.Series(long["n"].to_numpy(dtype="float64"), index=idx).groupby(level=0).sum()
+
+
+def tables_shift(a: pd.DataFrame, b: pd.DataFrame, m: dict, diff: dict, by: str | None = None) -> dict:
+    """Cambio en las tablas del plan entre versiones. Sólo recalcula las tablas cuyas
+    columnas cambiaron; si hay registros agregados/eliminados, todas pueden moverse."""
+    todas = bool(len(diff["agregados"]) or len(diff["eliminados"]))
+    tocadas = diff["cols_cambiadas"] | set(diff["cols_nuevas"]) | set(diff["cols_eliminadas"])
+    cache_a, cache_b, out = {}, {}, {}
+    for entry in plan_tables(m):
+        if not todas and not (table_columns(entry, m) & tocadas):
+            continue
+        na = _long_counts(build_table(a, entry, m, by=by, _cache=cache_a))
+        nb = _long_counts(build_table(b, entry, m, by=by, _cache=cache_b))
+        t = pd.concat([na.rename("n_a"), nb.rename("n_b")], axis=1).fillna(0)
+        t["Δn"] = t["n_b"] - t["n_a"]
+        t = t[t["Δn"] != 0]
+        if not t.empty:
+            out[entry[0]] = t.rename_axis("celda").reset_index()
+    return out
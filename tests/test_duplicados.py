@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from encuesta.duplicados import detectar, resolver
+
+RESP = ["p004", "p005"]
+
+
+def _base():
+    # 13.4866, -89.3223 está dentro del área de estudio; 1e-6° ≈ 0.1 m
+    return pd.DataFrame({
+        "interview__id": ["a", "a", "a", "b", "c"],
+        "id_e": [1, 2, 3, 1, 1],
+        "SECTOR": ["Punta Roca"] * 5,
+        "p004": ["Vivienda", "Vivienda", "Vivienda", "Negocio", "Negocio"],
+        "p005": ["Bueno", "Bueno", "Bueno", "Malo", "Malo"],
+        "lat": [13.486600, 13.486601, 13.486602, 13.490000, 13.490001],
+        "lon": [-89.322300, -89.322301, -89.322302, -89.330000, -89.330001],
+    })
+
+
+def _cercanos(df, **kw):
+    return detectar(df, [], "lat", "lon", "SECTOR", RESP, 5.0, **kw)
+
+
+def test_mismo_envio_no_es_duplicado():
+    df = _base()
+    g = _cercanos(df, envio_col="interview__id")
+    # sólo el par de envíos distintos (b, c); las tres estructuras del envío "a" se conservan
+    assert sorted(g["fila"]) == [3, 4]
+    limpio, n = resolver(df, g, "conservar_primero")
+    assert n == 1
+    assert list(limpio.index) == [0, 1, 2, 3]
+
+
+def test_sin_columna_de_envio_empareja_todo():
+    g = _cercanos(_base())
+    assert sorted(g["fila"]) == [0, 1, 2, 3, 4]
+
+
+def test_respuestas_clave_vacias_no_coinciden():
+    df = _base()
+    df.loc[3, RESP] = [np.nan, "NS/NR"]
+    df.loc[4, RESP] = ["(Sin dato)", np.nan]
+    g = _cercanos(df, envio_col="interview__id")
+    assert g.empty